@@ -1,13 +1,16 @@
+import time
 from datetime import datetime, timedelta
 from functools import wraps
+from hmac import compare_digest
 
-import bcrypt
 import jwt
-from database import UserAccount, db
+from cache import auth_cache, invalidate_user
+from database import UserAccount, after_commit, commit, db
 from flask import Blueprint, current_app, g, jsonify, request
 from flask_cors import CORS
+from passwords import HasherBusy, hasher
 
-from logs.Logger import log_access
+from logs.Logger import log_access, log_debug
 
 auth_ep = Blueprint('auth_ep', __name__, url_prefix='/api/auth')
 CORS(auth_ep)
@@ -20,35 +23,42 @@ def register():
     Validates the payload and creates a new user account in the database.
     '''
     if request.method != 'POST':
-        print('[!] Invalid request method')
+        log_debug('[!] Invalid request method')
         return jsonify({'error': 'Method not allowed'}), 405
 
     data = request.get_json()
 
     if not data:
-        print('[!] Invalid request body')
+        log_debug('[!] Invalid request body')
         return jsonify({'error': 'Invalid data'}), 400
 
     if not data.get('email') or not data.get('password') or not data.get(
             'first_name') or not data.get('last_name') or not data.get(
                 'education_level') or not data.get(
                     'profile_type') or not data.get('handle'):
-        print('[!] Invalid request body')
+        log_debug('[!] Invalid request body')
         return jsonify({'error': 'Missing data'}), 400
 
+    if is_admin_type(data.get('profile_type')):
+        log_debug('[!] Admin accounts cannot be registered')
+        return jsonify({'error': 'Invalid profile type'}), 400
+
     user = UserAccount.query.filter_by(email=data.get('email').lower()).first()
     if user:
-        print('[!] User already exists')
+        log_debug('[!] User already exists')
         return jsonify({'error': 'User already exists'}), 400
     
     user = UserAccount.query.filter_by(
-        handle=data.get('handle')).first()
+        handle=data.get('handle').lower()).first()
     if user:
-        print('[!] Vanity name already exists')
+        log_debug('[!] Vanity name already exists')
         return jsonify({'error': 'Handle already in use'}), 400
 
-    pw_hash = bcrypt.hashpw(
-        data.get('password').encode('utf-8'), bcrypt.gensalt())
+    try:
+        pw_hash = hasher.hash(data.get('password'))
+    except HasherBusy:
+        log_debug('[!] Password hashing queue is full')
+        return _busy_response()
 
     user = UserAccount(
         first_name=data.get('first_name').capitalize(),
@@ -63,9 +73,9 @@ def register():
     user.updated_at = datetime.now()
 
     db.session.add(user)
-    db.session.commit()
+    commit()
 
-    print('[+] User created')
+    log_debug('[+] User created')
     return jsonify({'success': 'User created'}), 201
 
 
@@ -76,35 +86,58 @@ def login():
     Verifies payload credentials against database and returns jwt if valid
     '''
     if request.method != 'POST':
-        print('[!] Invalid request method')
+        log_debug('[!] Invalid request method')
         return jsonify({'error': 'Method not allowed'}), 405
 
     data = request.get_json()
     if not data:
-        print('[!] Invalid request body')
+        log_debug('[!] Invalid request body')
         return jsonify({'error': 'Invalid data'}), 400
 
     if not data.get('email') or not data.get('password'):
-        print('[!] Invalid request body')
+        log_debug('[!] Invalid request body')
         return jsonify({'error': 'Missing data'}), 400
 
     user = UserAccount.query.filter_by(email=data.get('email').lower()).first()
 
     if not user:
-        print('[!] User does not exist')
+        log_debug('[!] User does not exist')
         return jsonify({'error': 'Invalid credentials'}), 401
 
-    if not user.check_password(data.get('password')):
-        print('[!] Invalid password')
-        return jsonify({'error': 'Invalid credentials'}), 401
+    try:
+        if not user.check_password(data.get('password')):
+            log_debug('[!] Invalid password')
+            return jsonify({'error': 'Invalid credentials'}), 401
+    except HasherBusy:
+        log_debug('[!] Password hashing queue is full')
+        return _busy_response()
+
+    # Upgrade hashes made with an outdated cost factor while the plain
+    # password is at hand. Not worth failing the login over if busy.
+    if hasher.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = hasher.hash(data.get('password'))
+            commit()
+            after_commit(invalidate_user, user.id)
+        except HasherBusy:
+            pass
 
     jwt = issue_jwt(user)
-    log_access(f'{user} logged in from {request.remote_addr}')
+    log_access(f'{user} logged in',
+               user_id=user.id,
+               remote_addr=request.remote_addr)
 
-    print(f'[+] User logged in: {user}')
+    log_debug(f'[+] User logged in: {user}')
     return jsonify({'success': 'User logged in', 'token': jwt}), 200
 
 
+def _busy_response():
+    '''Response for requests rejected because password hashing is saturated.'''
+    return jsonify({'error': 'Server busy, try again later'}), 503, {
+        'Retry-After': '1'
+    }
+
+
 def issue_jwt(user: UserAccount) -> str:
     '''Issues a json web token for uses in bearer authorization.'''
     payload = {
@@ -119,19 +152,37 @@ def issue_jwt(user: UserAccount) -> str:
 
 
 def get_user_by_jwt(token) -> UserAccount or None:
-    '''Returns UserAccount object if token is valid.'''
+    '''
+    Returns UserAccount object if token is valid.
+    Valid tokens are cached by signature until they expire, or for at most
+    `AUTH_CACHE_TTL` seconds, so repeated requests skip both the jwt decode
+    and the user lookup.
+    '''
+    signature = token.rsplit('.', 1)[-1]
+    cached = auth_cache.get(signature)
+    if cached is not None and compare_digest(cached[1], token):
+        return db.session.merge(cached[2], load=False)
+
     try:
         payload = jwt.decode(token.encode('utf-8'),
                              current_app.config['SECRET_KEY'],
                              algorithms=['HS256'])
-
-        user = UserAccount.query.get(payload['sub'])
-        if user: print(f'[?] Login successful by {user} via JWT')
-        return user
     except jwt.exceptions.InvalidTokenError as e:
-        print('[!] JWT invalid: ', e)
+        log_debug(f'[!] JWT invalid: {e}')
+        return None
+
+    user = UserAccount.query.get(payload['sub'])
+    if not user:
         return None
 
+    # Cache a detached copy and hand the request its own attached instance,
+    # so later requests never share session state with this one.
+    db.session.expunge(user)
+    ttl = min(payload['exp'] - time.time(),
+              current_app.config.get('AUTH_CACHE_TTL', 300))
+    auth_cache.set(signature, (user.id, token, user), ttl=ttl)
+    return db.session.merge(user, load=False)
+
 
 def login_required(func):
     '''
@@ -142,17 +193,47 @@ def login_required(func):
     @wraps(func)
     def wrapped(*args, **kwargs):
         if not request.headers.get('Authorization'):
-            print('[!] Missing authorization header')
+            log_debug('[!] Missing authorization header')
             return jsonify({'error': 'Missing authorization header'}), 401
         if not request.headers.get('Authorization').startswith('Bearer '):
-            print('[!] Invalid authorization header')
+            log_debug('[!] Invalid authorization header')
             return jsonify({'error': 'Invalid token format'}), 401
         token = request.headers.get('Authorization').split(' ')[1]
         user = get_user_by_jwt(token)
         if not user:
-            print('[!] Invalid authorization header')
+            log_debug('[!] Invalid authorization header')
             return jsonify({'error': 'Invalid authorization header'}), 401
         g.user = user
         return func(*args, **kwargs)
 
     return wrapped
+
+
+def is_admin_type(account_type) -> bool:
+    '''
+    Whether `account_type` names `ADMIN_ACCOUNT_TYPE`, ignoring case, since
+    registration and imports normalize the case of account types.
+    '''
+    return str(account_type).casefold() == current_app.config.get(
+        'ADMIN_ACCOUNT_TYPE', 'Admin').casefold()
+
+
+def is_admin(user) -> bool:
+    '''Admins are users whose `account_type` is `ADMIN_ACCOUNT_TYPE`.'''
+    return user is not None and is_admin_type(user.account_type)
+
+
+def admin_required(func):
+    '''
+    Decorator for admin only endpoints. Goes below `login_required`, which
+    assigns `g.user`.
+    '''
+
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        if not is_admin(g.user):
+            log_debug('[!] Admin access required')
+            return jsonify({'error': 'Admin access required'}), 403
+        return func(*args, **kwargs)
+
+    return wrapped
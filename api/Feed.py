@@ -0,0 +1,69 @@
+from database import PostModel, TimelineEntry
+from flask import Blueprint, g, jsonify, request
+from flask_cors import CORS
+from serialization import InvalidFields
+
+from .Authorization import login_required
+from .Pagination import (PaginationError, apply_keyset, encode_cursor,
+                         get_cursor, get_page_limit)
+from .Responses import conditional_json, get_fields, posts_etag
+
+feed_ep = Blueprint("feed_ep", __name__, url_prefix="/api/user/feed")
+CORS(feed_ep)
+
+
+@feed_ep.route("", methods=["GET"])
+@login_required
+def get_feed():
+    '''
+    Read a page of the currently logged in user's home feed, newest first.
+    Accepts `cursor` and `limit` query parameters like the post listings.
+    '''
+    if request.method != "GET":
+        return jsonify({"message": "Method not allowed"}), 405
+
+    try:
+        fields = get_fields(PostModel)
+        limit = get_page_limit()
+        cursor = get_cursor()
+    except (InvalidFields, PaginationError) as e:
+        return jsonify({"message": str(e)}), 400
+
+    # Precomputed timeline, plus posts from friends too popular to fan out
+    # on write. Each source contributes at most one page worth of rows.
+    candidates = {
+        entry.post_id: entry.created_at
+        for entry in apply_keyset(
+            TimelineEntry.query.filter_by(user_id=g.user.id),
+            TimelineEntry.created_at, TimelineEntry.post_id,
+            cursor).limit(limit + 1)
+    }
+    high_fanout = TimelineEntry.high_fanout_friend_ids(g.user.id)
+    if high_fanout:
+        for post_id, created_at in apply_keyset(
+                PostModel.query.with_entities(
+                    PostModel.id, PostModel.created_at).filter(
+                        PostModel.owner_id.in_(high_fanout)),
+                PostModel.created_at, PostModel.id, cursor).limit(limit + 1):
+            candidates[post_id] = created_at
+
+    page = sorted(candidates.items(),
+                  key=lambda item: (item[1], item[0]),
+                  reverse=True)[:limit + 1]
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1][1], page[-1][0])
+
+    posts = {
+        post.id: post
+        for post in PostModel.query.filter(
+            PostModel.id.in_([post_id for post_id, _ in page]))
+    }
+    posts = [posts[post_id] for post_id, _ in page if post_id in posts]
+    return conditional_json(
+        posts_etag(posts, g.user.id, next_cursor), lambda: {
+            "posts":
+            PostModel.to_json_many(posts, viewer_id=g.user.id, fields=fields),
+            "next_cursor": next_cursor
+        })
@@ -0,0 +1,68 @@
+import mimetypes
+import re
+
+from flask import Blueprint, abort, current_app, request, send_file
+from storage.Media import media
+
+media_ep = Blueprint("media_ep", __name__, url_prefix="/media")
+
+# `<sha256>.<ext>` originals and `<sha256>-<variant>.webp` variants
+MEDIA_KEY = re.compile(r'^[0-9a-f]{64}(-[0-9a-z]+)?\.[0-9a-z]+$')
+
+# Not in every platform's mime.types
+mimetypes.add_type('image/webp', '.webp')
+
+
+def _cache_headers(response, key):
+    '''
+    Marks the response as cacheable forever. Keys are content hashes, so a
+    key's bytes never change and the key itself is a strong validator.
+    '''
+    response.set_etag(key.rsplit('.', 1)[0])
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['MEDIA_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+
+
+def _offloaded(key):
+    '''
+    Returns an empty response telling the front-end server to send the blob
+    itself, so no app worker is held for the transfer.
+    '''
+    mode = current_app.config['MEDIA_SENDFILE']
+    response = current_app.response_class(
+        mimetype=mimetypes.guess_type(key)[0] or 'application/octet-stream')
+    if mode == 'x-accel-redirect':
+        response.headers['X-Accel-Redirect'] = (
+            current_app.config['MEDIA_ACCEL_PREFIX'].rstrip('/') + '/' + key)
+    elif mode == 'x-sendfile':
+        response.headers['X-Sendfile'] = media.backend.local_path(key)
+    else:
+        raise ValueError(f'Unknown MEDIA_SENDFILE mode: {mode}')
+    _cache_headers(response, key)
+    # The server answers ranges itself; only revalidation is handled here
+    return response.make_conditional(request)
+
+
+@media_ep.route("/<key>", methods=["GET", "HEAD"])
+def get_media(key):
+    '''
+    Serves a stored media blob with immutable caching, a strong ETag,
+    `304 Not Modified` revalidation and byte-range requests.
+    '''
+    if not MEDIA_KEY.match(key) or not media.backend.exists(key):
+        abort(404)
+
+    if current_app.config['MEDIA_SENDFILE']:
+        return _offloaded(key)
+
+    path = media.backend.local_path(key)
+    response = send_file(path or media.backend.open(key),
+                         mimetype=mimetypes.guess_type(key)[0],
+                         conditional=True,
+                         etag=key.rsplit('.', 1)[0],
+                         max_age=current_app.config['MEDIA_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
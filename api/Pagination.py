@@ -0,0 +1,112 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import and_, or_
+
+
+class PaginationError(ValueError):
+    '''Raised when the `cursor` or `limit` query parameters are invalid.'''
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    '''Encodes a `(created_at, id)` position as an opaque cursor token.'''
+    raw = json.dumps([created_at.isoformat(), row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str) -> tuple:
+    '''Decodes a cursor token produced by `encode_cursor`.'''
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise PaginationError('Invalid cursor')
+
+
+def encode_offset(offset: int) -> str:
+    '''Encodes a row offset as an opaque cursor token, for ranked results.'''
+    raw = json.dumps(['offset', offset]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def get_offset(maximum: int = None) -> int:
+    '''
+    Returns the offset in the `cursor` query parameter produced by
+    `encode_offset`, or 0. Offsets past `maximum` are rejected.
+    '''
+    token = request.args.get('cursor')
+    if not token:
+        return 0
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        kind, offset = json.loads(base64.urlsafe_b64decode(padded))
+        offset = int(offset)
+    except (ValueError, TypeError):
+        raise PaginationError('Invalid cursor')
+    if kind != 'offset' or offset < 0 or (maximum is not None
+                                          and offset > maximum):
+        raise PaginationError('Invalid cursor')
+    return offset
+
+
+def get_page_limit() -> int:
+    '''Returns the `limit` query parameter, clamped to `PAGE_MAX_LIMIT`.'''
+    default = current_app.config.get('PAGE_DEFAULT_LIMIT', 20)
+    maximum = current_app.config.get('PAGE_MAX_LIMIT', 100)
+    limit = request.args.get('limit', default)
+    try:
+        limit = int(limit)
+    except (ValueError, TypeError):
+        raise PaginationError('Invalid limit')
+    if limit < 1:
+        raise PaginationError('Invalid limit')
+    return min(limit, maximum)
+
+
+def apply_keyset(query, created_col, id_col, cursor=None, descending=True):
+    '''
+    Orders `query` by `(created_col, id_col)` and, given a decoded `cursor`,
+    filters it to the rows after that position.
+    '''
+    if cursor:
+        created_at, row_id = cursor
+        if descending:
+            query = query.filter(
+                or_(created_col < created_at,
+                    and_(created_col == created_at, id_col < row_id)))
+        else:
+            query = query.filter(
+                or_(created_col > created_at,
+                    and_(created_col == created_at, id_col > row_id)))
+
+    if descending:
+        return query.order_by(created_col.desc(), id_col.desc())
+    return query.order_by(created_col.asc(), id_col.asc())
+
+
+def get_cursor() -> tuple or None:
+    '''Returns the decoded `cursor` query parameter, if any.'''
+    token = request.args.get('cursor')
+    return decode_cursor(token) if token else None
+
+
+def paginate(query, created_col, id_col, descending=True) -> tuple:
+    '''
+    Applies keyset pagination on `(created_col, id_col)` to `query` using the
+    `cursor` and `limit` request arguments.
+    Returns `(rows, next_cursor)`; `next_cursor` is `None` on the last page.
+    '''
+    limit = get_page_limit()
+    query = apply_keyset(query, created_col, id_col, get_cursor(), descending)
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_col.key),
+                                    getattr(last, id_col.key))
+    return rows, next_cursor
@@ -1,15 +1,15 @@
-import datetime
-import os
-from hashlib import md5
-from uuid import uuid4
-
-from database import PostModel, db
-from flask import Blueprint, current_app, g, jsonify, request
+from database import (PostComment, PostModel, TimelineEntry, UserAccount,
+                      after_commit, commit, db)
+from flask import Blueprint, g, jsonify, request
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from serialization import InvalidFields
+from storage.Media import InvalidMedia, media
 
-from .Authorization import login_required
-from .User import _allowed_file
+from .Authorization import is_admin, login_required
+from .Pagination import PaginationError, apply_keyset, get_cursor, paginate
+from .Responses import (conditional_json, get_fields, get_stream_format,
+                        post_etag, posts_etag, stream_json)
+from .User import _allowed_file, _can_view
 
 post_ep = Blueprint("post_ep", __name__, url_prefix="/api/user/post")
 CORS(post_ep)
@@ -29,50 +29,29 @@ def create_post():
     if "content" not in data:
         return jsonify({"message": "Missing content"}), 400
 
+    image_key = None
     if "file" in request.files:
         file = request.files["file"]
 
         if file and _allowed_file(file.filename):
-            # Generate a unique filename
-            # Format is: <md5 hash of email>-<uuid4>.<extension>
-            ext = file.filename.rsplit(".", 1)[1].lower()
-            filename = secure_filename(
-                f"{md5(g.user.email.encode('utf-9'))}-{str(uuid4().hex)}.{ext}"
-            )
-
-            file.save(
-                os.path.join(current_app.config["UPLOADS_POSTS_FOLDER"],
-                             filename))
-
-            file_uri = f"{request.host_url}static/posts/{filename}"
-
-            post = PostModel(
-                content=data["content"],
-                image_uri=file_uri,
-                location=data.get("location", None),
-                owner_id=g.user.id,
-            )
-
-            db.session.add(post)
-            db.session.commit()
-            return (
-                jsonify({
-                    "success": "Post created successfully",
-                    "post": post.tp_json()
-                }),
-                201,
-            )
+            try:
+                image_key = media.acquire(file)
+            except InvalidMedia as e:
+                return jsonify({"message": str(e)}), 400
 
     post = PostModel(content=data["content"],
                      location=data.get("location", None),
-                     owner_id=g.user.id)
+                     owner_id=g.user.id,
+                     image_uri=media.url(image_key) if image_key else None,
+                     image_key=image_key)
 
     db.session.add(post)
-    db.session.commit()
+    commit()
+    TimelineEntry.fan_out(post, g.user)
     return (
         jsonify({
             "message": "Post created successfully",
-            "post": post.to_json()
+            "post": post.to_json(owner=g.user, liked=False)
         }),
         201,
     )
@@ -81,14 +60,45 @@ def create_post():
 @post_ep.route("/", methods=["GET"])
 @login_required
 def get_all_posts():
-    ''' Read all posts in the database '''
+    '''
+    Read a page of posts, newest first.
+    Accepts `cursor` and `limit` query parameters; the response includes a
+    `next_cursor` to pass back for the following page. Admins may pass
+    `stream=ndjson` or `stream=array` to receive every post from `cursor`
+    on in a single streamed response instead.
+    '''
     if request.method != "GET":
         return jsonify({"message": "Method not allowed"}), 405
 
     # verify that post owner is connected with requesting user
 
-    return jsonify(
-        {"posts": [post.to_json() for post in PostModel.query.all()]})
+    try:
+        fields = get_fields(PostModel)
+        stream = get_stream_format()
+        if stream is None:
+            posts, next_cursor = paginate(PostModel.query,
+                                          PostModel.created_at, PostModel.id)
+        else:
+            query = apply_keyset(PostModel.query, PostModel.created_at,
+                                 PostModel.id, get_cursor())
+    except (InvalidFields, PaginationError) as e:
+        return jsonify({"message": str(e)}), 400
+
+    if stream is not None:
+        # Streams are not paged, so only admins may pull every post
+        if not is_admin(g.user):
+            return jsonify({"message": "Admin access required"}), 403
+        viewer_id = g.user.id
+        return stream_json(
+            query, lambda posts: PostModel.to_json_many(
+                posts, viewer_id=viewer_id, fields=fields), "posts", stream)
+
+    return conditional_json(
+        posts_etag(posts, g.user.id, next_cursor), lambda: {
+            "posts":
+            PostModel.to_json_many(posts, viewer_id=g.user.id, fields=fields),
+            "next_cursor": next_cursor
+        })
 
 
 @post_ep.route("/by-post/<post_id>", methods=["GET"])
@@ -98,12 +108,23 @@ def get_post_by_post_id(post_id: int):
         return jsonify({"message": "Method not allowed"}), 405
     if not post_id:
         return jsonify({"message": "Missing post id"}), 400
+    try:
+        fields = get_fields(PostModel)
+    except InvalidFields as e:
+        return jsonify({"message": str(e)}), 400
     post = PostModel.query.filter_by(id=post_id).first()
 
     if not post:
         return jsonify({"message": "Post not found"}), 404
 
-    return jsonify({"post": post.to_json()}), 200
+    owner = post.get_user()
+    return conditional_json(
+        post_etag(post, owner, g.user.id), lambda: {
+            "post":
+            post.to_json(fields,
+                         owner=owner,
+                         liked=post.is_liked_by(g.user.id))
+        })
 
 
 @post_ep.route("/by-user/<user_id>", methods=["GET"])
@@ -115,13 +136,26 @@ def get_posts_by_user_id(user_id):
     if not user_id:
         return jsonify({"message": "Missing user id"}), 400
 
-    posts = PostModel.query.filter_by(owner_id=user_id).all()
-    # verify that post owner is connected with requesting user
+    user = UserAccount.query.get(user_id)
+    if not user:
+        return jsonify({"message": "User not found"}), 404
+    if not _can_view(user):
+        return jsonify({"message": "This profile is private"}), 403
 
-    if not posts:
-        return jsonify({"posts": {}}), 200
+    try:
+        fields = get_fields(PostModel)
+        posts, next_cursor = paginate(
+            PostModel.query.filter_by(owner_id=user.id), PostModel.created_at,
+            PostModel.id)
+    except (InvalidFields, PaginationError) as e:
+        return jsonify({"message": str(e)}), 400
 
-    return jsonify({"posts": [post.to_json() for post in posts]})
+    return conditional_json(
+        posts_etag(posts, g.user.id, next_cursor), lambda: {
+            "posts":
+            PostModel.to_json_many(posts, viewer_id=g.user.id, fields=fields),
+            "next_cursor": next_cursor
+        })
 
 
 @post_ep.route("/<post_id>", methods=["DELETE"])
@@ -134,12 +168,15 @@ def delete_posy_by_id(post_id):
         return jsonify({"message": "Missing post id"}), 400
 
     post = PostModel.query.get(post_id)
+    if not post:
+        return jsonify({"message": "Post not found"}), 404
     if post.owner_id != g.user.id:
         return jsonify(
             {"message": "You are not authorized to delete this post"}), 401
 
-    db.session.delete(post)
-    db.session.commit()
+    image_key = post.image_key
+    post.delete()
+    after_commit(media.release, image_key)
     return jsonify({"message": "Post deleted successfully"}), 200
 
 
@@ -181,12 +218,13 @@ def like_post(post_id):
         return jsonify({"message": "Missing post id"}), 400
 
     post = PostModel.query.filter_by(id=post_id).first()
-    post.likes += 1
-    post.save()
+    if not post:
+        return jsonify({"message": "Post not found"}), 404
+    post.like(g.user.id)
 
     return jsonify({
         'message': 'Post liked successfully',
-        'post': post.to_json()
+        'post': post.to_json(liked=True)
     }), 200
 
 
@@ -200,12 +238,13 @@ def unlike_post(post_id):
         return jsonify({"message": "Missing post id"}), 400
 
     post = PostModel.query.filter_by(id=post_id).first()
-    post.likes -= 1
-    post.save()
+    if not post:
+        return jsonify({"message": "Post not found"}), 404
+    post.unlike(g.user.id)
 
     return jsonify({
         'message': 'Post unliked successfully',
-        'post': post.to_json()
+        'post': post.to_json(liked=False)
     }), 200
 
 
@@ -218,18 +257,47 @@ def add_comment(post_id):
     if not post_id:
         return jsonify({"message": "Missing post id"}), 400
 
-    if not request.get_json():
+    data = request.get_json()
+    if not data:
         return jsonify({"message": "No data sent"}), 400
 
-    if not 'content' in request.get_json():
+    if not data.get('content'):
         return jsonify({"message": "Missing content"}), 400
 
     post = PostModel.query.filter_by(id=post_id).first()
     if not post:
         return jsonify({"message": "Post not found"}), 404
 
-    comment = {
-        'content': request.form.get("content"),
-        'owner_id': g.user.id,
-        'created_at': datetime.now(),
-    }
+    comment = post.add_comment(g.user.id, data['content'])
+    return jsonify({
+        'message': 'Comment added successfully',
+        'comment': comment.to_json(owner=g.user)
+    }), 201
+
+
+@post_ep.route("/<post_id>/comments", methods=["GET"])
+@login_required
+def get_comments(post_id):
+    '''
+    Read a page of comments on a post, oldest first.
+    Accepts `cursor` and `limit` query parameters like the post listings.
+    '''
+    if request.method != 'GET':
+        return jsonify({"message": "Method not allowed"}), 405
+
+    if not PostModel.query.filter_by(id=post_id).first():
+        return jsonify({"message": "Post not found"}), 404
+
+    try:
+        comments, next_cursor = paginate(
+            PostComment.query.filter_by(post_id=post_id),
+            PostComment.created_at,
+            PostComment.id,
+            descending=False)
+    except PaginationError as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify({
+        "comments": PostComment.to_json_many(comments),
+        "next_cursor": next_cursor
+    }), 200
@@ -0,0 +1,144 @@
+import hashlib
+from itertools import islice
+
+from database import UserAccount
+from diagnostics import inspector
+from flask import current_app, jsonify, request, stream_with_context
+from serialization import parse_fields
+
+from .Pagination import PaginationError
+
+STREAM_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'array': 'application/json',
+}
+
+
+def make_etag(*parts) -> str:
+    '''Returns an opaque entity tag for the version information in `parts`.'''
+    raw = '|'.join(str(part) for part in parts).encode('utf-8')
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def user_etag(user: UserAccount) -> str:
+    '''`updated_at` is bumped on every change to the user's row.'''
+    return make_etag('user', user.id, user.updated_at.isoformat())
+
+
+def post_etag(post, owner: UserAccount, viewer_id: int) -> str:
+    '''
+    A post's JSON depends on its `version`, the owner's profile and, through
+    `liked`, on who is asking.
+    '''
+    return make_etag('post', post.id, post.version,
+                     owner.updated_at.isoformat() if owner else None,
+                     viewer_id)
+
+
+def posts_etag(posts: list, viewer_id: int, next_cursor: str = None) -> str:
+    '''
+    Collection tag for a page of posts: changes whenever a post on the page,
+    one of their owners, or the page boundary changes.
+    '''
+    owners = UserAccount.get_many(post.owner_id for post in posts)
+    return make_etag(
+        'posts', viewer_id, next_cursor,
+        *(f'{post.id}:{post.version}' for post in posts),
+        *(f'{user.id}:{user.updated_at.isoformat()}'
+          for user in sorted(owners.values(), key=lambda user: user.id)))
+
+
+def get_fields(model) -> tuple or None:
+    '''
+    Returns the `fields` query parameter as a projection of `model`'s JSON
+    fields, or `None` for the default set. Raises `InvalidFields`.
+    '''
+    return parse_fields(model, request.args.get('fields'))
+
+
+def representation_tag() -> tuple:
+    '''
+    What shapes a JSON body besides the resource's version: the `fields`
+    projection, order-insensitive, and the JSON encoder in use.
+    '''
+    fields = request.args.get('fields') or ''
+    projection = ','.join(
+        sorted({field.strip()
+                for field in fields.split(',') if field.strip()}))
+    return projection, type(current_app.json).__name__
+
+
+def conditional_json(etag: str, build, status: int = 200):
+    '''
+    Returns `build()` as a JSON response tagged with a weak `etag`, or an
+    empty `304 Not Modified` if the client's `If-None-Match` already holds
+    it. `build` is only called on a miss, so unchanged resources are never
+    serialized. The tag sent is `etag` combined with `representation_tag()`,
+    so a projected body never validates a request for another projection.
+    '''
+    etag = make_etag(etag, *representation_tag())
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build())
+        response.status_code = status
+    response.set_etag(etag, weak=True)
+    # Responses depend on the token, and clients should always revalidate
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Authorization')
+    return response
+
+
+def get_stream_format() -> str or None:
+    '''
+    Returns the `stream` query parameter (`ndjson` or `array`), or `None`
+    for a normal paged response. Raises `PaginationError`.
+    '''
+    fmt = request.args.get('stream')
+    if fmt is None:
+        return None
+    if fmt not in STREAM_MIMETYPES:
+        raise PaginationError('Invalid stream format')
+    return fmt
+
+
+def stream_json(query, serialize, key: str, fmt: str):
+    '''
+    Streams every row of `query` as NDJSON, one object per line, or as a
+    `{key: [...]}` document sent in chunks. Rows are fetched
+    `STREAM_BATCH_SIZE` at a time with `yield_per` and passed to
+    `serialize(rows)` a batch at a time, so batch serializers keep their few
+    queries per batch and memory stays flat however many rows match.
+    '''
+    batch_size = current_app.config.get('STREAM_BATCH_SIZE', 500)
+    dumps = current_app.json.dumps
+
+    def generate():
+        rows = iter(query.yield_per(batch_size))
+        if fmt == 'array':
+            yield '{' + dumps(key) + ': ['
+        first = True
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            # The same queries run once per batch by design
+            inspector.start_batch()
+            items = [dumps(item) for item in serialize(batch)]
+            if fmt == 'ndjson':
+                yield ''.join(item + '\n' for item in items)
+            elif items:
+                yield ('' if first else ',') + ','.join(items)
+                first = False
+        if fmt == 'array':
+            yield ']}'
+
+    response = current_app.response_class(stream_with_context(generate()),
+                                          mimetype=STREAM_MIMETYPES[fmt])
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    response.vary.add('Authorization')
+    # Ask a buffering proxy (nginx) to pass chunks through as they come
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,85 @@
+import search
+from database import PostModel, UserAccount
+from flask import Blueprint, g, jsonify, request
+from flask_cors import CORS
+from serialization import InvalidFields
+
+from .Authorization import login_required
+from .Pagination import (PaginationError, encode_offset, get_offset,
+                         get_page_limit)
+from .Responses import get_fields
+
+search_ep = Blueprint("search_ep", __name__, url_prefix="/api/search")
+CORS(search_ep)
+
+# Ranked results are paged by offset; deep pages are not useful for search
+MAX_OFFSET = 1000
+
+
+def _search(model, find, serialize):
+    '''
+    Runs `find(query, viewer_id, limit, offset, prefix)` for the request's
+    `q` and returns a json response with a page of serialized results.
+    '''
+    if not search.is_available():
+        return jsonify({"error": "Search is not available"}), 501
+
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Missing query"}), 400
+    # Typeahead matches the last term as a prefix unless `prefix=false`
+    prefix = request.args.get("prefix", "true").lower() != "false"
+    try:
+        fields = get_fields(model)
+        limit = get_page_limit()
+        offset = get_offset(MAX_OFFSET)
+    except (InvalidFields, PaginationError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    ids = find(query, g.user.id, limit + 1, offset, prefix)
+    next_cursor = None
+    if len(ids) > limit:
+        ids = ids[:limit]
+        next_cursor = encode_offset(offset + limit)
+
+    rows = {
+        row.id: row
+        for row in model.query.filter(model.id.in_(ids))
+    } if ids else {}
+    return jsonify({
+        "results":
+        serialize([rows[row_id] for row_id in ids if row_id in rows],
+                  fields),
+        "next_cursor":
+        next_cursor
+    }), 200
+
+
+@search_ep.route("/users", methods=["GET"])
+@login_required
+def search_users():
+    '''
+    Searches users by handle, name, occupation, institution and interests,
+    best match first. Accepts `q`, `prefix`, `fields`, `cursor` and `limit`
+    query parameters.
+    '''
+    if request.method != "GET":
+        return jsonify({"error": "Method not allowed"}), 405
+
+    return _search(UserAccount, search.search_users,
+                   UserAccount.to_json_many)
+
+
+@search_ep.route("/posts", methods=["GET"])
+@login_required
+def search_posts():
+    '''
+    Searches post content, best match first. Accepts the same query
+    parameters as user search.
+    '''
+    if request.method != "GET":
+        return jsonify({"error": "Method not allowed"}), 405
+
+    return _search(
+        PostModel, search.search_posts, lambda posts, fields: PostModel.
+        to_json_many(posts, viewer_id=g.user.id, fields=fields))
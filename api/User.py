@@ -1,12 +1,20 @@
-import os
-from hashlib import md5
+import json
 
-from database import db, UserAccount
+from cache import invalidate_user
+from database import after_commit, commit, Friendship, rollback, UserAccount
+from logs.Logger import log_debug
+from serialization import InvalidFields
 from flask import Blueprint, current_app, g, jsonify, request
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
+from storage.Media import InvalidMedia, media
+from suggestions import engine as suggestions
 
-from .Authorization import login_required
+from .Authorization import admin_required, is_admin_type, login_required
+from .Pagination import (PaginationError, apply_keyset, get_cursor,
+                         get_page_limit, paginate)
+from .Responses import (conditional_json, get_fields, get_stream_format,
+                        stream_json, user_etag)
 
 user_ep = Blueprint("user_ep", __name__, url_prefix="/api/user")
 CORS(user_ep)
@@ -18,14 +26,62 @@ def _allowed_file(filename):
             in current_app.config["ALLOWED_EXTENSIONS"])
 
 
+def _can_view(user) -> bool:
+    """Checks if `g.user` may see `user`'s profile and posts."""
+    if user.id == g.user.id or user.privacy_setting in (None, "public"):
+        return True
+    if user.privacy_setting == "friends":
+        return g.user.is_friend(user.id)
+    return False
+
+
+@user_ep.route("/", methods=["GET"])
+@login_required
+@admin_required
+def get_all_users():
+    """
+    Lists every user, newest first, for admins. Pages with `cursor` and
+    `limit` like the other listings, or with `stream=ndjson` or
+    `stream=array` returns all users from `cursor` on in one streamed
+    response.
+    """
+    if request.method != "GET":
+        return jsonify({"error": "Method not allowed"}), 405
+    try:
+        fields = get_fields(UserAccount)
+        stream = get_stream_format()
+        if stream is None:
+            users, next_cursor = paginate(UserAccount.query,
+                                          UserAccount.created_at,
+                                          UserAccount.id)
+        else:
+            query = apply_keyset(UserAccount.query, UserAccount.created_at,
+                                 UserAccount.id, get_cursor())
+    except (InvalidFields, PaginationError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    if stream is not None:
+        return stream_json(
+            query, lambda users: UserAccount.to_json_many(users, fields),
+            "users", stream)
+    return jsonify({
+        "users": UserAccount.to_json_many(users, fields),
+        "next_cursor": next_cursor
+    }), 200
+
+
 @user_ep.route("/me", methods=["GET"])
 @login_required
 def get_current_user():
     """Returns the user object for the currently logged in user."""
     if request.method != "GET":
         return jsonify({"error": "Method not allowed"}), 405
+    try:
+        fields = get_fields(UserAccount)
+    except InvalidFields as e:
+        return jsonify({"error": str(e)}), 400
 
-    return jsonify(g.user.to_json()), 200
+    return conditional_json(user_etag(g.user), lambda: g.user.to_json(fields))
 
 
 @user_ep.route("/handle/<handle>", methods=["GET"])
@@ -36,12 +92,16 @@ def get_user_by_handle(handle):
 
     if not handle:
         return jsonify({"error": "Missing handle"}), 400
+    try:
+        fields = get_fields(UserAccount)
+    except InvalidFields as e:
+        return jsonify({"error": str(e)}), 400
 
     user = UserAccount.query.filter_by(handle=handle).first()
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    return jsonify(user.to_json()), 200
+    return conditional_json(user_etag(user), lambda: user.to_json(fields))
 
 
 @user_ep.route("/<user_id>", methods=["GET"])
@@ -51,12 +111,17 @@ def get_user_by_id(user_id):
         return jsonify({"error": "Method not allowed"}), 405
     if not user_id or not user_id.isdigit():
         return jsonify({"error": "Invalid user id"}), 400
-    user = db.session.query(db.User).filter_by(id=user_id).first()
+    try:
+        fields = get_fields(UserAccount)
+    except InvalidFields as e:
+        return jsonify({"error": str(e)}), 400
+    user = UserAccount.query.get(user_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
-    #verify users are friends
-    return jsonify(user.to_json()), 200
+    if not _can_view(user):
+        return jsonify({"error": "This profile is private"}), 403
+    return conditional_json(user_etag(user), lambda: user.to_json(fields))
 
 
 @user_ep.route("/update", methods=["POST"])
@@ -68,34 +133,68 @@ def update_user():
 
     data = request.get_json()
     if data is None:
-        print("[!] No data provided")
+        log_debug("[!] No data provided")
         return jsonify({"error": "No json data"}), 400
 
-    new_user_data = g.user.to_json()
+    new_user_data = {}
 
     for key in data:
-        if (key == "email" or key == "auth_token" or key == "token_expiration"
-                or key == "created_at" or key == "updated_at"
-                or key not in g.user.to_json().keys()):
-            print(f"[!] Will not update {key} from this endpoint")
+        if (key == "id" or key == "email" or key == "auth_token"
+                or key == "token_expiration" or key == "created_at"
+                or key == "updated_at" or key == "friend_count"
+                or (key == "account_type" and is_admin_type(data[key]))
+                or not isinstance(UserAccount.JSON_FIELDS.get(key), str)):
+            log_debug(f"[!] Will not update {key} from this endpoint")
             pass
         else:
             new_user_data[key] = data[key]
-    g.user.update(new_user_data)
-    db.session.commit()
+
+    if "interests" in new_user_data and not _valid_interests(
+            new_user_data["interests"]):
+        log_debug("[!] Invalid interests")
+        return jsonify({"error": "Interests must be a JSON list"}), 400
+
+    if "handle" in new_user_data:
+        # Stored lower-cased, as at registration
+        handle = str(new_user_data["handle"] or "").strip().lower()
+        if not handle:
+            return jsonify({"error": "Invalid handle"}), 400
+        if UserAccount.query.filter(UserAccount.handle == handle,
+                                    UserAccount.id != g.user.id).first():
+            log_debug("[!] Vanity name already exists")
+            return jsonify({"error": "Handle already in use"}), 400
+        new_user_data["handle"] = handle
+
+    try:
+        g.user.update(new_user_data)
+    except IntegrityError:
+        # Taken concurrently, after the check above
+        rollback()
+        log_debug("[!] Vanity name already exists")
+        return jsonify({"error": "Handle already in use"}), 400
     return jsonify({
         "success": "User data  updated",
         "user": g.user.to_json()
     }), 200
 
 
+def _valid_interests(value) -> bool:
+    """Interests are sent as a list of strings or as its JSON encoding."""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return False
+    return isinstance(value, list) and all(
+        isinstance(interest, str) for interest in value)
+
+
 @user_ep.route("/set-avatar", methods=["POST"])
 @login_required
 def get_profile_picture():
     """Uploads a profile picture for the currently logged in user."""
     if request.method != "POST":
         return jsonify({"error": "Method not allowed"}), 405
-    print(request.data)
 
     if not "file" in request.files:
         return jsonify({"error": "No file provided"}), 400
@@ -105,27 +204,21 @@ def get_profile_picture():
 
     if file and _allowed_file(file.filename):
 
-        # Generate a unique filename
-        # Format is: <md5 hash of email>-<user_id>.<extension>
-        ext = file.filename.rsplit(".", 1)[1].lower()
-        filename = secure_filename(
-            f"{md5(g.user.email.encode('utf-8')).hexdigest()}-{g.user.id}.{ext}"
-        )
-
-        # delete the old file if exists
-        if os.path.exists(f"{filename}"):
-            with open(f"{filename}.{ext}") as f:
-                os.remove(file.name)
-
         # TODO:
         # Send file to virus total for scanning
 
-        file.save(
-            os.path.join(current_app.config["UPLOADS_AVATAR_FOLDER"],
-                         filename))
-        g.user.avatar_uri = f"{request.host_url}static/avatars/{filename}"
-        print("[+] Profile picture updated to " + g.user.avatar_uri)
-        db.session.commit()
+        try:
+            key = media.acquire(file)
+        except InvalidMedia as e:
+            return jsonify({"error": str(e)}), 400
+
+        old_key = g.user.avatar_key
+        g.user.avatar_key = key
+        g.user.avatar_uri = media.url(key)
+        commit()
+        if old_key:
+            after_commit(media.release, old_key)
+        after_commit(invalidate_user, g.user.id)
         return (
             jsonify({
                 "success": "Profile picture updated",
@@ -143,24 +236,23 @@ def delete_avatar():
     if request.method != "POST":
         return jsonify({"error": "Method not allowed"}), 405
 
-    filename = g.user.avatar.rsplit("/", 1)[1]
-    if os.path.exists(filename):
-        with open(f"{current_app.config['UPLOAD_FOLDER']}/{filename}",
-                  "rb") as f:
-            os.remove(f.name)
-            f.close()
-
-            g.user.avatar_uri = None
+    if not g.user.avatar_key:
+        return jsonify({"error": "Profile picture not found"}), 404
 
-            return (
-                jsonify({
-                    "success": "Profile picture deleted",
-                    "user": g.user.to_json()
-                }),
-                200,
-            )
+    key = g.user.avatar_key
+    g.user.avatar_key = None
+    g.user.avatar_uri = None
+    commit()
+    after_commit(media.release, key)
+    after_commit(invalidate_user, g.user.id)
 
-    return jsonify({"error": "Profile picture not found"}), 404
+    return (
+        jsonify({
+            "success": "Profile picture deleted",
+            "user": g.user.to_json()
+        }),
+        200,
+    )
 
 
 @user_ep.route("/delete", methods=["DELETE"])
@@ -169,7 +261,141 @@ def delete_user():
     if request.method != "DELETE":
         return jsonify({"error": "Method not allowed"}), 405
 
-    db.session.delete(g.user)
-    db.session.commit()
+    for key in g.user.delete():
+        after_commit(media.release, key)
     g.user = None
     return jsonify({"success": "User deleted"}), 200
+
+
+def _friends_page(user_id):
+    """Returns a json response with a page of `user_id`'s friends."""
+    try:
+        fields = get_fields(UserAccount)
+        edges, next_cursor = paginate(
+            Friendship.query.filter_by(user_id=user_id,
+                                       status=Friendship.ACCEPTED),
+            Friendship.created_at, Friendship.friend_id)
+    except (InvalidFields, PaginationError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    friends = UserAccount.get_many(edge.friend_id for edge in edges)
+    return jsonify({
+        "friends":
+        UserAccount.to_json_many([
+            friends[edge.friend_id] for edge in edges
+            if edge.friend_id in friends
+        ], fields),
+        "next_cursor": next_cursor
+    }), 200
+
+
+@user_ep.route("/friends", methods=["GET"])
+@login_required
+def get_friends():
+    """Returns a page of the currently logged in user's friends."""
+    if request.method != "GET":
+        return jsonify({"error": "Method not allowed"}), 405
+
+    return _friends_page(g.user.id)
+
+
+@user_ep.route("/<user_id>/friends", methods=["GET"])
+@login_required
+def get_friends_by_user_id(user_id):
+    """Returns a page of another user's friends."""
+    if request.method != "GET":
+        return jsonify({"error": "Method not allowed"}), 405
+    if not user_id or not user_id.isdigit():
+        return jsonify({"error": "Invalid user id"}), 400
+
+    user = UserAccount.query.get(user_id)
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+    if not _can_view(user):
+        return jsonify({"error": "This profile is private"}), 403
+
+    return _friends_page(user.id)
+
+
+@user_ep.route("/suggestions", methods=["GET"])
+@login_required
+def get_suggestions():
+    """
+    Returns people the currently logged in user may know, best first, with
+    the score and the reasons behind it. Suggestions are precomputed by the
+    suggestion job, so this never scans other users.
+    """
+    if request.method != "GET":
+        return jsonify({"error": "Method not allowed"}), 405
+    try:
+        fields = get_fields(UserAccount)
+        limit = get_page_limit()
+    except (InvalidFields, PaginationError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    suggested = suggestions.get(g.user.id)[:limit]
+    users = UserAccount.get_many(candidate_id
+                                 for candidate_id, _, _ in suggested)
+    results = []
+    for candidate_id, score, reasons in suggested:
+        user = users.get(candidate_id)
+        # Profiles deleted or made private since the last run are skipped
+        if user and user.privacy_setting in (None, "public"):
+            results.append((user, score, reasons))
+    profiles = UserAccount.to_json_many([user for user, _, _ in results],
+                                        fields)
+    return jsonify({
+        "suggestions": [{
+            "user": profile,
+            "score": score,
+            "reasons": reasons
+        } for profile, (_, score, reasons) in zip(profiles, results)]
+    }), 200
+
+
+@user_ep.route("/friends/<user_id>", methods=["GET"])
+@login_required
+def get_friendship(user_id):
+    """Returns the friendship status and mutual friend count with another user."""
+    if request.method != "GET":
+        return jsonify({"error": "Method not allowed"}), 405
+    if not user_id or not user_id.isdigit():
+        return jsonify({"error": "Invalid user id"}), 400
+
+    status = g.user.friendship_status(user_id)
+    return jsonify({
+        "status": status,
+        "is_friend": status == Friendship.ACCEPTED,
+        "mutual_friends": g.user.mutual_friend_count(user_id),
+    }), 200
+
+
+@user_ep.route("/friends/<user_id>", methods=["POST"])
+@login_required
+def add_friend(user_id):
+    """Sends a friend request to another user, or accepts theirs."""
+    if request.method != "POST":
+        return jsonify({"error": "Method not allowed"}), 405
+    if not user_id or not user_id.isdigit():
+        return jsonify({"error": "Invalid user id"}), 400
+    if int(user_id) == g.user.id:
+        return jsonify({"error": "Cannot befriend yourself"}), 400
+    if not UserAccount.query.get(user_id):
+        return jsonify({"error": "User not found"}), 404
+
+    status = g.user.add_friend(user_id)
+    return jsonify({"success": "Friendship updated", "status": status}), 200
+
+
+@user_ep.route("/friends/<user_id>", methods=["DELETE"])
+@login_required
+def remove_friend(user_id):
+    """Removes a friend, or cancels / declines a pending friend request."""
+    if request.method != "DELETE":
+        return jsonify({"error": "Method not allowed"}), 405
+    if not user_id or not user_id.isdigit():
+        return jsonify({"error": "Invalid user id"}), 400
+
+    if not g.user.remove_friend(user_id):
+        return jsonify({"error": "Friendship not found"}), 404
+    return jsonify({"success": "Friendship removed"}), 200
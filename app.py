@@ -4,32 +4,165 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 from flask_migrate import Migrate
 
-from database import db
+from cache import auth_cache
+from compression import compressor
+from database import (check_query_plans, configure_database, db,
+                      init_unit_of_work)
+from logs import Logger
+import metrics
+import search
+from diagnostics import inspector
+from passwords import hasher
+import serialization
+from storage.Media import media
+from storage.Processing import images
+from suggestions import engine as suggestions
+import transfer
 from api.Authorization import auth_ep
 from api.User import user_ep
 from api.Post import post_ep
 from api.Meetings import meetings_ep
+from api.Feed import feed_ep
+from api.Media import media_ep
+from api.Search import search_ep
 
 app = Flask(__name__)
 app.config['DEBUG'] = True
 app.config['SECRET_KEY'] = 'three blind mice and a giant red riding hood'
 
 # Database settings
+# DATABASE_URL switches to a server database, e.g. postgresql://user:pw@host/db
+# DATABASE_PROFILE picks the SQLite PRAGMAs (development or production),
+# individual PRAGMAs can be overridden through SQLITE_PRAGMAS.
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config[
-    "SQLALCHEMY_DATABASE_URI"] = f'sqlite:///{os.path.join(os.getcwd(), "database.sqlite")}'
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    'DATABASE_URL',
+    f'sqlite:///{os.path.join(os.getcwd(), "database.sqlite")}')
+app.config['DATABASE_PROFILE'] = os.environ.get('DATABASE_PROFILE',
+                                                'production')
+app.config['DATABASE_POOL_SIZE'] = int(
+    os.environ.get('DATABASE_POOL_SIZE', 5))
+app.config['DATABASE_MAX_OVERFLOW'] = int(
+    os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+app.config['SQLITE_PRAGMAS'] = {}
+# Each request commits once, after the view returns, instead of once per
+# model mutation
+app.config['DATABASE_UNIT_OF_WORK'] = True
+
+# Authentication cache settings
+app.config['AUTH_CACHE_SIZE'] = 1024
+app.config['AUTH_CACHE_TTL'] = 300
+auth_cache.maxsize = app.config['AUTH_CACHE_SIZE']
+
+# Password hashing settings
+# Set BCRYPT_TARGET_MS to pick the cost factor by benchmarking at startup.
+app.config['BCRYPT_ROUNDS'] = 12
+app.config['BCRYPT_TARGET_MS'] = None
+app.config['BCRYPT_MAX_WORKERS'] = 4
+app.config['BCRYPT_MAX_PENDING'] = 32
+app.config['BCRYPT_TIMEOUT'] = 10
+
+# Logging settings
+# LOG_DEBUG prints request diagnostics to stdout; off on the hot path.
+app.config['LOG_DEBUG'] = False
+app.config['LOG_FLUSH_INTERVAL'] = 1.0
+app.config['LOG_MAX_BYTES'] = 10 * 1024 * 1024
+app.config['LOG_BACKUP_COUNT'] = 5
+app.config['LOG_DIR'] = os.environ.get('LOG_DIR')
+
+# Encode JSON responses with orjson when it is installed
+app.config['JSON_ORJSON'] = True
+
+# Response compression (brotli when installed, otherwise gzip)
+app.config['COMPRESS_MIN_SIZE'] = 500
+app.config['COMPRESS_GZIP_LEVEL'] = 6
+app.config['COMPRESS_BR_LEVEL'] = 4
+app.config['COMPRESS_CACHE_SIZE'] = 512
+
+# Request latency, SQL and bcrypt metrics in Prometheus text format.
+# Scrapers authenticate with `Authorization: Bearer $METRICS_TOKEN`; the
+# endpoint is hidden while no token is set.
+app.config['METRICS_ENABLED'] = True
+app.config['METRICS_ENDPOINT'] = '/metrics'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+# N+1 detector and slow query log, for development and staging.
+# SQL_INSPECT_RAISE turns repeated statements into errors, e.g. in tests.
+app.config['SQL_INSPECT'] = os.environ.get('SQL_INSPECT') == '1'
+app.config['SQL_REPEAT_THRESHOLD'] = 5
+app.config['SQL_SLOW_MS'] = 100
+app.config['SQL_INSPECT_RAISE'] = os.environ.get('SQL_INSPECT_RAISE') == '1'
+
+# Report EXPLAIN QUERY PLAN output for hot queries at startup
+app.config['CHECK_QUERY_PLANS'] = True
+
+# Pagination settings
+app.config['PAGE_DEFAULT_LIMIT'] = 20
+app.config['PAGE_MAX_LIMIT'] = 100
+app.config['COMMENT_PREVIEW_SIZE'] = 3
+# Admins (account_type ADMIN_ACCOUNT_TYPE) may stream whole listings with
+# `?stream=ndjson|array`; rows are fetched STREAM_BATCH_SIZE at a time.
+app.config['ADMIN_ACCOUNT_TYPE'] = 'Admin'
+app.config['STREAM_BATCH_SIZE'] = 500
+
+# Home feed settings
+# Users with more friends than FEED_FANOUT_LIMIT are merged into feeds at
+# read time instead of being copied into every friend's timeline.
+app.config['FEED_FANOUT_LIMIT'] = 1000
+app.config['FEED_TIMELINE_MAX'] = 800
+app.config['FEED_TRIM_INTERVAL'] = 20
+app.config['FEED_BACKFILL_POSTS'] = 20
 
 # Uploads settings
 app.config['ALLOWED_EXTENSIONS'] = set(['png', 'jpg', 'jpeg', 'gif'])
-app.config['UPLOADS_AVATAR_FOLDER'] = os.path.join(os.getcwd(),
-                                                   "static/avatars")
-app.config['UPLOADS_POSTS_FOLDER'] = os.path.join(os.getcwd(), "static/posts")
+# Uploads are stored once per distinct content under MEDIA_ROOT
+app.config['MEDIA_ROOT'] = os.path.join(os.getcwd(), "static/media")
+# Uploads are written here while being hashed; keep it outside the static
+# folder so partial uploads are never served
+app.config['MEDIA_STAGING'] = os.path.join(os.getcwd(), "media_staging")
+app.config['MEDIA_CHUNK_SIZE'] = 64 * 1024
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+# Media URLs are content hashes, so they are cached as immutable.
+# MEDIA_SENDFILE hands the transfer to the front-end server instead of a
+# worker: 'x-accel-redirect' (nginx, internal location MEDIA_ACCEL_PREFIX
+# aliased to MEDIA_ROOT) or 'x-sendfile' (Apache / lighttpd).
+app.config['MEDIA_MAX_AGE'] = 365 * 24 * 60 * 60
+app.config['MEDIA_SENDFILE'] = os.environ.get('MEDIA_SENDFILE')
+app.config['MEDIA_ACCEL_PREFIX'] = '/_media/'
+# Thumbnail / WebP variants are rendered on a process pool (needs Pillow)
+app.config['IMAGE_PROCESSING'] = True
+app.config['IMAGE_WORKERS'] = 2
+app.config['IMAGE_WEBP_QUALITY'] = 80
+
+# Friend suggestions are precomputed on a background thread: everyone every
+# SUGGESTIONS_INTERVAL seconds, users whose interests or friendships changed
+# every SUGGESTIONS_REFRESH seconds. With several worker processes, turn it
+# off and run `flask suggestions rebuild` from cron instead.
+app.config['SUGGESTIONS_BACKGROUND'] = (
+    os.environ.get('SUGGESTIONS_BACKGROUND', '1') == '1')
+app.config['SUGGESTIONS_INTERVAL'] = 6 * 60 * 60
+app.config['SUGGESTIONS_REFRESH'] = 60
+app.config['SUGGESTIONS_PER_USER'] = 50
+app.config['SUGGESTIONS_MAX_POSTING'] = 5000
 
 cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
 cors.init_app(app)
 
+configure_database(app)
 db.init_app(app)
-migrate = Migrate(app, db)
+migrate = Migrate(app, db, render_as_batch=True)
+transfer.init_app(app)
+hasher.init_app(app)
+serialization.init_app(app)
+metrics.init_app(app)
+inspector.init_app(app)
+compressor.init_app(app)
+Logger.init_app(app)
+media.init_app(app)
+images.init_app(app)
+search.init_app(app)
+suggestions.init_app(app)
+init_unit_of_work(app)
 
 
 @app.before_first_request
@@ -43,6 +176,9 @@ def register_blueprints(app):
     app.register_blueprint(user_ep)
     app.register_blueprint(post_ep)
     app.register_blueprint(meetings_ep)
+    app.register_blueprint(feed_ep)
+    app.register_blueprint(media_ep)
+    app.register_blueprint(search_ep)
 
 
 def setup_database(app):
@@ -51,6 +187,9 @@ def setup_database(app):
         if not os.path.exists(os.path.join(os.getcwd(), "database.db")):
             print("[+] Creating database tables.")
             db.create_all()
+            search.create_indexes()
+        if app.config['CHECK_QUERY_PLANS']:
+            check_query_plans()
 
 
 if __name__ == '__main__':
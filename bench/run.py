@@ -0,0 +1,395 @@
+'''
+Benchmarks the API against a freshly seeded SQLite database.
+
+    python -m bench.run --users 200 --posts 2000 --requests 300
+    python -m bench.run --server --concurrency 8 --save bench/baseline.json
+    python -m bench.run --compare bench/baseline.json
+
+Each workload is run separately after a short warm up, through the Flask
+test client or, with `--server`, over HTTP against a threaded WSGI server.
+Reports p50/p95/p99 latency, throughput and SQL statements per request.
+'''
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from json import dumps as json_dumps
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestClient:
+    '''Drives the app in-process through the Flask test client.'''
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers=None, json=None, form=None):
+        response = self.client.open(path,
+                                     method=method,
+                                     headers=headers,
+                                     json=json,
+                                     data=form)
+        return response.status_code, response.get_data()
+
+
+class HTTPClient:
+    '''Drives the app over HTTP, one keep-alive connection per thread.'''
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, 'connection', None) is None:
+            self._local.connection = http.client.HTTPConnection(self.host,
+                                                                self.port,
+                                                                timeout=30)
+        return self._local.connection
+
+    def request(self, method, path, headers=None, json=None, form=None):
+        headers = dict(headers or {})
+        body = None
+        if json is not None:
+            body = json_dumps(json)
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection = self._connection()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            raise
+
+
+class QueryCounter:
+    '''Counts SQL statements executed by any thread.'''
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def percentile(samples: list, p: float) -> float:
+    '''Nearest-rank percentile of the sorted `samples`.'''
+    if not samples:
+        return 0.0
+    rank = max(1, min(len(samples), round(p / 100 * len(samples) + 0.5)))
+    return samples[rank - 1]
+
+
+# Workloads build one request: `fn(ctx, i) -> (method, path, kwargs)`
+def _register(ctx, i):
+    n = next(ctx['registrations'])
+    return 'POST', '/api/auth/register', {
+        'json': {
+            'email': f'new{n}@example.com',
+            'password': 'benchmark-password',
+            'first_name': 'New',
+            'last_name': 'User',
+            'education_level': 'Bachelors',
+            'profile_type': 'Student',
+            'handle': f'new{n}'
+        }
+    }
+
+
+def _login(ctx, i):
+    return 'POST', '/api/auth/login', {
+        'json': {
+            'email': ctx['rng'].choice(ctx['emails']),
+            'password': ctx['password']
+        }
+    }
+
+
+def _me(ctx, i):
+    return 'GET', '/api/user/me', {'headers': ctx['auth'](i)}
+
+
+def _post_list(ctx, i):
+    return 'GET', '/api/user/post/?limit=20', {'headers': ctx['auth'](i)}
+
+
+def _feed(ctx, i):
+    return 'GET', '/api/user/feed?limit=20', {'headers': ctx['auth'](i)}
+
+
+def _post_create(ctx, i):
+    return 'POST', '/api/user/post/', {
+        'headers': ctx['auth'](i),
+        'form': {
+            'content': f'Benchmark run post {i}'
+        }
+    }
+
+
+def _like(ctx, i):
+    post_id = ctx['rng'].choice(ctx['post_ids'])
+    return 'POST', f'/api/user/post/{post_id}/like', {
+        'headers': ctx['auth'](i)
+    }
+
+
+WORKLOADS = {
+    'register': _register,
+    'login': _login,
+    'me': _me,
+    'post_list': _post_list,
+    'feed': _feed,
+    'post_create': _post_create,
+    'like': _like,
+}
+
+
+def run_workload(client, ctx, build, requests, concurrency, queries) -> dict:
+    '''Sends `requests` requests built by `build` and returns their stats.'''
+    timings = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        method, path, kwargs = build(ctx, i)
+        start = time.perf_counter()
+        status, _ = client.request(method, path, **kwargs)
+        elapsed = time.perf_counter() - start
+        with lock:
+            timings.append(elapsed)
+            if status >= 400:
+                errors += 1
+
+    queries_before = queries.count
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests)))
+    else:
+        for i in range(requests):
+            one(i)
+    wall = time.perf_counter() - start
+
+    timings.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'throughput_rps': round(requests / wall, 1),
+        'queries_per_request':
+        round((queries.count - queries_before) / requests, 2),
+    }
+
+
+def compare(results: dict, baseline: dict) -> None:
+    '''Prints each workload's change against a saved baseline.'''
+    print(f'\n[+] Compared to baseline from {baseline["meta"]["date"]}')
+    for name, stats in results.items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        deltas = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps',
+                    'queries_per_request'):
+            if before[key]:
+                change = (stats[key] - before[key]) / before[key] * 100
+                deltas.append(f'{key} {change:+.1f}%')
+        print(f'    {name:<12} ' + ', '.join(deltas))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--likes', type=int, default=5000)
+    parser.add_argument('--comments', type=int, default=2000)
+    parser.add_argument('--friends', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per workload')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--workloads', default=','.join(WORKLOADS),
+                        help='comma separated subset of: ' +
+                        ', '.join(WORKLOADS))
+    parser.add_argument('--server', action='store_true',
+                        help='run through a threaded WSGI server over HTTP')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--bcrypt-rounds', type=int, default=None,
+                        help='override BCRYPT_ROUNDS for the run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> dict:
+    args = parse_args(argv)
+    workloads = [name.strip() for name in args.workloads.split(',')]
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        sys.exit(f'[!] Unknown workloads: {", ".join(sorted(unknown))}')
+
+    # The app reads its database, media and log locations at import time,
+    # so point them at a scratch directory first. It is removed afterwards,
+    # database, logs and media included.
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        os.chdir(workdir)
+        try:
+            return run(args, workloads, cwd, workdir)
+        finally:
+            os.chdir(cwd)
+
+
+def run(args, workloads: list, cwd: str, workdir: str) -> dict:
+    '''Seeds a database in `workdir` and runs `workloads` against it.'''
+    os.environ['DATABASE_URL'] = (
+        f'sqlite:///{os.path.join(workdir, "database.sqlite")}')
+    os.environ['LOG_DIR'] = os.path.join(workdir, 'logs')
+    sys.path.insert(0, ROOT)
+
+    import app as appmod
+    from app import app
+    import search
+    from database import PostModel, db
+    from logs import Logger
+    from passwords import hasher
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    from bench.seed import PASSWORD, email_for, seed
+
+    app.config['CHECK_QUERY_PLANS'] = False
+    app.config['IMAGE_PROCESSING'] = False
+    app.config['SUGGESTIONS_BACKGROUND'] = False
+    if args.bcrypt_rounds:
+        app.config['BCRYPT_ROUNDS'] = args.bcrypt_rounds
+        hasher.init_app(app)
+    appmod.register_blueprints(app)
+
+    with app.app_context():
+        db.create_all()
+        search.create_indexes()
+        start = time.perf_counter()
+        counts = seed(users=args.users,
+                      posts=args.posts,
+                      likes=args.likes,
+                      comments=args.comments,
+                      friends=args.friends,
+                      seed=args.seed)
+        print(f'[+] Seeded {counts} in {time.perf_counter() - start:.1f}s')
+        post_ids = [post_id for post_id, in db.session.query(PostModel.id)]
+
+    server = None
+    if args.server:
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server('127.0.0.1',
+                             0,
+                             app,
+                             threaded=True,
+                             request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = HTTPClient('127.0.0.1', server.server_port)
+    else:
+        client = TestClient(app)
+
+    queries = QueryCounter()
+    event.listen(Engine, 'after_cursor_execute', queries)
+
+    rng = random.Random(args.seed)
+    emails = [email_for(i) for i in range(args.users)]
+    tokens = []
+    for email in emails[:min(len(emails), 20)]:
+        status, body = client.request('POST',
+                                      '/api/auth/login',
+                                      json={
+                                          'email': email,
+                                          'password': PASSWORD
+                                      })
+        if status != 200:
+            sys.exit(f'[!] Could not log in as {email}: {status} {body!r}')
+        tokens.append(json.loads(body)['token'])
+
+    registrations = iter(range(10**9))
+    ctx = {
+        'rng': rng,
+        'emails': emails,
+        'password': PASSWORD,
+        'post_ids': post_ids,
+        'registrations': registrations,
+        'auth': lambda i: {
+            'Authorization': f'Bearer {tokens[i % len(tokens)]}'
+        },
+    }
+
+    results = {}
+    for name in workloads:
+        build = WORKLOADS[name]
+        if args.warmup:
+            run_workload(client, ctx, build, args.warmup, 1, queries)
+        stats = run_workload(client, ctx, build, args.requests,
+                             args.concurrency, queries)
+        results[name] = stats
+        print(f'[+] {name:<12} p50 {stats["p50_ms"]:>8.2f}ms  '
+              f'p95 {stats["p95_ms"]:>8.2f}ms  '
+              f'p99 {stats["p99_ms"]:>8.2f}ms  '
+              f'{stats["throughput_rps"]:>8.1f} req/s  '
+              f'{stats["queries_per_request"]:>6.2f} queries/req'
+              + (f'  {stats["errors"]} errors' if stats['errors'] else ''))
+
+    if server is not None:
+        server.shutdown()
+    # Written out before the scratch directory is removed
+    Logger.flush()
+
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'mode': 'server' if args.server else 'test_client',
+            'concurrency': args.concurrency,
+            'bcrypt_rounds': hasher.rounds,
+            'seed': counts,
+        },
+        'results': results,
+    }
+    if args.compare:
+        with open(os.path.join(cwd, args.compare)) as f:
+            compare(results, json.load(f))
+    if args.save:
+        path = os.path.join(cwd, args.save)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'[+] Saved results to {path}')
+    return report
+
+
+if __name__ == '__main__':
+    main()
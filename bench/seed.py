@@ -0,0 +1,136 @@
+'''
+Fills the database with synthetic users, friendships, posts, likes and
+comments for benchmarking. Rows are built through the models in
+`database.py` and inserted in bulk, so large data sets seed quickly.
+'''
+import random
+from datetime import datetime, timedelta
+
+from database import (Friendship, PostComment, PostLike, PostModel,
+                      TimelineEntry, UserAccount, db)
+from passwords import hasher
+
+PASSWORD = 'benchmark-password'
+
+
+def email_for(i: int) -> str:
+    return f'bench{i}@example.com'
+
+
+def seed(users=100,
+         posts=1000,
+         likes=5000,
+         comments=2000,
+         friends=10,
+         seed=0) -> dict:
+    '''
+    Seeds the database of the current app context. Every user's password is
+    `PASSWORD`. Returns the counts of the rows created.
+    '''
+    rng = random.Random(seed)
+    now = datetime.now()
+    # One bcrypt hash shared by every user; hashing each would dominate
+    password_hash = hasher.hash(PASSWORD)
+
+    accounts = []
+    for i in range(users):
+        user = UserAccount(first_name=f'Bench{i}',
+                           last_name='User',
+                           handle=f'bench{i}',
+                           email=email_for(i),
+                           password_hash=password_hash,
+                           education_level='Bachelors',
+                           account_type='Student')
+        user.created_at = user.updated_at = now - timedelta(days=30)
+        accounts.append(user)
+    db.session.add_all(accounts)
+    db.session.commit()
+    user_ids = [user.id for user in accounts]
+
+    # Accepted friendships are stored as a pair of edges
+    pairs = set()
+    for user_id in user_ids:
+        for friend_id in rng.sample(user_ids, min(friends, len(user_ids))):
+            if friend_id != user_id:
+                pairs.add((min(user_id, friend_id), max(user_id, friend_id)))
+    friend_count = dict.fromkeys(user_ids, 0)
+    edges = []
+    for a, b in pairs:
+        created_at = now - timedelta(days=rng.randint(1, 29))
+        for user_id, friend_id in ((a, b), (b, a)):
+            edges.append({
+                'user_id': user_id,
+                'friend_id': friend_id,
+                'status': Friendship.ACCEPTED,
+                'created_at': created_at
+            })
+            friend_count[user_id] += 1
+    db.session.bulk_insert_mappings(Friendship, edges)
+    db.session.bulk_update_mappings(UserAccount, [{
+        'id': user_id,
+        'friend_count': count
+    } for user_id, count in friend_count.items()])
+    db.session.commit()
+
+    post_rows = []
+    for i in range(posts):
+        post = PostModel(content=f'Benchmark post {i}',
+                         owner_id=rng.choice(user_ids))
+        post.created_at = now - timedelta(seconds=rng.randint(0, 29 * 86400))
+        post_rows.append(post)
+    db.session.add_all(post_rows)
+    db.session.commit()
+
+    friends_of = {user_id: [] for user_id in user_ids}
+    for edge in edges:
+        friends_of[edge['user_id']].append(edge['friend_id'])
+    timeline = []
+    for post in post_rows:
+        for user_id in [post.owner_id, *friends_of[post.owner_id]]:
+            timeline.append({
+                'user_id': user_id,
+                'post_id': post.id,
+                'created_at': post.created_at
+            })
+    db.session.bulk_insert_mappings(TimelineEntry, timeline)
+
+    post_ids = [post.id for post in post_rows]
+    like_pairs = set()
+    for _ in range(min(likes, len(post_ids) * len(user_ids))):
+        like_pairs.add((rng.choice(post_ids), rng.choice(user_ids)))
+    db.session.bulk_insert_mappings(PostLike, [{
+        'post_id': post_id,
+        'user_id': user_id,
+        'created_at': now
+    } for post_id, user_id in like_pairs])
+
+    comment_rows = []
+    for i in range(comments if post_ids else 0):
+        comment_rows.append({
+            'post_id': rng.choice(post_ids),
+            'owner_id': rng.choice(user_ids),
+            'content': f'Benchmark comment {i}',
+            'created_at': now - timedelta(seconds=rng.randint(0, 86400))
+        })
+    db.session.bulk_insert_mappings(PostComment, comment_rows)
+
+    like_count = dict.fromkeys(post_ids, 0)
+    for post_id, _ in like_pairs:
+        like_count[post_id] += 1
+    comment_count = dict.fromkeys(post_ids, 0)
+    for row in comment_rows:
+        comment_count[row['post_id']] += 1
+    db.session.bulk_update_mappings(PostModel, [{
+        'id': post_id,
+        'like_count': like_count[post_id],
+        'comment_count': comment_count[post_id]
+    } for post_id in post_ids])
+    db.session.commit()
+
+    return {
+        'users': len(user_ids),
+        'friendships': len(pairs),
+        'posts': len(post_ids),
+        'likes': len(like_pairs),
+        'comments': len(comment_rows),
+    }
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    '''
+    Thread safe, size bounded LRU cache whose entries expire after a
+    per-entry deadline.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        '''Returns the cached value for `key`, or `default` if missing or expired.'''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None) -> None:
+        '''Caches `value` under `key` for `ttl` seconds (defaults to `self.ttl`).'''
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate) -> None:
+        '''Removes every entry whose value satisfies `predicate`.'''
+        with self._lock:
+            for key in [k for k, (_, v) in self._data.items() if predicate(v)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Decoded bearer tokens, keyed by token signature.
+# Values are `(user_id, token, detached UserAccount snapshot)`.
+auth_cache = TTLCache()
+
+
+def invalidate_user(user_id) -> None:
+    '''Drops every cached authentication entry for `user_id`.'''
+    if user_id is None:
+        return
+    user_id = int(user_id)
+    auth_cache.delete_where(lambda entry: entry[0] == user_id)
+
+
+# Friend suggestions, keyed by user id. Values are lists of
+# `(candidate_id, score, reasons)` read from `FriendSuggestion`.
+suggestion_cache = TTLCache(maxsize=4096, ttl=3600)
+
+# Users whose suggestions should be recomputed by the next suggestion job run
+_stale_suggestions = set()
+_stale_lock = threading.Lock()
+
+
+def invalidate_suggestions(*user_ids) -> None:
+    '''
+    Drops the cached suggestions of `user_ids` and queues them to be
+    recomputed, e.g. after their interests or friendships change.
+    '''
+    user_ids = [int(user_id) for user_id in user_ids if user_id is not None]
+    for user_id in user_ids:
+        suggestion_cache.delete(user_id)
+    with _stale_lock:
+        _stale_suggestions.update(user_ids)
+
+
+def pop_stale_suggestions() -> set:
+    '''Returns and clears the users queued by `invalidate_suggestions`.'''
+    with _stale_lock:
+        stale = set(_stale_suggestions)
+        _stale_suggestions.clear()
+    return stale
@@ -0,0 +1,91 @@
+import gzip
+
+from flask import request
+
+from cache import TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Compressor:
+    '''
+    Compresses responses with brotli or gzip, whichever the client prefers
+    in `Accept-Encoding`. Responses smaller than `COMPRESS_MIN_SIZE`, of a
+    type outside `COMPRESS_MIMETYPES`, streamed, partial or already encoded
+    are sent as they are.
+
+    Responses carrying an ETag are versioned, so their compressed bodies are
+    kept in an LRU keyed by URL, ETag and encoding; a repeated request for
+    an unchanged resource skips recompression.
+    '''
+
+    def __init__(self):
+        self.cache = TTLCache()
+        self.settings = {}
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIMETYPES', {
+            'application/json', 'text/html', 'text/plain', 'text/css',
+            'application/javascript'
+        })
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BR_LEVEL', 4)
+        app.config.setdefault('COMPRESS_CACHE_SIZE', 512)
+        app.config.setdefault('COMPRESS_CACHE_TTL', 600)
+        self.settings = app.config
+        self.cache.maxsize = app.config['COMPRESS_CACHE_SIZE']
+        self.cache.ttl = app.config['COMPRESS_CACHE_TTL']
+        app.after_request(self.after_request)
+
+    @property
+    def encodings(self) -> list:
+        '''Supported encodings, in order of preference on equal quality.'''
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(data,
+                                   quality=self.settings['COMPRESS_BR_LEVEL'])
+        return gzip.compress(data,
+                             compresslevel=self.settings['COMPRESS_GZIP_LEVEL'],
+                             mtime=0)
+
+    def _should_compress(self, response) -> bool:
+        return (200 <= response.status_code < 300
+                and response.status_code != 206
+                and not response.direct_passthrough
+                and not response.is_streamed
+                and 'Content-Encoding' not in response.headers
+                and response.mimetype in self.settings['COMPRESS_MIMETYPES']
+                and (response.content_length or 0) >=
+                self.settings['COMPRESS_MIN_SIZE'])
+
+    def after_request(self, response):
+        response.vary.add('Accept-Encoding')
+        if not self._should_compress(response):
+            return response
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        key = (request.full_path, etag, encoding) if etag else None
+        body = self.cache.get(key) if key else None
+        if body is None:
+            body = self.compress(response.get_data(), encoding)
+            if key:
+                self.cache.set(key, body)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag and not weak:
+            # The compressed body is a different byte sequence
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compressor = Compressor()
@@ -1,19 +1,279 @@
 import json
+import random
+import sqlite3
+from contextlib import contextmanager
 import jwt
 from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exists, func, literal, or_, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.pool import QueuePool
 from datetime import datetime, timedelta
-from bcrypt import checkpw
+
+from cache import invalidate_suggestions, invalidate_user
+from logs.Logger import log_error
+from passwords import hasher
+from serialization import serializer, timestamp, wants
 
 db = SQLAlchemy()
 
+# PRAGMAs applied to every new SQLite connection, per `DATABASE_PROFILE`.
+SQLITE_PROFILES = {
+    'development': {
+        'busy_timeout': 5000,
+    },
+    'production': {
+        # Readers no longer block behind writers (and vice versa)
+        'journal_mode': 'WAL',
+        # Safe with WAL; only fsyncs at checkpoints
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        # Negative values are in KiB, so this is 64MB of page cache
+        'cache_size': -64000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+}
+_sqlite_pragmas = {}
+
+
+@event.listens_for(Engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in _sqlite_pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+def configure_database(app) -> None:
+    '''
+    Fills in `SQLALCHEMY_ENGINE_OPTIONS` and the SQLite PRAGMAs from the
+    app's database settings. Must run before `db.init_app(app)`.
+    '''
+    app.config.setdefault('DATABASE_PROFILE', 'development')
+    app.config.setdefault('DATABASE_POOL_SIZE', 5)
+    app.config.setdefault('DATABASE_MAX_OVERFLOW', 10)
+    app.config.setdefault('DATABASE_POOL_RECYCLE', 1800)
+    app.config.setdefault('SQLITE_PRAGMAS', {})
+
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    options.setdefault('pool_pre_ping', True)
+
+    if not uri.startswith('sqlite'):
+        options.setdefault('pool_size', app.config['DATABASE_POOL_SIZE'])
+        options.setdefault('max_overflow', app.config['DATABASE_MAX_OVERFLOW'])
+        options.setdefault('pool_recycle', app.config['DATABASE_POOL_RECYCLE'])
+        return
+
+    if uri not in ('sqlite://', 'sqlite:///:memory:'):
+        # File databases default to opening a connection per checkout
+        options.setdefault('poolclass', QueuePool)
+        options.setdefault('pool_size', app.config['DATABASE_POOL_SIZE'])
+        options.setdefault('max_overflow', app.config['DATABASE_MAX_OVERFLOW'])
+        options.setdefault('connect_args', {'check_same_thread': False})
+
+    _sqlite_pragmas.clear()
+    _sqlite_pragmas.update(SQLITE_PROFILES[app.config['DATABASE_PROFILE']])
+    _sqlite_pragmas.update(app.config['SQLITE_PRAGMAS'])
+
+
+def commit() -> None:
+    '''
+    Commits the session, or inside a unit of work only flushes it, so ids
+    are assigned and constraint errors surface where they happen; the unit
+    commits once when it ends. Model mutators call this rather than
+    `db.session.commit()`.
+    '''
+    if db.session.info.get('unit_of_work') is not None:
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def after_commit(callback, *args) -> None:
+    '''
+    Runs `callback(*args)` now, or once the open unit of work has
+    committed. Used for cache invalidation, so another thread cannot cache
+    the old row again between the invalidation and the commit.
+    '''
+    unit = db.session.info.get('unit_of_work')
+    if unit is not None:
+        unit['commit'].append((callback, args))
+    else:
+        callback(*args)
+
+
+def after_rollback(callback, *args) -> None:
+    '''
+    Runs `callback(*args)` if the open unit of work is rolled back instead
+    of committed; outside a unit, never. Used to undo work done outside the
+    session, such as media references, when a request fails.
+    '''
+    unit = db.session.info.get('unit_of_work')
+    if unit is not None:
+        unit['rollback'].append((callback, args))
+
+
+def rollback() -> None:
+    '''
+    Rolls back the session, e.g. after a constraint error. Inside a unit of
+    work, its rollback callbacks run and its after-commit callbacks are
+    dropped; the unit stays open for the rest of the request.
+    '''
+    db.session.rollback()
+    unit = db.session.info.get('unit_of_work')
+    if unit is not None:
+        callbacks = unit['rollback']
+        unit['commit'] = []
+        unit['rollback'] = []
+        _run_rollback_callbacks(callbacks)
+
+
+def _run_rollback_callbacks(callbacks) -> None:
+    # Already failing; a callback error must not hide the original one
+    for callback, args in callbacks:
+        try:
+            callback(*args)
+        except Exception as e:
+            log_error('Rollback callback failed',
+                      callback=getattr(callback, '__qualname__', None),
+                      error=repr(e))
+
+
+def _begin_unit() -> None:
+    db.session.info['unit_of_work'] = {'commit': [], 'rollback': []}
+
+
+def _end_unit(success: bool) -> None:
+    unit = db.session.info.pop('unit_of_work', None)
+    if unit is None:
+        return
+    if not success:
+        db.session.rollback()
+        _run_rollback_callbacks(unit['rollback'])
+        return
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _run_rollback_callbacks(unit['rollback'])
+        raise
+    for callback, args in unit['commit']:
+        callback(*args)
+
+
+@contextmanager
+def unit_of_work():
+    '''
+    Defers the `commit()` calls made inside to a single commit at the end,
+    or rolls everything back if an exception escapes. Nested units join the
+    outermost one.
+    '''
+    if db.session.info.get('unit_of_work') is not None:
+        yield
+        return
+    _begin_unit()
+    try:
+        yield
+    except BaseException:
+        _end_unit(False)
+        raise
+    _end_unit(True)
+
+
+class BulkWriter:
+    '''
+    Groups many mutations into transactions of `chunk_size` steps, for
+    imports and admin jobs:
+
+        with BulkWriter(1000) as batch:
+            for row in rows:
+                UserAccount.query.get(row['id']).update(row)
+                batch.step()
+
+    Commits made by the mutators are deferred, and every `chunk_size` steps
+    the chunk is committed at once. An exception rolls back only the
+    current chunk; `committed` counts the steps already durable.
+    '''
+
+    def __init__(self, chunk_size: int = 1000):
+        self.chunk_size = max(1, chunk_size)
+        self.pending = 0
+        self.committed = 0
+        self._outer = None
+
+    def __enter__(self) -> 'BulkWriter':
+        # Work already pending in an enclosing unit goes out with the first
+        # chunk; the enclosing unit carries on afterwards.
+        self._outer = db.session.info.pop('unit_of_work', None)
+        _begin_unit()
+        return self
+
+    def step(self, count: int = 1) -> None:
+        '''Records `count` mutations, committing once a chunk is full.'''
+        self.pending += count
+        if self.pending >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        '''Commits the current chunk, however small.'''
+        _end_unit(True)
+        self.committed += self.pending
+        self.pending = 0
+        _begin_unit()
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.flush()
+        _end_unit(False)
+        if self._outer is not None:
+            db.session.info['unit_of_work'] = self._outer
+        return False
+
+
+def init_unit_of_work(app) -> None:
+    '''
+    With `DATABASE_UNIT_OF_WORK`, each request runs in a unit of work: one
+    commit after the view returns, or a rollback if it failed or answered
+    with a server error. Call after `metrics.init_app(app)`, so the commit
+    is timed with the request.
+    '''
+    app.config.setdefault('DATABASE_UNIT_OF_WORK', True)
+    if not app.config['DATABASE_UNIT_OF_WORK']:
+        return
+
+    def commit_request(response):
+        _end_unit(response.status_code < 500)
+        return response
+
+    def rollback_request(exc=None):
+        _end_unit(False)
+
+    app.before_request(_begin_unit)
+    app.after_request(commit_request)
+    app.teardown_request(rollback_request)
+
 
 class UserAccount(db.Model):
+    __table_args__ = (db.Index('ix_user_account_created_at', 'created_at'), )
+
     id = db.Column(db.Integer, primary_key=True)
     avatar_uri = db.Column(db.String(256), nullable=True, default=None)
+    avatar_key = db.Column(db.String(80),
+                           db.ForeignKey('media_blob.key'),
+                           nullable=True)
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
-    handle = db.Column(db.String(50), nullable=False, default=None)
+    handle = db.Column(db.String(50),
+                       nullable=False,
+                       default=None,
+                       unique=True,
+                       index=True)
 
     occupation = db.Column(db.String(50), nullable=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -27,7 +287,10 @@ class UserAccount(db.Model):
 
     posts_ids = db.Column(db.Text, default='[]')
     interests = db.Column(db.String(120), default='[]')
-    friend_ids = db.Column(db.String(120), default='[]')
+    friend_count = db.Column(db.Integer,
+                             nullable=False,
+                             default=0,
+                             server_default='0')
 
     # public, private, and friends
     privacy_setting = db.Column(db.String(120), default='public')
@@ -68,34 +331,71 @@ class UserAccount(db.Model):
     def __str__(self) -> str:
         return f"<UserAccount {self.id}>"
 
-    def to_json(self) -> dict:
-        '''Returns a dictionary representation of the UserAccount object.'''
-        return {
-            'id': self.id,
-            'avatar_uri': self.avatar_uri,
-            'first_name': self.first_name,
-            'last_name': self.last_name,
-            'handle': self.handle,
-            'occupation': self.occupation,
-            'email': self.email,
-            'reset_token': self.reset_token,
-            'reset_token_expiration': self.reset_token_expiration,
-            'location': self.location,
-            'bio': self.bio,
-            'website': self.website,
-            'posts_ids': self.posts_ids,
-            'interests': self.interests,
-            'friend_ids': self.friend_ids,
-            'privacy_setting': self.privacy_setting,
-            'education_level': self.education_level,
-            'education_major': self.education_major,
-            'education_institution': self.education_institution,
-            'organization_name': self.organization_name,
-            'years_in_business': self.years_in_business,
-            'account_type': self.account_type,
-            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S'),
-        }
+    # Serializable fields in output order: an attribute name, or a getter
+    # taking the user and a context holding the `blobs` map. Secrets such as
+    # the password hash and reset token are never exposed.
+    JSON_FIELDS = {
+        'id': 'id',
+        'avatar_uri': 'avatar_uri',
+        'avatar_variants':
+        lambda user, ctx: MediaBlob.variant_urls(
+            user.avatar_uri, ctx['blobs'].get(user.avatar_key)),
+        'first_name': 'first_name',
+        'last_name': 'last_name',
+        'handle': 'handle',
+        'occupation': 'occupation',
+        'email': 'email',
+        'location': 'location',
+        'bio': 'bio',
+        'website': 'website',
+        'posts_ids': 'posts_ids',
+        'interests': 'interests',
+        'friend_count': 'friend_count',
+        'privacy_setting': 'privacy_setting',
+        'education_level': 'education_level',
+        'education_major': 'education_major',
+        'education_institution': 'education_institution',
+        'organization_name': 'organization_name',
+        'years_in_business': 'years_in_business',
+        'account_type': 'account_type',
+        'created_at': timestamp('created_at'),
+        'updated_at': timestamp('updated_at'),
+    }
+    JSON_DEFAULT_FIELDS = tuple(JSON_FIELDS)
+
+    def to_json(self, fields: tuple = None, blobs: dict = None) -> dict:
+        '''
+        Returns a dictionary representation of the UserAccount object,
+        limited to `fields` if given. `blobs` maps media keys to already
+        loaded `MediaBlob` rows; the avatar's blob is fetched when needed.
+        '''
+        fields = fields or self.JSON_DEFAULT_FIELDS
+        if blobs is None:
+            blobs = MediaBlob.get_many(
+                [self.avatar_key] if 'avatar_variants' in fields else [])
+        return serializer(UserAccount, fields)(self, {'blobs': blobs})
+
+    @staticmethod
+    def to_json_many(users: list, fields: tuple = None) -> list:
+        '''
+        Returns a list of dictionary representations of `users`, loading all
+        of their avatar blobs with a single query.
+        '''
+        fields = fields or UserAccount.JSON_DEFAULT_FIELDS
+        blobs = {}
+        if 'avatar_variants' in fields:
+            blobs = MediaBlob.get_many(user.avatar_key for user in users)
+        serialize = serializer(UserAccount, fields)
+        return [serialize(user, {'blobs': blobs}) for user in users]
+
+    @staticmethod
+    def get_many(user_ids) -> dict:
+        '''Returns a `{id: UserAccount}` map for `user_ids` using a single query.'''
+        user_ids = set(user_ids)
+        if not user_ids:
+            return {}
+        users = UserAccount.query.filter(UserAccount.id.in_(user_ids)).all()
+        return {user.id: user for user in users}
 
     def update(self, data: dict):
         '''Updates the UserAccount object with the provided data.'''
@@ -104,46 +404,171 @@ class UserAccount(db.Model):
                 self.created_at = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
             elif key == 'updated_at':
                 self.updated_at = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+            elif key == 'interests':
+                self.set_interests(
+                    self.parse_interests(value)
+                    if isinstance(value, str) else value)
             else:
                 setattr(self, key, value)
-        db.session.commit()
+        commit()
+        after_commit(invalidate_user, self.id)
+        if data.keys() & {'interests', 'education_institution',
+                          'education_major'}:
+            after_commit(invalidate_suggestions, self.id)
         return
 
     def check_password(self, hash) -> bool:
-        '''Returns `True` if the provided password hash matches the password hash in the database.'''
-        return checkpw(hash.encode('utf-8'), self.password_hash)
+        '''
+        Returns `True` if the provided password hash matches the password hash in the database.
+        Raises `HasherBusy` if the password hashing queue is saturated.
+        '''
+        return hasher.verify(hash, self.password_hash)
 
-    def add_friend(self, friend_id):
-        '''Adds a friend to the list of friends.'''
-        if friend_id not in self.friend_ids:
-            self.friend_ids.append(friend_id)
-            self.save()
+    def add_friend(self, friend_id) -> str:
+        '''
+        Sends a friend request to `friend_id`, or accepts theirs if they
+        already sent one. Returns the resulting friendship status.
+        '''
+        friend_id = int(friend_id)
+        outgoing = Friendship.query.get((self.id, friend_id))
+        if outgoing:
+            return outgoing.status
 
-    def remove_friend(self, friend_id):
-        '''Removes a friend from the list of friends.'''
-        if friend_id in self.friend_ids:
-            self.friend_ids.remove(friend_id)
-            self.save()
+        incoming = Friendship.query.get((friend_id, self.id))
+        if incoming:
+            incoming.status = Friendship.ACCEPTED
+            db.session.add(
+                Friendship(user_id=self.id,
+                           friend_id=friend_id,
+                           status=Friendship.ACCEPTED))
+            UserAccount._change_friend_count([self.id, friend_id], 1)
+            TimelineEntry.backfill(self.id, friend_id)
+            TimelineEntry.backfill(friend_id, self.id)
+        else:
+            db.session.add(
+                Friendship(user_id=self.id,
+                           friend_id=friend_id,
+                           status=Friendship.PENDING))
+        commit()
+        after_commit(invalidate_suggestions, self.id, friend_id)
+        return Friendship.ACCEPTED if incoming else Friendship.PENDING
+
+    def remove_friend(self, friend_id) -> bool:
+        '''
+        Removes a friend, or cancels / declines a pending request.
+        Returns `True` if anything was removed.
+        '''
+        friend_id = int(friend_id)
+        was_friend = self.is_friend(friend_id)
+        removed = Friendship.query.filter(
+            or_(
+                (Friendship.user_id == self.id) &
+                (Friendship.friend_id == friend_id),
+                (Friendship.user_id == friend_id) &
+                (Friendship.friend_id == self.id))).delete(
+                    synchronize_session='evaluate')
+        if was_friend:
+            UserAccount._change_friend_count([self.id, friend_id], -1)
+            TimelineEntry.remove_between(self.id, friend_id)
+        commit()
+        if removed:
+            after_commit(invalidate_suggestions, self.id, friend_id)
+        return bool(removed)
 
-    def is_friend(self, friend_id):
+    def is_friend(self, friend_id) -> bool:
         '''Returns `True` if the user is friends with the provided user id.'''
-        return friend_id in self.friend_ids
+        return self.friendship_status(friend_id) == Friendship.ACCEPTED
+
+    def friendship_status(self, friend_id) -> str or None:
+        '''
+        Returns `'accepted'` if the users are friends, `'pending'` if this user
+        sent a request, `'requested'` if `friend_id` sent one, else `None`.
+        '''
+        outgoing = Friendship.query.get((self.id, int(friend_id)))
+        if outgoing:
+            return outgoing.status
+        if Friendship.query.get((int(friend_id), self.id)):
+            return Friendship.REQUESTED
+        return None
+
+    def mutual_friend_count(self, other_id) -> int:
+        '''Returns the number of friends this user has in common with `other_id`.'''
+        mine = aliased(Friendship)
+        theirs = aliased(Friendship)
+        return db.session.query(func.count()).select_from(mine).join(
+            theirs, theirs.friend_id == mine.friend_id).filter(
+                mine.user_id == self.id, mine.status == Friendship.ACCEPTED,
+                theirs.user_id == int(other_id),
+                theirs.status == Friendship.ACCEPTED).scalar()
+
+    @staticmethod
+    def _change_friend_count(user_ids, delta: int) -> None:
+        UserAccount.query.filter(UserAccount.id.in_(user_ids)).update(
+            {
+                UserAccount.friend_count: UserAccount.friend_count + delta,
+                UserAccount.updated_at: datetime.now()
+            },
+            synchronize_session='evaluate')
+        for user_id in user_ids:
+            after_commit(invalidate_user, user_id)
+
+    @staticmethod
+    def normalize_interest(interest) -> str:
+        '''Interests compare case insensitively, ignoring surrounding spaces.'''
+        return str(interest).strip().lower()
+
+    @staticmethod
+    def parse_interests(value) -> list:
+        '''Decodes an `interests` column value, tolerating bad JSON.'''
+        try:
+            interests = json.loads(value or '[]')
+        except ValueError:
+            return []
+        return interests if isinstance(interests, list) else []
+
+    def get_interests(self) -> list:
+        '''Returns the decoded `interests` JSON list.'''
+        return self.parse_interests(self.interests)
+
+    @staticmethod
+    def encode_interests(interests) -> str:
+        '''Encodes `interests` as a JSON list, without duplicates.'''
+        seen = set()
+        unique = []
+        for interest in interests or []:
+            key = UserAccount.normalize_interest(interest)
+            if key and key not in seen:
+                seen.add(key)
+                unique.append(str(interest).strip())
+        return json.dumps(unique)
+
+    def set_interests(self, interests) -> None:
+        '''Stores `interests` as a JSON list, without duplicates.'''
+        self.interests = self.encode_interests(interests)
 
     def shares_interest(self, interest):
         '''Returns `True` if the user shares an interest with the provided interest.'''
-        return interest in self.interests
+        return self.normalize_interest(interest) in {
+            self.normalize_interest(i) for i in self.get_interests()
+        }
 
     def add_interest(self, interest):
         '''Adds an interest to the list of interests.'''
-        if interest not in self.interests:
-            self.interests.append(interest)
+        if not self.shares_interest(interest):
+            self.set_interests(self.get_interests() + [interest])
             self.save()
+            after_commit(invalidate_suggestions, self.id)
 
     def remove_interest(self, interest):
         '''Removes an interest from the list of interests.'''
-        if interest in self.interests:
-            self.interests.remove(interest)
+        if self.shares_interest(interest):
+            interest = self.normalize_interest(interest)
+            self.set_interests([
+                i for i in self.get_interests()
+                if self.normalize_interest(i) != interest
+            ])
             self.save()
+            after_commit(invalidate_suggestions, self.id)
 
     def add_post(self, post_id):
         '''Adds a post to the list of posts.'''
@@ -171,35 +596,327 @@ class UserAccount(db.Model):
 
     def save(self) -> None:
         db.session.add(self)
-        db.session.commit()
+        commit()
 
-    def delete(self):
+    def delete(self) -> list:
+        '''
+        Deletes the user together with their posts, likes, comments,
+        timeline entries, friendships and suggestions, and takes their likes
+        and comments off the counts of other users' posts. Returns the media
+        keys of the avatar and posts, for the caller to release once the
+        deletion is committed.
+        '''
+        posts = db.session.query(PostModel.id, PostModel.image_key).filter_by(
+            owner_id=self.id).all()
+        post_ids = [post_id for post_id, _ in posts]
+
+        for counter, model, owner_id in (
+            (PostModel.like_count, PostLike, PostLike.user_id),
+            (PostModel.comment_count, PostComment, PostComment.owner_id),
+        ):
+            own = select(func.count()).where(
+                model.post_id == PostModel.id,
+                owner_id == self.id).scalar_subquery()
+            PostModel.query.filter(
+                PostModel.id.in_(
+                    select(model.post_id).where(owner_id == self.id)),
+                PostModel.owner_id != self.id).update(
+                    {
+                        counter: counter - own,
+                        PostModel.version: PostModel.version + 1
+                    },
+                    synchronize_session=False)
+        PostLike.query.filter(
+            or_(PostLike.user_id == self.id,
+                PostLike.post_id.in_(post_ids))).delete(
+                    synchronize_session=False)
+        PostComment.query.filter(
+            or_(PostComment.owner_id == self.id,
+                PostComment.post_id.in_(post_ids))).delete(
+                    synchronize_session=False)
+        TimelineEntry.query.filter(
+            or_(TimelineEntry.user_id == self.id,
+                TimelineEntry.post_id.in_(post_ids))).delete(
+                    synchronize_session=False)
+        PostModel.query.filter_by(owner_id=self.id).delete(
+            synchronize_session=False)
+
+        friend_ids = [
+            friend_id for friend_id, in db.session.query(
+                Friendship.friend_id).filter_by(user_id=self.id,
+                                                status=Friendship.ACCEPTED)
+        ]
+        if friend_ids:
+            UserAccount._change_friend_count(friend_ids, -1)
+        Friendship.query.filter(
+            or_(Friendship.user_id == self.id,
+                Friendship.friend_id == self.id)).delete(
+                    synchronize_session=False)
+        FriendSuggestion.query.filter(
+            or_(FriendSuggestion.user_id == self.id,
+                FriendSuggestion.candidate_id == self.id)).delete(
+                    synchronize_session=False)
         db.session.delete(self)
+        commit()
+        after_commit(invalidate_user, self.id)
+        return [
+            key for key in [self.avatar_key, *(key for _, key in posts)]
+            if key
+        ]
+
+
+class MediaBlob(db.Model):
+    '''
+    An uploaded file, stored once per distinct content under its
+    `<sha256>.<ext>` key and shared by every avatar / post that uses it.
+    '''
+    __tablename__ = 'media_blob'
+
+    key = db.Column(db.String(80), primary_key=True)
+    content_type = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=1)
+    # Variant name -> blob key of the resized copy, once processed
+    variants = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f"<MediaBlob {self.key}>"
+
+    @staticmethod
+    def get_many(keys) -> dict:
+        '''Returns a `{key: MediaBlob}` map for `keys` using a single query.'''
+        keys = {key for key in keys if key}
+        if not keys:
+            return {}
+        return {
+            blob.key: blob
+            for blob in MediaBlob.query.filter(MediaBlob.key.in_(keys))
+        }
+
+    @staticmethod
+    def variant_urls(uri: str, blob) -> dict or None:
+        '''
+        Returns a srcset-style `{variant: url}` map for the file at `uri`.
+        Holds only the original until the blob's variants are processed.
+        '''
+        if not uri:
+            return None
+        urls = {'original': uri}
+        if blob is not None and blob.variants:
+            base = uri.rsplit('/', 1)[0]
+            urls.update({
+                name: f'{base}/{key}'
+                for name, key in blob.variants.items()
+            })
+        return urls
+
+    @staticmethod
+    def set_variants(key, variants: dict) -> bool:
+        '''
+        Records processed variants; `False` if the blob no longer exists.
+        Users and posts showing the blob are touched, since their JSON now
+        lists the variants.
+        '''
+        updated = MediaBlob.query.filter_by(key=key).update(
+            {MediaBlob.variants: variants}, synchronize_session=False)
+        user_ids = [
+            user_id for user_id, in db.session.query(
+                UserAccount.id).filter_by(avatar_key=key)
+        ]
+        if user_ids:
+            UserAccount.query.filter(UserAccount.id.in_(user_ids)).update(
+                {UserAccount.updated_at: datetime.now()},
+                synchronize_session=False)
+        PostModel.query.filter_by(image_key=key).update(
+            {PostModel.version: PostModel.version + 1},
+            synchronize_session=False)
         db.session.commit()
+        for user_id in user_ids:
+            invalidate_user(user_id)
+        return bool(updated)
+
+    # Reference counts are written on a connection of their own and
+    # committed at once, so they stay durable whatever the request's unit
+    # of work later commits or rolls back.
+
+    @staticmethod
+    def create(key, content_type, size) -> None:
+        '''Records a newly stored blob with a single reference.'''
+        table = MediaBlob.__table__
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(table.insert().values(
+                    key=key, content_type=content_type, size=size))
+        except IntegrityError:
+            # Stored concurrently by another upload of the same content
+            MediaBlob.acquire(key)
+
+    @staticmethod
+    def acquire(key) -> bool:
+        '''Takes a reference to an existing blob; `False` if there is none.'''
+        table = MediaBlob.__table__
+        with db.engine.begin() as connection:
+            updated = connection.execute(
+                table.update().where(table.c.key == key).values(
+                    ref_count=table.c.ref_count + 1)).rowcount
+        return bool(updated)
+
+    @staticmethod
+    def release(key, delete) -> None:
+        '''
+        Drops a reference. If it was the last one, the row is deleted and
+        `delete(key)` is called for the original and each variant before the
+        transaction commits: the decrement holds the write lock until then,
+        so a concurrent `acquire` of the same content either kept the blob
+        alive or waits and finds the files gone, and stores them again.
+        '''
+        table = MediaBlob.__table__
+        with db.engine.begin() as connection:
+            connection.execute(
+                table.update().where(table.c.key == key).values(
+                    ref_count=table.c.ref_count - 1))
+            blob = connection.execute(
+                select(table.c.variants).where(
+                    table.c.key == key, table.c.ref_count <= 0)).first()
+            if blob is None:
+                return
+            for freed_key in [key, *(blob.variants or {}).values()]:
+                delete(freed_key)
+            connection.execute(table.delete().where(table.c.key == key))
+
+
+class Friendship(db.Model):
+    '''
+    A directed friendship edge. A request from A to B is stored as
+    `(A, B, 'pending')`; once accepted, both `(A, B)` and `(B, A)` exist
+    with status `'accepted'`, so every lookup starts from `user_id`.
+    '''
+    __tablename__ = 'friendship'
+    __table_args__ = (
+        db.Index('ix_friendship_friend_id_user_id', 'friend_id', 'user_id'),
+        db.Index('ix_friendship_user_id_created_at', 'user_id', 'created_at',
+                 'friend_id'),
+    )
+
+    PENDING = 'pending'
+    ACCEPTED = 'accepted'
+    # Never stored; reported for requests received from the other user
+    REQUESTED = 'requested'
+
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('user_account.id'),
+                        primary_key=True)
+    friend_id = db.Column(db.Integer,
+                          db.ForeignKey('user_account.id'),
+                          primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default=PENDING)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f"<Friendship {self.user_id}:{self.friend_id} {self.status}>"
+
+
+class FriendSuggestion(db.Model):
+    '''
+    A precomputed "people you may know" candidate for `user_id`, written by
+    the suggestion job in `suggestions.py` and read back best score first.
+    '''
+    __tablename__ = 'friend_suggestion'
+    __table_args__ = (db.Index('ix_friend_suggestion_user_id_score',
+                               'user_id', 'score', 'candidate_id'), )
+
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('user_account.id'),
+                        primary_key=True)
+    candidate_id = db.Column(db.Integer,
+                             db.ForeignKey('user_account.id'),
+                             primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    mutual_friends = db.Column(db.Integer, nullable=False, default=0)
+    shared_interests = db.Column(db.Integer, nullable=False, default=0)
+    same_institution = db.Column(db.Boolean, nullable=False, default=False)
+    same_major = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f"<FriendSuggestion {self.user_id}:{self.candidate_id} {self.score}>"
+
+    @staticmethod
+    def for_user(user_id, limit: int) -> list:
+        '''
+        Returns up to `limit` of `user_id`'s suggestions, best first, as
+        `(candidate_id, score, reasons)`. Candidates the user has befriended
+        or exchanged a request with since the last run are left out.
+        '''
+        connected = exists().where(
+            or_(
+                (Friendship.user_id == user_id) &
+                (Friendship.friend_id == FriendSuggestion.candidate_id),
+                (Friendship.user_id == FriendSuggestion.candidate_id) &
+                (Friendship.friend_id == user_id)))
+        rows = FriendSuggestion.query.filter(
+            FriendSuggestion.user_id == user_id, ~connected).order_by(
+                FriendSuggestion.score.desc(),
+                FriendSuggestion.candidate_id.desc()).limit(limit).all()
+        return [(row.candidate_id, row.score, {
+            'mutual_friends': row.mutual_friends,
+            'shared_interests': row.shared_interests,
+            'same_institution': row.same_institution,
+            'same_major': row.same_major,
+        }) for row in rows]
 
 
 class PostModel(db.Model):
+    # Ascending columns: SQLite walks these backwards for the newest-first
+    # listings, which keeps the `id` tie-break free of a temporary sort.
+    __table_args__ = (
+        db.Index('ix_post_model_owner_id_created_at', 'owner_id',
+                 'created_at'),
+        db.Index('ix_post_model_created_at', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
 
     content = db.Column(db.String(120), nullable=False)
 
     location = db.Column(db.String(120), nullable=True)
     image_uri = db.Column(db.String(120), nullable=True)
+    image_key = db.Column(db.String(80),
+                          db.ForeignKey('media_blob.key'),
+                          nullable=True)
 
     owner_id = db.Column(db.Integer,
                          db.ForeignKey('user_account.id'),
                          nullable=False)
 
-    liked_by = db.Column(db.Text, nullable=False, default='[]')
-    comments = db.Column(db.JSON, nullable=False, default='{}')
+    like_count = db.Column(db.Integer,
+                           nullable=False,
+                           default=0,
+                           server_default='0')
+    comment_count = db.Column(db.Integer,
+                              nullable=False,
+                              default=0,
+                              server_default='0')
+    # Bumped on every change to the post or its counters; used for ETags
+    version = db.Column(db.Integer,
+                        nullable=False,
+                        default=1,
+                        server_default='1')
 
     created_at = db.Column(db.DateTime, nullable=False)
 
-    def __init__(self, content, owner_id, location=None, image_uri=None):
+    def __init__(self,
+                 content,
+                 owner_id,
+                 location=None,
+                 image_uri=None,
+                 image_key=None):
         self.content = content
         self.owner_id = owner_id
         self.location = location
         self.image_uri = image_uri
+        self.image_key = image_key
         self.created_at = datetime.now()
 
     def __repr__(self):
@@ -208,57 +925,505 @@ class PostModel(db.Model):
     def __str__(self):
         return f"<PostModel {self.id}>"
 
-    def to_json(self) -> dict:
-        '''Returns a dictionary representation of the PostModel object.'''
-        return {
-            'id':
-            self.id,
-            'content':
-            self.content,
-            'location':
-            self.location,
-            'image_uri':
-            self.image_uri,
-            'owner_id':
-            self.owner_id,
-            'owner_avatar':
-            UserAccount.query.get(self.owner_id).avatar_uri,
-            'owner_name':
-            UserAccount.query.get(self.owner_id).first_name + ' ' +
-            UserAccount.query.get(self.owner_id).last_name,
-            'owner_handle':
-            UserAccount.query.get(self.owner_id).handle,
-            'liked_by':
-            self.liked_by,
-            'comments':
-            self.comments,
-            'created_at':
-            self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+    # Serializable fields in output order: an attribute name, or a getter
+    # taking the post and a context with `owner`, `liked`, `comments` and
+    # `blobs`, which are only loaded when a field needing them is requested.
+    JSON_FIELDS = {
+        'id': 'id',
+        'content': 'content',
+        'location': 'location',
+        'image_uri': 'image_uri',
+        'image_variants':
+        lambda post, ctx: MediaBlob.variant_urls(
+            post.image_uri, ctx['blobs'].get(post.image_key)),
+        'owner_id': 'owner_id',
+        'owner_avatar':
+        lambda post, ctx: ctx['owner'].avatar_uri if ctx['owner'] else None,
+        'owner_avatar_variants':
+        lambda post, ctx: MediaBlob.variant_urls(
+            ctx['owner'].avatar_uri, ctx['blobs'].get(ctx['owner'].avatar_key))
+        if ctx['owner'] else None,
+        'owner_name':
+        lambda post, ctx: f'{ctx["owner"].first_name} {ctx["owner"].last_name}'
+        if ctx['owner'] else None,
+        'owner_handle':
+        lambda post, ctx: ctx['owner'].handle if ctx['owner'] else None,
+        'like_count': 'like_count',
+        'liked': lambda post, ctx: ctx['liked'],
+        'comment_count': 'comment_count',
+        'comments': lambda post, ctx: ctx['comments'],
+        'created_at': timestamp('created_at'),
+    }
+    JSON_DEFAULT_FIELDS = tuple(JSON_FIELDS)
+    OWNER_FIELDS = ('owner_avatar', 'owner_avatar_variants', 'owner_name',
+                    'owner_handle')
+
+    def to_json(self,
+                fields: tuple = None,
+                owner: UserAccount = None,
+                liked: bool = None,
+                comments: list = None,
+                blobs: dict = None) -> dict:
+        '''
+        Returns a dictionary representation of the PostModel object, limited
+        to `fields` if given. `owner` may be passed in when it has already
+        been loaded, otherwise it is fetched from the database. `liked` tells
+        whether the viewing user likes the post, if known. `comments` is the
+        serialized comment preview and `blobs` maps media keys to `MediaBlob`
+        rows; both are loaded when needed and not given.
+        '''
+        fields = fields or self.JSON_DEFAULT_FIELDS
+        if owner is None and wants(fields, *self.OWNER_FIELDS):
+            owner = self.get_user()
+        if comments is None and 'comments' in fields:
+            comments = PostComment.to_json_many(
+                PostComment.previews([self.id]).get(self.id, []))
+        if blobs is None:
+            keys = []
+            if 'image_variants' in fields:
+                keys.append(self.image_key)
+            if 'owner_avatar_variants' in fields and owner:
+                keys.append(owner.avatar_key)
+            blobs = MediaBlob.get_many(keys)
+        return serializer(PostModel, fields)(self, {
+            'owner': owner,
+            'liked': liked,
+            'comments': comments,
+            'blobs': blobs
+        })
+
+    @staticmethod
+    def to_json_many(posts: list,
+                     viewer_id: int = None,
+                     fields: tuple = None) -> list:
+        '''
+        Returns a list of dictionary representations of `posts`, limited to
+        `fields` if given. Comment previews, the owners of posts and
+        comments, media blobs, and whether `viewer_id` likes each post are
+        each loaded with a single query instead of per post, and only when
+        a requested field needs them.
+        '''
+        fields = fields or PostModel.JSON_DEFAULT_FIELDS
+        previews = {}
+        if 'comments' in fields:
+            previews = PostComment.previews(
+                [post.id for post in posts if post.comment_count])
+        owner_ids = {
+            comment.owner_id
+            for comments in previews.values() for comment in comments
         }
+        if wants(fields, *PostModel.OWNER_FIELDS):
+            owner_ids.update(post.owner_id for post in posts)
+        owners = UserAccount.get_many(owner_ids)
+        keys = []
+        if 'image_variants' in fields:
+            keys += [post.image_key for post in posts]
+        if 'owner_avatar_variants' in fields:
+            keys += [
+                owners[post.owner_id].avatar_key for post in posts
+                if post.owner_id in owners
+            ]
+        blobs = MediaBlob.get_many(keys)
+        liked = set()
+        if viewer_id is not None and 'liked' in fields:
+            liked = PostLike.liked_post_ids(viewer_id,
+                                            [post.id for post in posts])
+
+        serialize = serializer(PostModel, fields)
+        return [
+            serialize(
+                post, {
+                    'owner':
+                    owners.get(post.owner_id),
+                    'liked':
+                    post.id in liked if viewer_id is not None else None,
+                    'comments':
+                    PostComment.to_json_many(previews.get(post.id, []), owners)
+                    if 'comments' in fields else None,
+                    'blobs':
+                    blobs
+                }) for post in posts
+        ]
 
     def get_user(self) -> UserAccount:
         return UserAccount.query.get(self.owner_id)
 
-    def like(self, user_id) -> None:
-        '''Appends a user_id to the liked_by field.'''
-        if user_id not in self.liked_by:
-            self.liked_by = self.liked_by + ',' + user_id
-            self.save()
+    def is_liked_by(self, user_id) -> bool:
+        '''Returns `True` if `user_id` likes this post.'''
+        return self.id in PostLike.liked_post_ids(user_id, [self.id])
 
-    def add_comment(self, user_id: int, comment: str) -> None:
-        '''Appends a json object to the comments field.'''
-        self.comments = self.comments + ',' + json.dumps({
-            'user_id': user_id,
-            'comment': comment,
-        })
-        self.save()
+    def like(self, user_id) -> bool:
+        '''
+        Records a like by `user_id`; liking a post twice is a no-op.
+        Returns `True` if a new like was recorded.
+        '''
+        already_liked = exists().where(PostLike.post_id == self.id).where(
+            PostLike.user_id == user_id)
+        result = db.session.execute(PostLike.__table__.insert().from_select(
+            ['post_id', 'user_id', 'created_at'],
+            select(literal(self.id), literal(int(user_id)),
+                   literal(datetime.now())).where(~already_liked)))
+        if result.rowcount:
+            PostModel.query.filter_by(id=self.id).update(
+                {
+                    PostModel.like_count: PostModel.like_count + 1,
+                    PostModel.version: PostModel.version + 1
+                },
+                synchronize_session='evaluate')
+        commit()
+        return bool(result.rowcount)
+
+    def unlike(self, user_id) -> bool:
+        '''
+        Removes the like by `user_id`; unliking a post twice is a no-op.
+        Returns `True` if a like was removed.
+        '''
+        removed = PostLike.query.filter_by(post_id=self.id,
+                                           user_id=user_id).delete(
+                                               synchronize_session='evaluate')
+        if removed:
+            PostModel.query.filter_by(id=self.id).update(
+                {
+                    PostModel.like_count: PostModel.like_count - 1,
+                    PostModel.version: PostModel.version + 1
+                },
+                synchronize_session='evaluate')
+        commit()
+        return bool(removed)
+
+    def add_comment(self, user_id: int, content: str) -> 'PostComment':
+        '''Adds a comment by `user_id` and returns it.'''
+        comment = PostComment(post_id=self.id,
+                              owner_id=user_id,
+                              content=content)
+        db.session.add(comment)
+        PostModel.query.filter_by(id=self.id).update(
+            {
+                PostModel.comment_count: PostModel.comment_count + 1,
+                PostModel.version: PostModel.version + 1
+            },
+            synchronize_session='evaluate')
+        commit()
+        return comment
 
     def save(self) -> None:
         '''Saves the current PostModel object (`self`) to the database.'''
         db.session.add(self)
-        db.session.commit()
+        commit()
 
     def delete(self) -> None:
         '''Deletes the current PostModel object (`self`) from the database.'''
+        PostLike.query.filter_by(post_id=self.id).delete(
+            synchronize_session=False)
+        PostComment.query.filter_by(post_id=self.id).delete(
+            synchronize_session=False)
+        TimelineEntry.query.filter_by(post_id=self.id).delete(
+            synchronize_session=False)
         db.session.delete(self)
-        db.session.commit()
+        commit()
+
+
+@event.listens_for(UserAccount, 'before_update')
+def _touch_user(mapper, connection, target):
+    target.updated_at = datetime.now()
+
+
+@event.listens_for(PostModel, 'before_update')
+def _bump_post_version(mapper, connection, target):
+    # Incremented in SQL: the loaded value may be behind counter updates
+    target.version = PostModel.version + 1
+
+
+class PostLike(db.Model):
+    '''A like of a post by a user, one row per (post, user) pair.'''
+    __tablename__ = 'post_like'
+
+    post_id = db.Column(db.Integer,
+                        db.ForeignKey('post_model.id'),
+                        primary_key=True)
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('user_account.id'),
+                        primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f"<PostLike {self.post_id}:{self.user_id}>"
+
+    @staticmethod
+    def liked_post_ids(user_id, post_ids) -> set:
+        '''Returns the subset of `post_ids` liked by `user_id`, using a single query.'''
+        if not post_ids:
+            return set()
+        rows = db.session.query(PostLike.post_id).filter(
+            PostLike.user_id == user_id, PostLike.post_id.in_(post_ids))
+        return {post_id for post_id, in rows}
+
+
+class PostComment(db.Model):
+    '''A comment on a post.'''
+    __tablename__ = 'post_comment'
+    __table_args__ = (db.Index('ix_post_comment_post_id_created_at',
+                               'post_id', 'created_at'), )
+
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer,
+                        db.ForeignKey('post_model.id'),
+                        nullable=False)
+    owner_id = db.Column(db.Integer,
+                         db.ForeignKey('user_account.id'),
+                         nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f"<PostComment {self.id}>"
+
+    def to_json(self, owner: UserAccount = None) -> dict:
+        '''Returns a dictionary representation of the PostComment object.'''
+        if owner is None:
+            owner = UserAccount.query.get(self.owner_id)
+        return {
+            'id': self.id,
+            'post_id': self.post_id,
+            'owner_id': self.owner_id,
+            'owner_avatar': owner.avatar_uri if owner else None,
+            'owner_name':
+            f'{owner.first_name} {owner.last_name}' if owner else None,
+            'owner_handle': owner.handle if owner else None,
+            'content': self.content,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+    @staticmethod
+    def to_json_many(comments: list, owners: dict = None) -> list:
+        '''
+        Returns a list of dictionary representations of `comments`.
+        Owners missing from `owners` are loaded with a single query.
+        '''
+        owners = dict(owners or {})
+        missing = {c.owner_id for c in comments} - owners.keys()
+        owners.update(UserAccount.get_many(missing))
+        return [c.to_json(owner=owners.get(c.owner_id)) for c in comments]
+
+    @staticmethod
+    def previews(post_ids, size: int = None) -> dict:
+        '''
+        Returns `{post_id: [PostComment]}` holding the first `size` comments
+        (default `COMMENT_PREVIEW_SIZE`) of each post, using a single query.
+        '''
+        if not post_ids:
+            return {}
+        if size is None:
+            size = current_app.config.get('COMMENT_PREVIEW_SIZE', 3)
+        ranked = db.session.query(
+            PostComment.id.label('id'),
+            func.row_number().over(
+                partition_by=PostComment.post_id,
+                order_by=(PostComment.created_at,
+                          PostComment.id)).label('position')).filter(
+                              PostComment.post_id.in_(post_ids)).subquery()
+        comments = PostComment.query.join(
+            ranked, ranked.c.id == PostComment.id).filter(
+                ranked.c.position <= size).order_by(PostComment.post_id,
+                                                    PostComment.created_at,
+                                                    PostComment.id)
+        previews = {}
+        for comment in comments:
+            previews.setdefault(comment.post_id, []).append(comment)
+        return previews
+
+
+class TimelineEntry(db.Model):
+    '''
+    A post in a user's precomputed home feed. Posts are fanned out to the
+    timelines of the owner and their friends when created; owners with more
+    than `FEED_FANOUT_LIMIT` friends are skipped and merged in at read time.
+    '''
+    __tablename__ = 'timeline_entry'
+    __table_args__ = (db.Index('ix_timeline_entry_user_id_created_at',
+                               'user_id', 'created_at', 'post_id'), )
+
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('user_account.id'),
+                        primary_key=True)
+    post_id = db.Column(db.Integer,
+                        db.ForeignKey('post_model.id'),
+                        primary_key=True)
+    # Copied from the post so the feed is a range scan on this table alone
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<TimelineEntry {self.user_id}:{self.post_id}>"
+
+    @staticmethod
+    def is_high_fanout(user: UserAccount) -> bool:
+        '''Returns `True` if `user`'s posts are merged into feeds at read time.'''
+        return user.friend_count > current_app.config.get(
+            'FEED_FANOUT_LIMIT', 1000)
+
+    @staticmethod
+    def fan_out(post: 'PostModel', owner: UserAccount) -> None:
+        '''Adds `post` to the timelines of its owner and, if feasible, their friends.'''
+        recipients = [owner.id]
+        if not TimelineEntry.is_high_fanout(owner):
+            recipients += [
+                friend_id for friend_id, in db.session.query(
+                    Friendship.friend_id).filter_by(
+                        user_id=owner.id, status=Friendship.ACCEPTED)
+            ]
+        db.session.execute(TimelineEntry.__table__.insert(), [{
+            'user_id': user_id,
+            'post_id': post.id,
+            'created_at': post.created_at
+        } for user_id in recipients])
+        # Trimming costs a query per timeline, so only a random share of
+        # recipients pay it on each write; timelines overshoot the cap by
+        # roughly FEED_TRIM_INTERVAL entries at most.
+        interval = current_app.config.get('FEED_TRIM_INTERVAL', 20)
+        for user_id in recipients:
+            if random.randrange(interval) == 0:
+                TimelineEntry.trim(user_id)
+        commit()
+
+    @staticmethod
+    def trim(user_id) -> None:
+        '''Drops entries beyond the newest `FEED_TIMELINE_MAX` from a timeline.'''
+        cutoff = db.session.query(
+            TimelineEntry.created_at, TimelineEntry.post_id).filter_by(
+                user_id=user_id).order_by(
+                    TimelineEntry.created_at.desc(),
+                    TimelineEntry.post_id.desc()).offset(
+                        current_app.config.get('FEED_TIMELINE_MAX',
+                                               800)).limit(1).first()
+        if not cutoff:
+            return
+        TimelineEntry.query.filter(
+            TimelineEntry.user_id == user_id,
+            or_(
+                TimelineEntry.created_at < cutoff.created_at,
+                (TimelineEntry.created_at == cutoff.created_at) &
+                (TimelineEntry.post_id <= cutoff.post_id))).delete(
+                    synchronize_session=False)
+
+    @staticmethod
+    def backfill(user_id, owner_id) -> None:
+        '''Copies `owner_id`'s most recent posts into `user_id`'s timeline.'''
+        owner = UserAccount.query.get(owner_id)
+        if not owner or TimelineEntry.is_high_fanout(owner):
+            return
+        already_present = exists().where(
+            TimelineEntry.user_id == user_id).where(
+                TimelineEntry.post_id == PostModel.id)
+        recent = select(literal(int(user_id)), PostModel.id,
+                        PostModel.created_at).where(
+                            PostModel.owner_id == owner.id).where(
+                                ~already_present).order_by(
+                                    PostModel.created_at.desc()).limit(
+                                        current_app.config.get(
+                                            'FEED_BACKFILL_POSTS', 20))
+        db.session.execute(TimelineEntry.__table__.insert().from_select(
+            ['user_id', 'post_id', 'created_at'], recent))
+
+    @staticmethod
+    def remove_between(user_id, friend_id) -> None:
+        '''Removes each user's posts from the other's timeline.'''
+        for reader, owner in ((user_id, friend_id), (friend_id, user_id)):
+            owned = select(PostModel.id).where(PostModel.owner_id == owner)
+            TimelineEntry.query.filter(
+                TimelineEntry.user_id == reader,
+                TimelineEntry.post_id.in_(owned)).delete(
+                    synchronize_session=False)
+
+    @staticmethod
+    def high_fanout_friend_ids(user_id) -> list:
+        '''Returns the friends of `user_id` whose posts are not fanned out on write.'''
+        return [
+            friend_id for friend_id, in db.session.query(
+                Friendship.friend_id).join(
+                    UserAccount, UserAccount.id == Friendship.friend_id).
+            filter(
+                Friendship.user_id == user_id,
+                Friendship.status == Friendship.ACCEPTED,
+                UserAccount.friend_count > current_app.config.get(
+                    'FEED_FANOUT_LIMIT', 1000))
+        ]
+
+
+def _hot_queries() -> dict:
+    '''Returns the queries on the request hot paths, keyed by a short name.'''
+    now = datetime.now()
+
+    def newest_first(query, created_col, id_col):
+        after_cursor = or_(created_col < now,
+                           (created_col == now) & (id_col < 1))
+        return query.filter(after_cursor).order_by(created_col.desc(),
+                                                   id_col.desc()).limit(21)
+
+    return {
+        'user by email':
+        UserAccount.query.filter_by(email='').limit(1),
+        'user by handle':
+        UserAccount.query.filter_by(handle='').limit(1),
+        'user by reset token':
+        UserAccount.query.filter_by(reset_token='').limit(1),
+        'users by id':
+        UserAccount.query.filter(UserAccount.id.in_([1, 2])),
+        'user listing':
+        newest_first(UserAccount.query, UserAccount.created_at,
+                     UserAccount.id),
+        'post listing':
+        newest_first(PostModel.query, PostModel.created_at, PostModel.id),
+        'posts by owner':
+        newest_first(PostModel.query.filter_by(owner_id=1),
+                     PostModel.created_at, PostModel.id),
+        'likes by viewer':
+        db.session.query(PostLike.post_id).filter(
+            PostLike.user_id == 1, PostLike.post_id.in_([1, 2])),
+        'comments by post':
+        PostComment.query.filter_by(post_id=1).order_by(
+            PostComment.created_at, PostComment.id).limit(21),
+        'friends by user':
+        newest_first(
+            Friendship.query.filter_by(user_id=1,
+                                       status=Friendship.ACCEPTED),
+            Friendship.created_at, Friendship.friend_id),
+        'timeline by user':
+        newest_first(TimelineEntry.query.filter_by(user_id=1),
+                     TimelineEntry.created_at, TimelineEntry.post_id),
+        'suggestions by user':
+        FriendSuggestion.query.filter_by(user_id=1).order_by(
+            FriendSuggestion.score.desc(),
+            FriendSuggestion.candidate_id.desc()).limit(50),
+    }
+
+
+def check_query_plans() -> list:
+    '''
+    Runs `EXPLAIN QUERY PLAN` for each hot query and prints the plans.
+    Returns the names of queries that fall back to a full table scan or a
+    temporary sort. Only supported on SQLite.
+    '''
+    if db.engine.dialect.name != 'sqlite':
+        return []
+
+    regressions = []
+    for name, query in _hot_queries().items():
+        compiled = query.statement.compile(
+            dialect=db.engine.dialect,
+            compile_kwargs={'render_postcompile': True})
+        params = tuple(compiled.params[key] for key in compiled.positiontup)
+        plan = [
+            row[-1] for row in db.session.connection().exec_driver_sql(
+                f'EXPLAIN QUERY PLAN {compiled}', params)
+        ]
+        slow = [
+            step for step in plan
+            if (step.startswith('SCAN') and 'INDEX' not in step)
+            or 'TEMP B-TREE' in step
+        ]
+        if slow:
+            regressions.append(name)
+            print(f'[!] Query plan for {name}: ' + '; '.join(plan))
+        else:
+            print(f'[?] Query plan for {name}: ' + '; '.join(plan))
+    return regressions
@@ -0,0 +1,167 @@
+import os
+import re
+import sys
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from logs.Logger import log_slow_query, log_warning
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Expanded `IN (?, ?, ?)` lists differ only in length
+_IN_LIST = re.compile(r'\(\s*\?(\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+# Statements seen during the request running on the current thread
+_request = threading.local()
+
+
+class RepeatedQueryError(RuntimeError):
+    '''
+    Raised in `SQL_INSPECT_RAISE` mode when a request repeats a statement
+    more than `SQL_REPEAT_THRESHOLD` times.
+    '''
+
+
+def statement_shape(statement: str) -> str:
+    '''Normalizes `statement` so repeats with different IN lists match.'''
+    return _IN_LIST.sub('(?...)', _SPACE.sub(' ', statement).strip())
+
+
+def parameter_shape(parameters, executemany=False):
+    '''Describes bound parameters by type only, never by value.'''
+    if executemany:
+        rows = list(parameters)
+        return {
+            'rows': len(rows),
+            'first': parameter_shape(rows[0]) if rows else None
+        }
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def call_site(depth=3) -> list:
+    '''
+    Returns the innermost `depth` frames of this application's own code on
+    the current stack, e.g. `database.py:600 in get_user`.
+    '''
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None and len(frames) < depth:
+        path = os.path.abspath(frame.f_code.co_filename)
+        if (path.startswith(ROOT) and path != os.path.abspath(__file__)
+                and f'{os.sep}site-packages{os.sep}' not in path):
+            frames.append(f'{os.path.relpath(path, ROOT)}:{frame.f_lineno} '
+                          f'in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return frames
+
+
+class QueryInspector:
+    '''
+    Development / staging aid that watches the SQL issued by each request.
+    A statement shape repeated more than `SQL_REPEAT_THRESHOLD` times in one
+    request, the usual sign of an N+1 loop, is logged as a warning with the
+    route and the calling code; with `SQL_INSPECT_RAISE` it raises instead,
+    failing the request (and any test making it). Statements slower than
+    `SQL_SLOW_MS` go to the slow query log regardless of the request.
+    '''
+
+    def __init__(self):
+        self.threshold = 5
+        self.slow_seconds = 0.1
+        self.fail_fast = False
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_INSPECT', False)
+        app.config.setdefault('SQL_REPEAT_THRESHOLD', 5)
+        app.config.setdefault('SQL_SLOW_MS', 100)
+        app.config.setdefault('SQL_INSPECT_RAISE', False)
+        if not app.config['SQL_INSPECT']:
+            return
+        self.threshold = app.config['SQL_REPEAT_THRESHOLD']
+        self.slow_seconds = app.config['SQL_SLOW_MS'] / 1000
+        self.fail_fast = app.config['SQL_INSPECT_RAISE']
+        if not event.contains(Engine, 'before_cursor_execute',
+                              self._before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         self._after_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+    def _start_request(self):
+        _request.counts = {}
+        _request.reported = set()
+
+    def _finish_request(self, exc=None):
+        _request.counts = None
+
+    def start_batch(self):
+        '''
+        Restarts repeat counting within the current request, for streamed
+        responses that run the same few queries once per batch.
+        '''
+        if getattr(_request, 'counts', None) is not None:
+            _request.counts = {}
+            _request.reported = set()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        conn.info.setdefault('inspect_start', []).append(time.perf_counter())
+
+    def _handle_error(self, context):
+        if context.connection is not None:
+            starts = context.connection.info.get('inspect_start')
+            if starts:
+                starts.pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        elapsed = time.perf_counter() - conn.info['inspect_start'].pop()
+        if elapsed >= self.slow_seconds:
+            log_slow_query('Slow query',
+                           statement=statement,
+                           parameters=parameter_shape(parameters,
+                                                      executemany),
+                           duration_ms=round(elapsed * 1000, 2),
+                           route=self._route(),
+                           call_site=call_site())
+
+        counts = getattr(_request, 'counts', None)
+        if counts is None:
+            return
+        shape = statement_shape(statement)
+        counts[shape] = counts.get(shape, 0) + 1
+        if counts[shape] <= self.threshold or shape in _request.reported:
+            return
+        _request.reported.add(shape)
+        sites = call_site()
+        message = (f'Statement repeated {counts[shape]} times in '
+                   f'{self._route()}: {shape}')
+        if self.fail_fast:
+            raise RepeatedQueryError(f'{message} (from {" <- ".join(sites)})')
+        log_warning('Repeated query',
+                    statement=shape,
+                    count=counts[shape],
+                    route=self._route(),
+                    call_site=sites)
+
+    @staticmethod
+    def _route() -> str or None:
+        try:
+            rule = request.url_rule
+        except RuntimeError:
+            # Outside of a request, e.g. a background job
+            return None
+        return rule.rule if rule else request.path
+
+
+inspector = QueryInspector()
@@ -1,43 +1,271 @@
 from datetime import datetime
+import atexit
+import json
 import os
+import queue
+import threading
+import time
 
 ACCESS_LOG = os.path.join(os.path.dirname(__file__), 'access.log')
-ERROR_LOG = os.path.join(os.path.dirname(__file__), 'error.log')
+ERROR_LOG = os.path.join(os.path.dirname(__file__), 'errors.log')
+SLOW_QUERY_LOG = os.path.join(os.path.dirname(__file__), 'slow_queries.log')
 
+# Defaults, overridden by `init_app`
+settings = {
+    'LOG_DEBUG': False,
+    'LOG_FLUSH_INTERVAL': 1.0,
+    'LOG_BATCH_SIZE': 256,
+    'LOG_MAX_BYTES': 10 * 1024 * 1024,
+    'LOG_BACKUP_COUNT': 5,
+    # Directory for the log files; defaults to this package's directory
+    'LOG_DIR': None,
+}
 
-def log_access(message):
-    with open(ACCESS_LOG, 'a') as f:
-        f.write(f'[{datetime.now()}]: {message}\n')
-        f.close()
 
+class LogWriter(threading.Thread):
+    '''
+    Background thread that appends queued records to a log file as JSON
+    lines. Records are written in batches, flushed every `LOG_BATCH_SIZE`
+    records or `LOG_FLUSH_INTERVAL` seconds, and the file is rotated once it
+    grows past `LOG_MAX_BYTES`.
+    '''
 
-def log_error(message):
-    with open(ERROR_LOG, 'a') as f:
-        f.write(f'[{datetime.now()}]: {message}\n')
-        f.close()
+    def __init__(self, path):
+        super().__init__(name=f'log-writer-{os.path.basename(path)}',
+                         daemon=True)
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self._file = None
 
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            # The interval runs from the batch's first record, so a steady
+            # trickle of records cannot hold the batch open indefinitely
+            deadline = time.monotonic() + settings['LOG_FLUSH_INTERVAL']
+            try:
+                while len(batch) < settings['LOG_BATCH_SIZE']:
+                    batch.append(
+                        self.queue.get(
+                            timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                pass
+            self._write(batch)
 
-def get_access_log():
-    with open(ACCESS_LOG, 'r') as f:
-        log = f.read()
-        f.close()
-    return log
+    def _write(self, batch):
+        # Callables are control messages from `flush` / `truncate`; run them
+        # once the records queued ahead of them are written.
+        records = [item for item in batch if not callable(item)]
+        if records:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(''.join(
+                json.dumps(record, default=str) + '\n' for record in records))
+            self._file.flush()
+            if self._file.tell() >= settings['LOG_MAX_BYTES']:
+                self._rotate()
+        for item in batch:
+            if callable(item):
+                item()
 
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
 
-def get_error_log():
-    with open(ERROR_LOG, 'r') as f:
-        log = f.read()
-        f.close()
-    return log
+    def _rotate(self):
+        self._close()
+        backups = settings['LOG_BACKUP_COUNT']
+        for i in range(backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+    def _truncate(self):
+        self._close()
+        with open(self.path, 'w') as f:
+            f.write('')
+
+    def write(self, record: dict):
+        self.queue.put(record)
+
+    def flush(self, timeout=5):
+        '''Blocks until every record queued so far is on disk.'''
+        done = threading.Event()
+        self.queue.put(done.set)
+        done.wait(timeout)
+
+    def reopen(self, path, timeout=5):
+        '''Switches to `path` once the records queued so far are written.'''
+        done = threading.Event()
+
+        def switch():
+            self._close()
+            self.path = path
+            done.set()
+
+        self.queue.put(switch)
+        done.wait(timeout)
+
+    def truncate(self, timeout=5):
+        '''Empties the log file once the records queued so far are written.'''
+        done = threading.Event()
+        self.queue.put(lambda: (self._truncate(), done.set()))
+        done.wait(timeout)
+
+
+_access_writer = LogWriter(ACCESS_LOG)
+_error_writer = LogWriter(ERROR_LOG)
+_slow_query_writer = LogWriter(SLOW_QUERY_LOG)
+_access_writer.start()
+_error_writer.start()
+_slow_query_writer.start()
+
+
+@atexit.register
+def flush():
+    '''Writes out all queued log records.'''
+    _access_writer.flush()
+    _error_writer.flush()
+    _slow_query_writer.flush()
+
+
+def init_app(app):
+    '''Reads the `LOG_*` settings from the app config.'''
+    for key, value in settings.items():
+        settings[key] = app.config.setdefault(key, value)
+    if settings['LOG_DIR']:
+        set_log_dir(settings['LOG_DIR'])
+
+
+def set_log_dir(path):
+    '''Moves all log files to the directory `path`.'''
+    global ACCESS_LOG, ERROR_LOG, SLOW_QUERY_LOG
+    os.makedirs(path, exist_ok=True)
+    ACCESS_LOG = os.path.join(path, 'access.log')
+    ERROR_LOG = os.path.join(path, 'errors.log')
+    SLOW_QUERY_LOG = os.path.join(path, 'slow_queries.log')
+    _access_writer.reopen(ACCESS_LOG)
+    _error_writer.reopen(ERROR_LOG)
+    _slow_query_writer.reopen(SLOW_QUERY_LOG)
+
+
+def _record(level, message, fields) -> dict:
+    return {
+        'time': datetime.now().isoformat(),
+        'level': level,
+        'message': message,
+        **fields
+    }
+
+
+def log_access(message, **fields):
+    _access_writer.write(_record('access', message, fields))
+
+
+def log_error(message, **fields):
+    _error_writer.write(_record('error', message, fields))
+
+
+def log_warning(message, **fields):
+    _error_writer.write(_record('warning', message, fields))
+
+
+def log_slow_query(message, **fields):
+    _slow_query_writer.write(_record('slow_query', message, fields))
+
+
+def log_debug(message):
+    '''Prints `message` when `LOG_DEBUG` is enabled; a no-op otherwise.'''
+    if settings['LOG_DEBUG']:
+        print(message)
+
+
+def _read(path, offset=0, limit=1000) -> tuple:
+    '''
+    Reads up to `limit` entries starting at byte `offset`.
+    Returns `(entries, next_offset)`; pass `next_offset` back to continue.
+    '''
+    entries = []
+    if not os.path.exists(path):
+        return entries, offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while len(entries) < limit:
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                # Missing or partially written line
+                break
+            offset += len(line)
+            entries.append(_parse(line))
+    return entries, offset
+
+
+def _tail(path, lines=100, block_size=8192) -> list:
+    '''Returns the last `lines` entries, reading the file backwards in blocks.'''
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= lines:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    return [_parse(line) for line in data.splitlines()[-lines:] if line]
+
+
+def _parse(line: bytes) -> dict:
+    text = line.decode('utf-8', errors='replace').rstrip('\n')
+    try:
+        return json.loads(text)
+    except ValueError:
+        # Entries written before the switch to JSON lines
+        return {'message': text}
+
+
+def get_access_log(offset=0, limit=1000) -> tuple:
+    _access_writer.flush()
+    return _read(ACCESS_LOG, offset, limit)
+
+
+def get_error_log(offset=0, limit=1000) -> tuple:
+    _error_writer.flush()
+    return _read(ERROR_LOG, offset, limit)
+
+
+def get_slow_query_log(offset=0, limit=1000) -> tuple:
+    _slow_query_writer.flush()
+    return _read(SLOW_QUERY_LOG, offset, limit)
+
+
+def tail_access_log(lines=100) -> list:
+    _access_writer.flush()
+    return _tail(ACCESS_LOG, lines)
+
+
+def tail_error_log(lines=100) -> list:
+    _error_writer.flush()
+    return _tail(ERROR_LOG, lines)
+
+
+def tail_slow_query_log(lines=100) -> list:
+    _slow_query_writer.flush()
+    return _tail(SLOW_QUERY_LOG, lines)
 
 
 def clear_access_log():
-    with open(ACCESS_LOG, 'w') as f:
-        f.write('')
-        f.close()
+    _access_writer.truncate()
 
 
 def clear_error_log():
-    with open(ERROR_LOG, 'w') as f:
-        f.write('')
-        f.close()
\ No newline at end of file
+    _error_writer.truncate()
+
+
+def clear_slow_query_log():
+    _slow_query_writer.truncate()
@@ -0,0 +1,251 @@
+import hmac
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from flask import Response, abort, current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Every metric, by name, in registration order
+REGISTRY = {}
+
+# Per-thread shards: `{(metric name, label values): cell}`. Each thread
+# only ever writes its own shard, so recording takes no lock; `/metrics`
+# sums the shards of all threads when scraped. When a thread exits, its
+# shard is folded into `_retired`, so the number of shards stays bounded by
+# the number of live threads rather than growing with every request thread.
+_shards = {}
+_retired = {}
+_shards_lock = threading.Lock()
+_local = threading.local()
+
+# Counters for the request running on the current thread
+_request = threading.local()
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 500, 1000, 5000, 10000, 50000, 100000, 500000,
+                1000000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class _ShardOwner:
+    '''Lives exactly as long as its thread's `threading.local` storage.'''
+
+
+def _retire(shard):
+    with _shards_lock:
+        _shards.pop(id(shard), None)
+        for key, cell in shard.items():
+            retired = _retired.get(key)
+            _retired[key] = (list(cell) if retired is None else
+                             REGISTRY[key[0]]._merge([retired, cell]))
+
+
+def _shard() -> dict:
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        owner = _local.owner = _ShardOwner()
+        with _shards_lock:
+            _shards[id(shard)] = shard
+        # The thread's locals are dropped when it exits, which runs this
+        finalizer = weakref.finalize(owner, _retire, shard)
+        finalizer.atexit = False
+    return shard
+
+
+def _format_labels(pairs) -> str:
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(
+        f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    '''A monotonically increasing value, per label set.'''
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        REGISTRY[name] = self
+
+    def inc(self, amount=1, *label_values):
+        shard = _shard()
+        key = (self.name, label_values)
+        cell = shard.get(key)
+        if cell is None:
+            cell = shard[key] = [0]
+        cell[0] += amount
+
+    def _merge(self, cells):
+        return [cells[0][0] + sum(cell[0] for cell in cells[1:])]
+
+    def _expose(self, label_values, merged) -> list:
+        labels = _format_labels(list(zip(self.labels, label_values)))
+        return [f'{self.name}{labels} {merged[0]}']
+
+
+class Histogram:
+    '''
+    Counts observations into fixed buckets, per label set, and tracks their
+    sum, like a Prometheus histogram.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        REGISTRY[name] = self
+
+    def observe(self, value, *label_values):
+        shard = _shard()
+        key = (self.name, label_values)
+        cell = shard.get(key)
+        if cell is None:
+            # One count per bucket, one for +Inf, then the sum
+            cell = shard[key] = [0] * (len(self.buckets) + 2)
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def _merge(self, cells):
+        return [sum(values) for values in zip(*cells)]
+
+    def _expose(self, label_values, merged) -> list:
+        pairs = list(zip(self.labels, label_values))
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf', ), merged[:-1]):
+            cumulative += count
+            labels = _format_labels(pairs + [('le', bound)])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(pairs)
+        lines.append(f'{self.name}_sum{labels} {merged[-1]}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds',
+                             'Time spent handling a request.',
+                             ('route', 'method', 'status'))
+RESPONSE_SIZE = Histogram('http_response_size_bytes',
+                          'Size of response bodies as sent.', ('route', ),
+                          SIZE_BUCKETS)
+REQUEST_QUERIES = Histogram('http_request_sql_queries',
+                            'SQL statements executed per request.',
+                            ('route', ), COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram('http_request_sql_seconds',
+                            'Time spent in SQL statements per request.',
+                            ('route', ))
+SQL_QUERIES = Counter('sql_queries_total',
+                      'SQL statements executed, in and out of requests.')
+PASSWORD_HASHING = Histogram(
+    'password_hashing_seconds',
+    'Time a caller waited for bcrypt, including queueing.', ('operation', ))
+
+
+def collect() -> str:
+    '''Returns every metric in the Prometheus text exposition format.'''
+    merged = {}
+    # Held throughout, so a shard retired meanwhile is not counted twice
+    with _shards_lock:
+        for shard in (_retired, *_shards.values()):
+            for key, cell in list(shard.items()):
+                merged.setdefault(key, []).append(list(cell))
+
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for (metric_name, label_values), cells in sorted(merged.items()):
+            if metric_name == name:
+                lines.extend(
+                    metric._expose(label_values, metric._merge(cells)))
+    return '\n'.join(lines) + '\n'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    SQL_QUERIES.inc()
+    if getattr(_request, 'active', False):
+        _request.queries += 1
+        _request.db_time += elapsed
+
+
+def _handle_error(context):
+    # The statement failed, so `after_cursor_execute` will not pop its start
+    if context.connection is not None:
+        starts = context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+
+def _route() -> str:
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _start_request():
+    _request.active = True
+    _request.start = time.perf_counter()
+    _request.queries = 0
+    _request.db_time = 0.0
+
+
+def _finish_request(response):
+    if not getattr(_request, 'active', False):
+        return response
+    _request.active = False
+    route = _route()
+    REQUEST_DURATION.observe(time.perf_counter() - _request.start, route,
+                             request.method, str(response.status_code))
+    REQUEST_QUERIES.observe(_request.queries, route)
+    REQUEST_DB_TIME.observe(_request.db_time, route)
+    if response.content_length is not None:
+        RESPONSE_SIZE.observe(response.content_length, route)
+    return response
+
+
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    supplied = request.headers.get('Authorization', '')
+    if not token or not hmac.compare_digest(supplied.encode('utf-8'),
+                                            f'Bearer {token}'.encode('utf-8')):
+        abort(404)
+    return Response(collect(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    '''
+    Times every request and counts its SQL statements, and serves the
+    collected metrics at `METRICS_ENDPOINT` to scrapers that send
+    `Authorization: Bearer <METRICS_TOKEN>`. Without a token the endpoint
+    answers 404. Call before hooks that rewrite the response body (e.g.
+    compression), so the size recorded is the size sent.
+    '''
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_ENDPOINT', '/metrics')
+    app.config.setdefault('METRICS_TOKEN', None)
+    if not app.config['METRICS_ENABLED']:
+        return
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule(app.config['METRICS_ENDPOINT'], 'metrics', metrics_view)
@@ -0,0 +1,68 @@
+"""friendship table replaces user_account.friend_ids
+
+Revision ID: 0442dea8a430
+Revises: d1d4294240c1
+Create Date: 2026-10-18 11:02:17.640358
+
+"""
+import re
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0442dea8a430'
+down_revision = 'd1d4294240c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    friendship = op.create_table('friendship',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('friend_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['friend_id'], ['user_account.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user_account.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'friend_id')
+    )
+    op.create_index('ix_friendship_friend_id_user_id', 'friendship', ['friend_id', 'user_id'], unique=False)
+    op.create_index('ix_friendship_user_id_created_at', 'friendship', ['user_id', 'created_at'], unique=False)
+    with op.batch_alter_table('user_account', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('friend_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Carry over friend_ids as accepted friendships in both directions.
+    conn = op.get_bind()
+    rows = conn.execute(sa.text('SELECT id, friend_ids FROM user_account')).fetchall()
+    user_ids = {user_id for user_id, _ in rows}
+    edges = set()
+    for user_id, friend_ids in rows:
+        for friend_id in {int(i) for i in re.findall(r'\d+', friend_ids or '')}:
+            if friend_id in user_ids and friend_id != user_id:
+                edges.add((user_id, friend_id))
+                edges.add((friend_id, user_id))
+    if edges:
+        now = datetime.now()
+        op.bulk_insert(friendship, [
+            {'user_id': u, 'friend_id': f, 'status': 'accepted', 'created_at': now}
+            for u, f in edges
+        ])
+        conn.execute(sa.text(
+            "UPDATE user_account SET friend_count = (SELECT count(*) FROM friendship "
+            "WHERE friendship.user_id = user_account.id AND status = 'accepted')"))
+
+    with op.batch_alter_table('user_account', schema=None) as batch_op:
+        batch_op.drop_column('friend_ids')
+
+
+def downgrade():
+    with op.batch_alter_table('user_account', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('friend_ids', sa.String(length=120), server_default='[]', nullable=True))
+        batch_op.drop_column('friend_count')
+
+    op.drop_index('ix_friendship_user_id_created_at', table_name='friendship')
+    op.drop_index('ix_friendship_friend_id_user_id', table_name='friendship')
+    op.drop_table('friendship')
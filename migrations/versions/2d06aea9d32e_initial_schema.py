@@ -0,0 +1,66 @@
+"""initial schema
+
+Revision ID: 2d06aea9d32e
+Revises: 
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2d06aea9d32e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_account',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('avatar_uri', sa.String(length=256), nullable=True),
+    sa.Column('first_name', sa.String(length=50), nullable=False),
+    sa.Column('last_name', sa.String(length=50), nullable=False),
+    sa.Column('handle', sa.String(length=50), nullable=False),
+    sa.Column('occupation', sa.String(length=50), nullable=True),
+    sa.Column('email', sa.String(length=120), nullable=False),
+    sa.Column('password_hash', sa.Text(), nullable=False),
+    sa.Column('reset_token', sa.String(length=120), nullable=True),
+    sa.Column('reset_token_expiration', sa.DateTime(), nullable=True),
+    sa.Column('location', sa.String(length=50), nullable=True),
+    sa.Column('bio', sa.Text(), nullable=True),
+    sa.Column('website', sa.String(length=120), nullable=True),
+    sa.Column('posts_ids', sa.Text(), nullable=True),
+    sa.Column('interests', sa.String(length=120), nullable=True),
+    sa.Column('friend_ids', sa.String(length=120), nullable=True),
+    sa.Column('privacy_setting', sa.String(length=120), nullable=True),
+    sa.Column('education_level', sa.String(length=50), nullable=False),
+    sa.Column('education_major', sa.String(length=50), nullable=True),
+    sa.Column('education_institution', sa.String(length=50), nullable=True),
+    sa.Column('organization_name', sa.String(length=120), nullable=True),
+    sa.Column('years_in_business', sa.String(length=2), nullable=True),
+    sa.Column('account_type', sa.String(length=50), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('reset_token')
+    )
+    op.create_table('post_model',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.String(length=120), nullable=False),
+    sa.Column('location', sa.String(length=120), nullable=True),
+    sa.Column('image_uri', sa.String(length=120), nullable=True),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('liked_by', sa.Text(), nullable=False),
+    sa.Column('comments', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['user_account.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('post_model')
+    op.drop_table('user_account')
@@ -0,0 +1,43 @@
+"""timeline_entry table for precomputed home feeds
+
+Revision ID: 65457df142b8
+Revises: 0442dea8a430
+Create Date: 2026-10-18 11:47:30.221945
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '65457df142b8'
+down_revision = '0442dea8a430'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline_entry',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post_model.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user_account.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    op.create_index('ix_timeline_entry_user_id_created_at', 'timeline_entry', ['user_id', 'created_at', 'post_id'], unique=False)
+
+    # Seed timelines with every existing post for its owner and their friends.
+    op.execute(
+        'INSERT INTO timeline_entry (user_id, post_id, created_at) '
+        'SELECT owner_id, id, created_at FROM post_model')
+    op.execute(
+        'INSERT INTO timeline_entry (user_id, post_id, created_at) '
+        'SELECT friendship.friend_id, post_model.id, post_model.created_at '
+        'FROM post_model JOIN friendship ON friendship.user_id = post_model.owner_id '
+        "WHERE friendship.status = 'accepted'")
+
+
+def downgrade():
+    op.drop_index('ix_timeline_entry_user_id_created_at', table_name='timeline_entry')
+    op.drop_table('timeline_entry')
@@ -0,0 +1,46 @@
+"""media_blob table for content-addressed uploads
+
+Revision ID: 6d80603ca3f1
+Revises: 8002688770e6
+Create Date: 2026-10-18 13:58:44.083561
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d80603ca3f1'
+down_revision = '8002688770e6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media_blob',
+    sa.Column('key', sa.String(length=80), nullable=False),
+    sa.Column('content_type', sa.String(length=50), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('user_account', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('avatar_key', sa.String(length=80), nullable=True))
+        batch_op.create_foreign_key('fk_user_account_avatar_key_media_blob', 'media_blob', ['avatar_key'], ['key'])
+
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_key', sa.String(length=80), nullable=True))
+        batch_op.create_foreign_key('fk_post_model_image_key_media_blob', 'media_blob', ['image_key'], ['key'])
+
+
+def downgrade():
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_post_model_image_key_media_blob', type_='foreignkey')
+        batch_op.drop_column('image_key')
+
+    with op.batch_alter_table('user_account', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_user_account_avatar_key_media_blob', type_='foreignkey')
+        batch_op.drop_column('avatar_key')
+
+    op.drop_table('media_blob')
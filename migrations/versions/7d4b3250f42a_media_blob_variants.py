@@ -0,0 +1,26 @@
+"""media_blob.variants for processed image variants
+
+Revision ID: 7d4b3250f42a
+Revises: 6d80603ca3f1
+Create Date: 2026-10-18 14:40:12.529810
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d4b3250f42a'
+down_revision = '6d80603ca3f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('media_blob', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('variants', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('media_blob', schema=None) as batch_op:
+        batch_op.drop_column('variants')
@@ -0,0 +1,63 @@
+"""indexes for hot lookup columns
+
+Revision ID: 8002688770e6
+Revises: 65457df142b8
+Create Date: 2026-10-18 12:30:09.752410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+HANDLE_LENGTH = 50
+
+
+# revision identifiers, used by Alembic.
+revision = '8002688770e6'
+down_revision = '65457df142b8'
+branch_labels = None
+depends_on = None
+
+
+def dedupe_handles():
+    # Registration used to accept case variants and repeats of a handle.
+    # Lower-case every handle as registration now does, keep it on the
+    # oldest account and rename the others to `<handle>_<id>`.
+    conn = op.get_bind()
+    rows = conn.execute(sa.text('SELECT id, handle FROM user_account ORDER BY id')).fetchall()
+    taken = {(handle or '').lower() for _, handle in rows}
+    seen = set()
+    for user_id, handle in rows:
+        new_handle = (handle or '').lower()
+        if new_handle in seen:
+            suffix = f'_{user_id}'
+            new_handle = new_handle[:HANDLE_LENGTH - len(suffix)] + suffix
+            while new_handle in taken:
+                suffix = '_' + suffix
+                new_handle = new_handle[:HANDLE_LENGTH - len(suffix)] + suffix
+            taken.add(new_handle)
+            print(f'[!] Renamed duplicate handle {handle!r} of user {user_id} to {new_handle!r}')
+        seen.add(new_handle)
+        if new_handle != handle:
+            conn.execute(sa.text('UPDATE user_account SET handle = :handle WHERE id = :id'),
+                         {'handle': new_handle, 'id': user_id})
+
+
+def upgrade():
+    dedupe_handles()
+    # reset_token already has a unique index through its UNIQUE constraint.
+    op.create_index('ix_user_account_handle', 'user_account', ['handle'], unique=True)
+    op.create_index('ix_post_model_owner_id_created_at', 'post_model', ['owner_id', 'created_at'], unique=False)
+    op.create_index('ix_post_model_created_at', 'post_model', ['created_at'], unique=False)
+
+    # Include the tie-break column so friend listings avoid a temporary sort.
+    op.drop_index('ix_friendship_user_id_created_at', table_name='friendship')
+    op.create_index('ix_friendship_user_id_created_at', 'friendship', ['user_id', 'created_at', 'friend_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_friendship_user_id_created_at', table_name='friendship')
+    op.create_index('ix_friendship_user_id_created_at', 'friendship', ['user_id', 'created_at'], unique=False)
+
+    op.drop_index('ix_post_model_created_at', table_name='post_model')
+    op.drop_index('ix_post_model_owner_id_created_at', table_name='post_model')
+    op.drop_index('ix_user_account_handle', table_name='user_account')
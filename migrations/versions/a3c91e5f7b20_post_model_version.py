@@ -0,0 +1,30 @@
+"""post_model.version for conditional requests
+
+Revision ID: a3c91e5f7b20
+Revises: 7d4b3250f42a
+Create Date: 2026-10-18 15:22:47.118304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c91e5f7b20'
+down_revision = '7d4b3250f42a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column('version',
+                      sa.Integer(),
+                      server_default='1',
+                      nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,68 @@
+"""post_like table replaces post_model.liked_by
+
+Revision ID: aaad5bd5569e
+Revises: 2d06aea9d32e
+Create Date: 2026-10-18 09:40:03.512877
+
+"""
+import re
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'aaad5bd5569e'
+down_revision = '2d06aea9d32e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    post_like = op.create_table('post_like',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post_model.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user_account.id'], ),
+    sa.PrimaryKeyConstraint('post_id', 'user_id')
+    )
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Carry over the comma separated user ids stored in liked_by.
+    conn = op.get_bind()
+    user_ids = {row[0] for row in conn.execute(sa.text('SELECT id FROM user_account'))}
+    now = datetime.now()
+    for post_id, liked_by in conn.execute(sa.text('SELECT id, liked_by FROM post_model')).fetchall():
+        likers = {int(i) for i in re.findall(r'\d+', liked_by or '')} & user_ids
+        if not likers:
+            continue
+        op.bulk_insert(post_like, [
+            {'post_id': post_id, 'user_id': user_id, 'created_at': now}
+            for user_id in likers
+        ])
+        conn.execute(sa.text('UPDATE post_model SET like_count = :count WHERE id = :id'),
+                     {'count': len(likers), 'id': post_id})
+
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.drop_column('liked_by')
+
+
+def downgrade():
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('liked_by', sa.Text(), server_default='[]', nullable=False))
+
+    conn = op.get_bind()
+    likes = {}
+    for post_id, user_id in conn.execute(sa.text('SELECT post_id, user_id FROM post_like')):
+        likes.setdefault(post_id, []).append(str(user_id))
+    for post_id, user_ids in likes.items():
+        conn.execute(sa.text('UPDATE post_model SET liked_by = :liked_by WHERE id = :id'),
+                     {'liked_by': '[],' + ','.join(user_ids), 'id': post_id})
+
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.drop_column('like_count')
+
+    op.drop_table('post_like')
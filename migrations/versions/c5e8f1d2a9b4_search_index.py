@@ -0,0 +1,49 @@
+"""full-text search indexes for users and posts
+
+Revision ID: c5e8f1d2a9b4
+Revises: a3c91e5f7b20
+Create Date: 2026-10-18 16:05:31.402217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8f1d2a9b4'
+down_revision = 'a3c91e5f7b20'
+branch_labels = None
+depends_on = None
+
+# FTS5 tables holding their own copy of the indexed text, and triggers that
+# keep them in sync. Existing rows are not indexed here, which would hold
+# the write lock for the whole table; run `flask search backfill` after
+# upgrading to index them in small batches.
+# Batch migrations that recreate user_account or post_model drop these
+# triggers with the old table and must create them again.
+STATEMENTS = [
+    "CREATE VIRTUAL TABLE user_search USING fts5(handle, first_name, last_name, occupation, education_institution, interests, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    'CREATE TRIGGER user_search_insert AFTER INSERT ON user_account BEGIN INSERT INTO user_search (rowid, handle, first_name, last_name, occupation, education_institution, interests) VALUES (new.id, new.handle, new.first_name, new.last_name, new.occupation, new.education_institution, new.interests); END',
+    'CREATE TRIGGER user_search_update AFTER UPDATE OF handle, first_name, last_name, occupation, education_institution, interests ON user_account BEGIN DELETE FROM user_search WHERE rowid = old.id; INSERT INTO user_search (rowid, handle, first_name, last_name, occupation, education_institution, interests) VALUES (new.id, new.handle, new.first_name, new.last_name, new.occupation, new.education_institution, new.interests); END',
+    'CREATE TRIGGER user_search_delete AFTER DELETE ON user_account BEGIN DELETE FROM user_search WHERE rowid = old.id; END',
+    "CREATE VIRTUAL TABLE post_search USING fts5(content, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    'CREATE TRIGGER post_search_insert AFTER INSERT ON post_model BEGIN INSERT INTO post_search (rowid, content) VALUES (new.id, new.content); END',
+    'CREATE TRIGGER post_search_update AFTER UPDATE OF content ON post_model BEGIN DELETE FROM post_search WHERE rowid = old.id; INSERT INTO post_search (rowid, content) VALUES (new.id, new.content); END',
+    'CREATE TRIGGER post_search_delete AFTER DELETE ON post_model BEGIN DELETE FROM post_search WHERE rowid = old.id; END',
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in STATEMENTS:
+        op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for index in ('user_search', 'post_search'):
+        for trigger in ('insert', 'update', 'delete'):
+            op.execute(f'DROP TRIGGER IF EXISTS {index}_{trigger}')
+        op.execute(f'DROP TABLE IF EXISTS {index}')
@@ -0,0 +1,71 @@
+"""post_comment table replaces post_model.comments
+
+Revision ID: d1d4294240c1
+Revises: aaad5bd5569e
+Create Date: 2026-10-18 10:21:56.904113
+
+"""
+import json
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1d4294240c1'
+down_revision = 'aaad5bd5569e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    post_comment = op.create_table('post_comment',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['user_account.id'], ),
+    sa.ForeignKeyConstraint(['post_id'], ['post_model.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_post_comment_post_id_created_at', 'post_comment', ['post_id', 'created_at'], unique=False)
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Carry over any comments that made it into the JSON column as a list of
+    # {"user_id": ..., "comment": ...} objects; anything else is dropped.
+    conn = op.get_bind()
+    now = datetime.now()
+    for post_id, comments in conn.execute(sa.text('SELECT id, comments FROM post_model')).fetchall():
+        try:
+            comments = json.loads(comments)
+            while isinstance(comments, str):
+                comments = json.loads(comments)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(comments, list):
+            continue
+        rows = [{
+            'post_id': post_id,
+            'owner_id': int(c['user_id']),
+            'content': str(c['comment']),
+            'created_at': now,
+        } for c in comments if isinstance(c, dict) and c.get('user_id') and c.get('comment')]
+        if rows:
+            op.bulk_insert(post_comment, rows)
+            conn.execute(sa.text('UPDATE post_model SET comment_count = :count WHERE id = :id'),
+                         {'count': len(rows), 'id': post_id})
+
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.drop_column('comments')
+
+
+def downgrade():
+    with op.batch_alter_table('post_model', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('comments', sa.JSON(), server_default='"{}"', nullable=False))
+        batch_op.drop_column('comment_count')
+
+    op.drop_index('ix_post_comment_post_id_created_at', table_name='post_comment')
+    op.drop_table('post_comment')
@@ -0,0 +1,40 @@
+"""friend_suggestion table for precomputed friend suggestions
+
+Revision ID: e2b7a4c9d613
+Revises: c5e8f1d2a9b4
+Create Date: 2026-10-18 17:12:09.583114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7a4c9d613'
+down_revision = 'c5e8f1d2a9b4'
+branch_labels = None
+depends_on = None
+
+
+# The table starts empty; the suggestion job fills it on its first run, or
+# run `flask suggestions rebuild` after upgrading.
+def upgrade():
+    op.create_table('friend_suggestion',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('candidate_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('mutual_friends', sa.Integer(), nullable=False),
+    sa.Column('shared_interests', sa.Integer(), nullable=False),
+    sa.Column('same_institution', sa.Boolean(), nullable=False),
+    sa.Column('same_major', sa.Boolean(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['candidate_id'], ['user_account.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user_account.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'candidate_id')
+    )
+    op.create_index('ix_friend_suggestion_user_id_score', 'friend_suggestion', ['user_id', 'score', 'candidate_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_friend_suggestion_user_id_score', table_name='friend_suggestion')
+    op.drop_table('friend_suggestion')
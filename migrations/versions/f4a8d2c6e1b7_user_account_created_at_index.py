@@ -0,0 +1,24 @@
+"""index user_account.created_at for the admin user listing
+
+Revision ID: f4a8d2c6e1b7
+Revises: e2b7a4c9d613
+Create Date: 2026-10-18 18:03:44.210937
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4a8d2c6e1b7'
+down_revision = 'e2b7a4c9d613'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user_account_created_at', 'user_account', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_account_created_at', table_name='user_account')
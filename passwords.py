@@ -0,0 +1,130 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import bcrypt
+
+from metrics import PASSWORD_HASHING
+
+
+class HasherBusy(Exception):
+    '''Raised when the password hashing queue is saturated.'''
+
+
+def get_rounds(password_hash) -> int:
+    '''Returns the bcrypt cost factor encoded in `password_hash`.'''
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode('utf-8')
+    # Format is: $2b$<rounds>$<salt+hash>
+    try:
+        return int(password_hash.split(b'$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def benchmark_rounds(target_ms, minimum=10, maximum=16) -> int:
+    '''
+    Returns the highest bcrypt cost factor whose hash time on this machine
+    stays within `target_ms` milliseconds.
+    '''
+    start = time.perf_counter()
+    bcrypt.hashpw(b'benchmark', bcrypt.gensalt(minimum))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    # Each extra round doubles the work.
+    rounds = minimum
+    while rounds < maximum and elapsed_ms * 2 <= target_ms:
+        elapsed_ms *= 2
+        rounds += 1
+    return rounds
+
+
+class PasswordHasher:
+    '''
+    Runs bcrypt on a dedicated, bounded thread pool so password work cannot
+    occupy every request worker. When more than `max_workers + max_pending`
+    operations are in flight, new ones fail fast with `HasherBusy`.
+    '''
+
+    def __init__(self, rounds=12, max_workers=4, max_pending=32, timeout=10):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_ROUNDS', 12)
+        app.config.setdefault('BCRYPT_TARGET_MS', None)
+        app.config.setdefault('BCRYPT_MAX_WORKERS', 4)
+        app.config.setdefault('BCRYPT_MAX_PENDING', 32)
+        app.config.setdefault('BCRYPT_TIMEOUT', 10)
+
+        if app.config['BCRYPT_TARGET_MS']:
+            self.rounds = benchmark_rounds(app.config['BCRYPT_TARGET_MS'])
+            print(f'[+] Using {self.rounds} bcrypt rounds')
+        else:
+            self.rounds = app.config['BCRYPT_ROUNDS']
+        self.max_workers = app.config['BCRYPT_MAX_WORKERS']
+        self.max_pending = app.config['BCRYPT_MAX_PENDING']
+        self.timeout = app.config['BCRYPT_TIMEOUT']
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='bcrypt')
+                self._slots = threading.BoundedSemaphore(self.max_workers +
+                                                         self.max_pending)
+            return self._executor
+
+    def _run(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return self._submit(fn, *args)
+        finally:
+            PASSWORD_HASHING.observe(time.perf_counter() - start,
+                                     fn.__name__)
+
+    def _submit(self, fn, *args):
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = executor.submit(fn, *args)
+        except RuntimeError:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HasherBusy()
+
+    def hash(self, password: str) -> bytes:
+        '''Returns a bcrypt hash of `password` using the configured cost factor.'''
+        return self._run(bcrypt.hashpw, password.encode('utf-8'),
+                         bcrypt.gensalt(self.rounds))
+
+    def verify(self, password: str, password_hash) -> bool:
+        '''Returns `True` if `password` matches `password_hash`.'''
+        if isinstance(password_hash, str):
+            password_hash = password_hash.encode('utf-8')
+        return self._run(bcrypt.checkpw, password.encode('utf-8'),
+                         password_hash)
+
+    def needs_rehash(self, password_hash) -> bool:
+        '''Returns `True` if `password_hash` was made with a different cost factor.'''
+        return get_rounds(password_hash) != self.rounds
+
+
+hasher = PasswordHasher()
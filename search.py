@@ -0,0 +1,225 @@
+import re
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+from database import db
+
+# FTS5 index per searchable table: the source table, indexed columns and
+# their BM25 weights. The indexes store their own copy of the text and are
+# kept in sync by triggers; see the `search_index` migration.
+INDEXES = {
+    'user_search': {
+        'source': 'user_account',
+        'columns': {
+            'handle': 10.0,
+            'first_name': 5.0,
+            'last_name': 5.0,
+            'occupation': 2.0,
+            'education_institution': 2.0,
+            'interests': 1.0,
+        },
+    },
+    'post_search': {
+        'source': 'post_model',
+        'columns': {
+            'content': 1.0,
+        },
+    },
+}
+
+# Longest query accepted, in terms
+MAX_TERMS = 8
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+# Rows `viewer` may see: public profiles, their own, and friends-only
+# profiles of their friends.
+_VISIBLE = '''
+    (u.privacy_setting IS NULL OR u.privacy_setting = 'public'
+     OR u.id = :viewer
+     OR (u.privacy_setting = 'friends' AND EXISTS (
+         SELECT 1 FROM friendship f
+         WHERE f.user_id = :viewer AND f.friend_id = u.id
+           AND f.status = 'accepted')))
+'''
+
+
+def is_available() -> bool:
+    '''Full-text search needs SQLite; other databases are not indexed.'''
+    return db.engine.dialect.name == 'sqlite'
+
+
+def index_ddl(index: str) -> list:
+    '''
+    Returns the statements creating `index` and the triggers that keep it
+    in sync with its source table. Updates only reindex when an indexed
+    column changes.
+    '''
+    spec = INDEXES[index]
+    source = spec['source']
+    columns = ', '.join(spec['columns'])
+    new_values = ', '.join(f'new.{column}' for column in spec['columns'])
+    insert = (f'INSERT INTO {index} (rowid, {columns}) '
+              f'VALUES (new.id, {new_values});')
+    delete = f'DELETE FROM {index} WHERE rowid = old.id;'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({columns}, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f'CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON '
+        f'{source} BEGIN {insert} END',
+        f'CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF '
+        f'{columns} ON {source} BEGIN {delete} {insert} END',
+        f'CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON '
+        f'{source} BEGIN {delete} END',
+    ]
+
+
+def create_indexes() -> None:
+    '''
+    Creates the search indexes and triggers if missing, for databases made
+    with `db.create_all()` rather than migrations.
+    '''
+    if not is_available():
+        return
+    for index in INDEXES:
+        for statement in index_ddl(index):
+            db.session.execute(text(statement))
+    db.session.commit()
+
+
+def match_expression(query: str, prefix: bool = True) -> str or None:
+    '''
+    Turns free text into an FTS5 query matching every term. Terms are
+    quoted, so user input cannot use FTS5 operators. With `prefix`, the last
+    term also matches as a prefix, for typeahead. `None` if there are no
+    terms.
+    '''
+    terms = _TERM.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if prefix:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _rank(index: str) -> str:
+    weights = ', '.join(str(w) for w in INDEXES[index]['columns'].values())
+    return f'bm25({index}, {weights})'
+
+
+def search_users(query: str, viewer_id: int, limit: int, offset: int = 0,
+                 prefix: bool = True) -> list:
+    '''
+    Returns the ids of up to `limit` users matching `query` that
+    `viewer_id` may see, best match first.
+    '''
+    expression = match_expression(query, prefix)
+    if expression is None:
+        return []
+    rows = db.session.execute(
+        text(f'''
+            SELECT u.id FROM user_search
+            JOIN user_account u ON u.id = user_search.rowid
+            WHERE user_search MATCH :match AND {_VISIBLE}
+            ORDER BY {_rank('user_search')}, u.id
+            LIMIT :limit OFFSET :offset
+        '''), {
+            'match': expression,
+            'viewer': viewer_id,
+            'limit': limit,
+            'offset': offset
+        })
+    return [row[0] for row in rows]
+
+
+def search_posts(query: str, viewer_id: int, limit: int, offset: int = 0,
+                 prefix: bool = True) -> list:
+    '''
+    Returns the ids of up to `limit` posts matching `query` whose owners
+    `viewer_id` may see, best match first.
+    '''
+    expression = match_expression(query, prefix)
+    if expression is None:
+        return []
+    rows = db.session.execute(
+        text(f'''
+            SELECT p.id FROM post_search
+            JOIN post_model p ON p.id = post_search.rowid
+            JOIN user_account u ON u.id = p.owner_id
+            WHERE post_search MATCH :match AND {_VISIBLE}
+            ORDER BY {_rank('post_search')}, p.id
+            LIMIT :limit OFFSET :offset
+        '''), {
+            'match': expression,
+            'viewer': viewer_id,
+            'limit': limit,
+            'offset': offset
+        })
+    return [row[0] for row in rows]
+
+
+def backfill(batch_size: int = 500, pause: float = 0.0, log=print) -> dict:
+    '''
+    (Re)indexes every existing row in batches of `batch_size` source ids,
+    committing after each so writers are never blocked for long. Safe to
+    run while the app is serving: the triggers keep rows changed meanwhile
+    in sync, and each batch replaces its rows in the index. Returns the
+    number of rows indexed per index.
+    '''
+    indexed = {}
+    for index, spec in INDEXES.items():
+        source = spec['source']
+        columns = ', '.join(spec['columns'])
+        indexed[index] = 0
+        last_id = 0
+        while True:
+            ids = [
+                row[0] for row in db.session.execute(
+                    text(f'SELECT id FROM {source} WHERE id > :last '
+                         'ORDER BY id LIMIT :batch'), {
+                             'last': last_id,
+                             'batch': batch_size
+                         })
+            ]
+            if not ids:
+                break
+            bounds = {'low': ids[0], 'high': ids[-1]}
+            db.session.execute(
+                text(f'DELETE FROM {index} '
+                     'WHERE rowid BETWEEN :low AND :high'), bounds)
+            db.session.execute(
+                text(f'INSERT INTO {index} (rowid, {columns}) '
+                     f'SELECT id, {columns} FROM {source} '
+                     'WHERE id BETWEEN :low AND :high'), bounds)
+            db.session.commit()
+            indexed[index] += len(ids)
+            last_id = ids[-1]
+            log(f'[+] {index}: indexed {indexed[index]} rows')
+            if pause:
+                time.sleep(pause)
+        db.session.execute(
+            text(f"INSERT INTO {index} ({index}) VALUES ('optimize')"))
+        db.session.commit()
+    return indexed
+
+
+search_cli = AppGroup('search', help='Full-text search index commands.')
+
+
+@search_cli.command('backfill')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--pause',
+              default=0.05,
+              show_default=True,
+              help='Seconds to sleep between batches.')
+def backfill_command(batch_size, pause):
+    '''Indexes existing users and posts for search.'''
+    backfill(batch_size, pause)
+
+
+def init_app(app):
+    app.cli.add_command(search_cli)
@@ -0,0 +1,104 @@
+from functools import lru_cache
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class InvalidFields(ValueError):
+    '''Raised when a `fields` projection names an unknown field.'''
+
+
+def timestamp(attr: str):
+    '''Field getter formatting a datetime column like the rest of the API.'''
+
+    def get(obj, ctx):
+        value = getattr(obj, attr)
+        return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+    return get
+
+
+@lru_cache(maxsize=256)
+def _compile(owner: str, spec: tuple, fields: tuple):
+    # Plain attribute fields become direct attribute loads in the generated
+    # function; only computed fields pay for a call.
+    getters = dict(spec)
+    namespace = {}
+    items = []
+    for i, name in enumerate(fields):
+        getter = getters[name]
+        if isinstance(getter, str):
+            items.append(f'{name!r}: obj.{getter}')
+        else:
+            namespace[f'_get{i}'] = getter
+            items.append(f'{name!r}: _get{i}(obj, ctx)')
+    source = ('def serialize(obj, ctx):\n'
+              f'    return {{{", ".join(items)}}}\n')
+    exec(compile(source, f'<serializer {owner}>', 'exec'), namespace)
+    return namespace['serialize']
+
+
+def serializer(model, fields: tuple = None):
+    '''
+    Returns a function `(obj, ctx) -> dict` emitting `fields` of `model`, or
+    its default fields. `model.JSON_FIELDS` maps each field to an attribute
+    name or a `(obj, ctx)` getter. Serializers are generated once per
+    distinct field set and reused.
+    '''
+    return _compile(model.__name__, tuple(model.JSON_FIELDS.items()),
+                    fields or model.JSON_DEFAULT_FIELDS)
+
+
+def parse_fields(model, value: str) -> tuple or None:
+    '''
+    Parses a comma separated `fields` projection into a tuple in `model`'s
+    field order; `None` when empty. Raises `InvalidFields`.
+    '''
+    if not value:
+        return None
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested - set(model.JSON_FIELDS)
+    if unknown:
+        raise InvalidFields(f'Unknown fields: {", ".join(sorted(unknown))}')
+    return tuple(name for name in model.JSON_FIELDS if name in requested)
+
+
+def wants(fields: tuple, *names) -> bool:
+    '''Returns `True` if any of `names` is in the `fields` projection.'''
+    return any(name in fields for name in names)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    '''
+    JSON provider backed by orjson, which encodes the large post listings
+    several times faster than the standard library. Values orjson does not
+    know are handled by Flask's default hook, so output is unchanged.
+    '''
+
+    option = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+              | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default,
+                            option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj,
+                                                     default=self.default,
+                                                     option=self.option),
+                                        mimetype=self.mimetype)
+
+
+def init_app(app):
+    '''Switches the app to `OrjsonProvider` when enabled and installed.'''
+    app.config.setdefault('JSON_ORJSON', True)
+    if app.config['JSON_ORJSON'] and orjson is not None:
+        app.json = OrjsonProvider(app)
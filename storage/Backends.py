@@ -0,0 +1,71 @@
+import os
+import shutil
+
+
+class StorageBackend:
+    '''
+    Interface for where media blobs live. Blobs are immutable and addressed
+    by key, so backends only need to store, fetch and delete whole files.
+    '''
+
+    # Directory uploads are staged in before `put`; `None` for the system
+    # temp directory.
+    staging_dir = None
+
+    def put(self, key: str, path: str) -> None:
+        '''Stores the staged file at `path` under `key`, consuming the file.'''
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def open(self, key: str):
+        '''Returns a binary file object for reading the blob.'''
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> str or None:
+        '''Returns the blob's path on the local filesystem, if it has one.'''
+        return None
+
+
+class LocalStorage(StorageBackend):
+    '''Stores blobs as files in a directory on the local filesystem.'''
+
+    def __init__(self, root: str, staging_dir: str = None):
+        self.root = root
+        # Kept outside `root`, which may be publicly served, but best on the
+        # same filesystem so `put` stays a rename
+        self.staging_dir = staging_dir or os.path.join(
+            os.path.dirname(os.path.abspath(root)), 'media_staging')
+        os.makedirs(self.root, exist_ok=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        if os.path.basename(key) != key or key.startswith('.'):
+            raise ValueError(f'Invalid media key: {key}')
+        return os.path.join(self.root, key)
+
+    def put(self, key, path):
+        target = self._path(key)
+        if os.path.exists(target):
+            os.remove(path)
+            return
+        shutil.move(path, target)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        return self._path(key)
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import tempfile
+
+from database import MediaBlob, after_rollback
+from flask import current_app, request
+
+from .Backends import LocalStorage
+from .Processing import images
+
+# Leading bytes of each accepted image format, mapped to its extension
+SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'\xff\xd8\xff': 'jpg',
+    b'GIF87a': 'gif',
+    b'GIF89a': 'gif',
+}
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'gif': 'image/gif',
+}
+
+
+class InvalidMedia(ValueError):
+    '''Raised when an upload is not an accepted image or is too large.'''
+
+
+def sniff_extension(head: bytes) -> str or None:
+    '''Returns the extension matching the file signature in `head`, if any.'''
+    for signature, ext in SIGNATURES.items():
+        if head.startswith(signature):
+            return ext
+    return None
+
+
+class MediaStore:
+    '''
+    Content-addressed media storage. Uploads are streamed to a staging file
+    in chunks while being hashed, then stored once per distinct content as
+    `<sha256>.<ext>`. `MediaBlob` rows count the references to each blob so
+    the file is removed when the last one is released.
+    '''
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.chunk_size = 64 * 1024
+        self.max_bytes = 16 * 1024 * 1024
+
+    def init_app(self, app):
+        app.config.setdefault('MEDIA_ROOT',
+                              os.path.join(os.getcwd(), 'static/media'))
+        app.config.setdefault('MEDIA_STAGING',
+                              os.path.join(os.getcwd(), 'media_staging'))
+        app.config.setdefault('MEDIA_CHUNK_SIZE', 64 * 1024)
+        app.config.setdefault('MAX_CONTENT_LENGTH', 16 * 1024 * 1024)
+        app.config.setdefault('MEDIA_MAX_AGE', 365 * 24 * 60 * 60)
+        app.config.setdefault('MEDIA_SENDFILE', None)
+        app.config.setdefault('MEDIA_ACCEL_PREFIX', '/_media/')
+        if self.backend is None:
+            self.backend = LocalStorage(app.config['MEDIA_ROOT'],
+                                        app.config['MEDIA_STAGING'])
+        self.chunk_size = app.config['MEDIA_CHUNK_SIZE']
+        self.max_bytes = app.config['MAX_CONTENT_LENGTH']
+
+    def acquire(self, file) -> str:
+        '''
+        Stores the uploaded `file` (a werkzeug `FileStorage`) and takes a
+        reference to it, which is released again if the open unit of work
+        rolls back. Returns the blob key. Raises `InvalidMedia`.
+        '''
+        digest = hashlib.sha256()
+        size = 0
+        ext = None
+        staged = tempfile.NamedTemporaryFile(dir=self.backend.staging_dir,
+                                             delete=False)
+        try:
+            with staged:
+                while True:
+                    chunk = file.stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    if ext is None:
+                        ext = sniff_extension(chunk)
+                        if ext is None or ext not in current_app.config[
+                                'ALLOWED_EXTENSIONS']:
+                            raise InvalidMedia('Unsupported image format')
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise InvalidMedia('File too large')
+                    digest.update(chunk)
+                    staged.write(chunk)
+            if ext is None:
+                raise InvalidMedia('Empty file')
+
+            key = f'{digest.hexdigest()}.{ext}'
+            if not MediaBlob.acquire(key):
+                self.backend.put(key, staged.name)
+                MediaBlob.create(key, CONTENT_TYPES[ext], size)
+                images.submit(key, self.backend)
+            after_rollback(self.release, key)
+            return key
+        finally:
+            if os.path.exists(staged.name):
+                os.remove(staged.name)
+
+    def release(self, key: str) -> None:
+        '''Drops a reference to `key`, deleting the blob if it was the last.'''
+        if not key:
+            return
+        MediaBlob.release(key, self.backend.delete)
+
+    def url(self, key: str) -> str:
+        '''Returns the public URL of `key`, served by `api.Media`.'''
+        return f"{request.host_url}media/{key}"
+
+
+media = MediaStore()
@@ -0,0 +1,127 @@
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from database import MediaBlob
+from logs.Logger import log_error
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Variant name -> longest side in pixels. `thumb` is cropped square.
+VARIANTS = {
+    'thumb': 128,
+    '320w': 320,
+    '640w': 640,
+    '1280w': 1280,
+}
+
+
+def render_variants(source_path, staging_dir, key, variants,
+                    quality) -> dict:
+    '''
+    Renders WebP variants of the image at `source_path` into `staging_dir`.
+    Runs in a worker process. Returns `{name: (variant_key, staged_path)}`;
+    width variants larger than the source are skipped.
+    '''
+    stem = key.rsplit('.', 1)[0]
+    rendered = {}
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        for name, size in variants.items():
+            if name == 'thumb':
+                variant = ImageOps.fit(image, (size, size))
+            elif max(image.size) > size:
+                variant = image.copy()
+                variant.thumbnail((size, size))
+            else:
+                continue
+            fd, path = tempfile.mkstemp(dir=staging_dir, suffix='.webp')
+            with os.fdopen(fd, 'wb') as f:
+                variant.save(f, 'WEBP', quality=quality, method=4)
+            rendered[name] = (f'{stem}-{name}.webp', path)
+    return rendered
+
+
+class ImageProcessor:
+    '''
+    Generates resized WebP variants of newly stored images on a process
+    pool, so decoding runs outside the request workers. Until a blob's
+    variants are recorded, serializers fall back to the original.
+    '''
+
+    def __init__(self):
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_PROCESSING', True)
+        app.config.setdefault('IMAGE_WORKERS', 2)
+        app.config.setdefault('IMAGE_WEBP_QUALITY', 80)
+        self.app = app
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    @property
+    def enabled(self) -> bool:
+        return (Image is not None and self.app is not None
+                and self.app.config['IMAGE_PROCESSING'])
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.app.config['IMAGE_WORKERS'])
+            return self._executor
+
+    def submit(self, key, backend) -> None:
+        '''Queues variant generation for the blob `key` stored in `backend`.'''
+        source_path = backend.local_path(key)
+        if not self.enabled or source_path is None:
+            return
+        future = self._get_executor().submit(
+            render_variants, source_path, backend.staging_dir, key, VARIANTS,
+            self.app.config['IMAGE_WEBP_QUALITY'])
+        future.add_done_callback(
+            lambda f: self._finished(key, backend, f))
+
+    def _finished(self, key, backend, future):
+        # Runs on the executor's callback thread, where nothing would report
+        # an exception, so every failure is logged here
+        rendered = {}
+        stored = []
+        try:
+            rendered = future.result()
+            for variant_key, path in rendered.values():
+                backend.put(variant_key, path)
+                stored.append(variant_key)
+            with self.app.app_context():
+                variants = {
+                    name: variant_key
+                    for name, (variant_key, _) in rendered.items()
+                }
+                if not MediaBlob.set_variants(key, variants):
+                    # Released while processing
+                    for variant_key in variants.values():
+                        backend.delete(variant_key)
+        except Exception as e:
+            log_error('Image processing failed', key=key, error=repr(e))
+            # Not recorded on the blob, so nothing would ever delete them
+            for variant_key in stored:
+                backend.delete(variant_key)
+        finally:
+            # `put` consumes the staged files it stores; drop any left over
+            for _, path in rendered.values():
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+images = ImageProcessor()
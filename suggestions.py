@@ -0,0 +1,262 @@
+import heapq
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+
+from cache import (invalidate_suggestions, pop_stale_suggestions,
+                   suggestion_cache)
+from database import FriendSuggestion, Friendship, UserAccount, db
+from logs.Logger import log_error
+
+# How much each signal adds to a candidate's score
+DEFAULT_WEIGHTS = {
+    'mutual_friends': 3.0,
+    'shared_interests': 2.0,
+    'same_institution': 1.5,
+    'same_major': 1.0,
+}
+
+
+class SuggestionIndex:
+    '''
+    Inverted indexes from each interest, institution and major to the users
+    that have it, plus the friendship graph, loaded in one pass. Scoring a
+    user only touches the posting lists of their own features and friends,
+    never every other user.
+    '''
+
+    def __init__(self, max_posting: int):
+        # Features shared by more users than this say little about any pair
+        # and would make scoring quadratic, so they are skipped
+        self.max_posting = max_posting
+        self.interests = {}
+        self.public = set()
+        self.institution = {}
+        self.major = {}
+        self.by_interest = defaultdict(list)
+        self.by_institution = defaultdict(list)
+        self.by_major = defaultdict(list)
+        self.friends = defaultdict(list)
+        self.connected = defaultdict(set)
+
+    @staticmethod
+    def _key(value) -> str or None:
+        return value.strip().lower() if value and value.strip() else None
+
+    def load(self) -> 'SuggestionIndex':
+        users = db.session.query(UserAccount.id, UserAccount.interests,
+                                 UserAccount.education_institution,
+                                 UserAccount.education_major,
+                                 UserAccount.privacy_setting)
+        for user_id, interests, institution, major, privacy in users:
+            self.interests[user_id] = {
+                UserAccount.normalize_interest(interest)
+                for interest in UserAccount.parse_interests(interests)
+            }
+            self.institution[user_id] = self._key(institution)
+            self.major[user_id] = self._key(major)
+            # Only public profiles are suggested to strangers, as in search
+            if privacy not in (None, 'public'):
+                continue
+            self.public.add(user_id)
+            for interest in self.interests[user_id]:
+                self.by_interest[interest].append(user_id)
+            if self.institution[user_id]:
+                self.by_institution[self.institution[user_id]].append(user_id)
+            if self.major[user_id]:
+                self.by_major[self.major[user_id]].append(user_id)
+
+        edges = db.session.query(Friendship.user_id, Friendship.friend_id,
+                                 Friendship.status)
+        for user_id, friend_id, status in edges:
+            if status == Friendship.ACCEPTED:
+                self.friends[user_id].append(friend_id)
+            # Pending requests in either direction rule a candidate out too
+            self.connected[user_id].add(friend_id)
+            self.connected[friend_id].add(user_id)
+        return self
+
+    def _posting(self, index: dict, key) -> list:
+        posting = index.get(key, ()) if key else ()
+        return posting if len(posting) <= self.max_posting else ()
+
+    def score(self, user_id, weights: dict, limit: int) -> list:
+        '''
+        Returns `user_id`'s best `limit` candidates as mappings for
+        `FriendSuggestion`. Overlaps are counted with `Counter.update` over
+        whole posting lists, so the per-candidate loop only runs once over
+        the union of candidates.
+        '''
+        shared = Counter()
+        for interest in self.interests.get(user_id, ()):
+            shared.update(self._posting(self.by_interest, interest))
+        mutual = Counter()
+        for friend_id in self.friends.get(user_id, ()):
+            friends_of_friend = self.friends.get(friend_id, ())
+            if len(friends_of_friend) <= self.max_posting:
+                mutual.update(friends_of_friend)
+        same_institution = set(
+            self._posting(self.by_institution, self.institution.get(user_id)))
+        same_major = set(self._posting(self.by_major,
+                                       self.major.get(user_id)))
+
+        candidates = (shared.keys() | mutual.keys() | same_institution
+                      | same_major)
+        candidates -= self.connected.get(user_id, set())
+        candidates.discard(user_id)
+        # Mutual friends may be private; they are only suggested when also
+        # reachable through the public indexes
+        candidates &= self.public
+
+        def total(candidate_id) -> float:
+            return (weights['mutual_friends'] * mutual[candidate_id] +
+                    weights['shared_interests'] * shared[candidate_id] +
+                    weights['same_institution'] *
+                    (candidate_id in same_institution) +
+                    weights['same_major'] * (candidate_id in same_major))
+
+        now = datetime.now()
+        return [{
+            'user_id': user_id,
+            'candidate_id': candidate_id,
+            'score': total(candidate_id),
+            'mutual_friends': mutual[candidate_id],
+            'shared_interests': shared[candidate_id],
+            'same_institution': candidate_id in same_institution,
+            'same_major': candidate_id in same_major,
+            'created_at': now,
+        } for candidate_id in heapq.nlargest(
+            limit, candidates, key=lambda c: (total(c), c))]
+
+
+class SuggestionEngine:
+    '''
+    Precomputes "people you may know" for every user on a background
+    thread: a full rebuild every `SUGGESTIONS_INTERVAL` seconds, and every
+    `SUGGESTIONS_REFRESH` seconds a rebuild of just the users whose
+    interests or friendships changed since. Requests only read the stored
+    results, through `suggestion_cache`.
+    '''
+
+    def __init__(self):
+        self.app = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('SUGGESTIONS_BACKGROUND', True)
+        app.config.setdefault('SUGGESTIONS_INTERVAL', 6 * 60 * 60)
+        app.config.setdefault('SUGGESTIONS_REFRESH', 60)
+        app.config.setdefault('SUGGESTIONS_PER_USER', 50)
+        app.config.setdefault('SUGGESTIONS_MAX_POSTING', 5000)
+        app.config.setdefault('SUGGESTIONS_BATCH_SIZE', 500)
+        app.config.setdefault('SUGGESTIONS_WEIGHTS', DEFAULT_WEIGHTS)
+        app.config.setdefault('SUGGESTIONS_CACHE_SIZE', 4096)
+        app.config.setdefault('SUGGESTIONS_CACHE_TTL', 3600)
+        suggestion_cache.maxsize = app.config['SUGGESTIONS_CACHE_SIZE']
+        suggestion_cache.ttl = app.config['SUGGESTIONS_CACHE_TTL']
+        self.app = app
+        app.cli.add_command(suggestions_cli)
+        # The thread is started by the first request rather than here, so
+        # CLI commands (`flask db upgrade`, `flask data ...`) never run it
+        app.before_request(self._start)
+
+    def _start(self):
+        if ((self._thread is not None and self._thread.is_alive())
+                or not self.app.config['SUGGESTIONS_BACKGROUND']):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='suggestions',
+                                                daemon=True)
+                self._thread.start()
+
+    def get(self, user_id) -> list:
+        '''
+        Returns `user_id`'s stored suggestions as
+        `(candidate_id, score, reasons)`, best first.
+        '''
+        suggestions = suggestion_cache.get(user_id)
+        if suggestions is None:
+            suggestions = FriendSuggestion.for_user(
+                user_id, self.app.config['SUGGESTIONS_PER_USER'])
+            suggestion_cache.set(user_id, suggestions)
+        return suggestions
+
+    def rebuild(self, user_ids=None, log=None) -> int:
+        '''
+        Recomputes the suggestions of `user_ids`, or of every user, and
+        replaces their stored rows in batches. Returns the number of users
+        rebuilt.
+        '''
+        config = self.app.config
+        weights = {**DEFAULT_WEIGHTS, **config['SUGGESTIONS_WEIGHTS']}
+        index = SuggestionIndex(config['SUGGESTIONS_MAX_POSTING']).load()
+        if user_ids is None:
+            user_ids = list(index.interests)
+        else:
+            user_ids = [user_id for user_id in user_ids
+                        if user_id in index.interests]
+
+        batch_size = config['SUGGESTIONS_BATCH_SIZE']
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            rows = []
+            for user_id in batch:
+                rows.extend(
+                    index.score(user_id, weights,
+                                config['SUGGESTIONS_PER_USER']))
+            FriendSuggestion.query.filter(
+                FriendSuggestion.user_id.in_(batch)).delete(
+                    synchronize_session=False)
+            db.session.bulk_insert_mappings(FriendSuggestion, rows)
+            db.session.commit()
+            for user_id in batch:
+                suggestion_cache.delete(user_id)
+            if log:
+                log(f'[+] Rebuilt suggestions for '
+                    f'{start + len(batch)}/{len(user_ids)} users')
+        return len(user_ids)
+
+    def _run(self):
+        last_full = None
+        while True:
+            time.sleep(self.app.config['SUGGESTIONS_REFRESH'])
+            with self.app.app_context():
+                stale = set()
+                try:
+                    now = time.monotonic()
+                    if (last_full is None or now - last_full >=
+                            self.app.config['SUGGESTIONS_INTERVAL']):
+                        pop_stale_suggestions()
+                        self.rebuild()
+                        last_full = now
+                    else:
+                        stale = pop_stale_suggestions()
+                        if stale:
+                            self.rebuild(sorted(stale))
+                except Exception as e:
+                    db.session.rollback()
+                    # Retried on the next pass
+                    invalidate_suggestions(*stale)
+                    log_error('Failed to rebuild friend suggestions',
+                              error=repr(e))
+
+
+suggestions_cli = AppGroup('suggestions', help='Friend suggestion commands.')
+
+
+@suggestions_cli.command('rebuild')
+@click.option('--user-id', 'user_ids', multiple=True, type=int,
+              help='Only rebuild these users; may be repeated.')
+def rebuild_command(user_ids):
+    '''Recomputes friend suggestions.'''
+    engine.rebuild(list(user_ids) or None, log=print)
+
+
+engine = SuggestionEngine()
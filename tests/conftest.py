@@ -0,0 +1,140 @@
+import os
+
+import pytest
+from flask import Flask
+
+import metrics
+import search
+import serialization
+from cache import (auth_cache, pop_stale_suggestions,
+                   suggestion_cache)
+from compression import compressor
+from database import configure_database, db, init_unit_of_work
+from logs import Logger
+from passwords import hasher
+from storage.Media import media
+from storage.Processing import images
+from suggestions import engine as suggestions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'correct horse'
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    '''
+    The app as `app.py` wires it, on a scratch database and media root.
+    `api.Meetings` is left out: it needs the VideoSDK keys in the untracked
+    `app_secrets` module.
+    '''
+    from api.Authorization import auth_ep
+    from api.Feed import feed_ep
+    from api.Media import media_ep
+    from api.Post import post_ep
+    from api.Search import search_ep
+    from api.User import user_ep
+
+    workdir = tmp_path_factory.mktemp('app')
+    app = Flask('app', root_path=ROOT)
+    app.config.update(
+        TESTING=True,
+        SECRET_KEY='test secret key, long enough for HS256',
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{workdir / "database.sqlite"}',
+        DATABASE_PROFILE='production',
+        # Cheap hashes; tests that need a rehash raise it
+        BCRYPT_ROUNDS=4,
+        LOG_DIR=str(workdir / 'logs'),
+        ALLOWED_EXTENSIONS={'png', 'jpg', 'jpeg', 'gif'},
+        MAX_CONTENT_LENGTH=16 * 1024 * 1024,
+        MEDIA_ROOT=str(workdir / 'media'),
+        MEDIA_STAGING=str(workdir / 'media_staging'),
+        IMAGE_PROCESSING=False,
+        SUGGESTIONS_BACKGROUND=False,
+        PAGE_DEFAULT_LIMIT=20,
+        PAGE_MAX_LIMIT=100,
+        COMMENT_PREVIEW_SIZE=3,
+    )
+    configure_database(app)
+    db.init_app(app)
+    hasher.init_app(app)
+    serialization.init_app(app)
+    metrics.init_app(app)
+    compressor.init_app(app)
+    Logger.init_app(app)
+    media.init_app(app)
+    images.init_app(app)
+    search.init_app(app)
+    suggestions.init_app(app)
+    init_unit_of_work(app)
+    for blueprint in (auth_ep, user_ep, post_ep, feed_ep, media_ep,
+                      search_ep):
+        app.register_blueprint(blueprint)
+
+    with app.app_context():
+        db.create_all()
+        search.create_indexes()
+    return app
+
+
+@pytest.fixture(autouse=True)
+def clean(app):
+    '''Every test starts from empty tables and caches.'''
+    yield
+    with app.app_context():
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+    auth_cache.clear()
+    suggestion_cache.clear()
+    pop_stale_suggestions()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    '''
+    Logs in and returns `(user_id, headers)`, the headers carrying the new
+    bearer token.
+    '''
+
+    def login(email, password=PASSWORD):
+        response = client.post('/api/auth/login',
+                               json={
+                                   'email': email,
+                                   'password': password
+                               })
+        assert response.status_code == 200, response.json
+        headers = {'Authorization': f'Bearer {response.json["token"]}'}
+        user = client.get('/api/user/me', headers=headers).json
+        return user['id'], headers
+
+    return login
+
+
+@pytest.fixture
+def register(client, login):
+    '''Registers a user named `handle` and logs them in, as `login`.'''
+
+    def register(handle, **fields):
+        data = {
+            'email': f'{handle}@example.com',
+            'password': PASSWORD,
+            'first_name': handle,
+            'last_name': 'test',
+            'education_level': 'bachelor',
+            'profile_type': 'student',
+            'handle': handle,
+            **fields,
+        }
+        response = client.post('/api/auth/register', json=data)
+        assert response.status_code == 201, response.json
+        return login(data['email'])
+
+    return register
+
@@ -0,0 +1,53 @@
+from cache import auth_cache
+from database import UserAccount
+from passwords import get_rounds, hasher
+
+
+def cached_for(user_id) -> list:
+    '''The cached snapshots of `user_id`.'''
+    return [
+        user for cached_id, _, user in
+        (value for _, value in list(auth_cache._data.values()))
+        if cached_id == user_id
+    ]
+
+
+def test_requests_are_served_from_the_cache(client, register):
+    user_id, headers = register('alice')
+    assert len(cached_for(user_id)) == 1
+    assert client.get('/api/user/me', headers=headers).status_code == 200
+    assert len(cached_for(user_id)) == 1
+
+
+def test_update_invalidates_the_cached_user(client, register):
+    user_id, headers = register('alice')
+    response = client.post('/api/user/update',
+                           json={'bio': 'hello'},
+                           headers=headers)
+    assert response.status_code == 200
+    assert cached_for(user_id) == []
+    assert client.get('/api/user/me', headers=headers).json['bio'] == 'hello'
+
+
+def test_rehash_on_login_invalidates_the_cached_user(app, register, login,
+                                                     monkeypatch):
+    user_id, _ = register('alice')
+    old_hash = cached_for(user_id)[0].password_hash
+
+    monkeypatch.setattr(hasher, 'rounds', hasher.rounds + 1)
+    login('alice@example.com')
+
+    with app.app_context():
+        new_hash = UserAccount.query.get(user_id).password_hash
+    assert get_rounds(new_hash) == hasher.rounds
+    # The second login cached a fresh snapshot; the stale one is gone
+    assert [user.password_hash
+            for user in cached_for(user_id)] == [new_hash]
+    assert new_hash != old_hash
+
+
+def test_deleted_user_token_is_rejected(client, register):
+    user_id, headers = register('alice')
+    assert client.delete('/api/user/delete', headers=headers).status_code == 200
+    assert cached_for(user_id) == []
+    assert client.get('/api/user/me', headers=headers).status_code == 401
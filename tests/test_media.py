@@ -0,0 +1,87 @@
+import io
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from database import MediaBlob, unit_of_work
+from storage.Media import InvalidMedia, media
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def upload(content: bytes = b'pixels') -> FileStorage:
+    return FileStorage(io.BytesIO(PNG_SIGNATURE + content), 'image.png')
+
+
+def ref_count(key) -> int or None:
+    blob = MediaBlob.query.get(key)
+    if blob is not None:
+        MediaBlob.query.session.refresh(blob)
+    return blob.ref_count if blob else None
+
+
+@pytest.fixture
+def request_context(app):
+    with app.test_request_context():
+        yield
+
+
+def test_identical_uploads_share_one_blob(request_context):
+    key = media.acquire(upload())
+    assert media.acquire(upload()) == key
+    assert ref_count(key) == 2
+    assert media.backend.exists(key)
+
+    media.release(key)
+    assert ref_count(key) == 1
+    assert media.backend.exists(key)
+
+    media.release(key)
+    assert ref_count(key) is None
+    assert not media.backend.exists(key)
+
+
+def test_rejects_files_that_are_not_images(request_context):
+    with pytest.raises(InvalidMedia):
+        media.acquire(FileStorage(io.BytesIO(b'not an image'), 'a.png'))
+
+
+def test_reference_taken_by_a_failed_unit_is_released(request_context):
+    key = media.acquire(upload())
+    with pytest.raises(RuntimeError):
+        with unit_of_work():
+            assert media.acquire(upload()) == key
+            raise RuntimeError
+    assert ref_count(key) == 1
+
+    with pytest.raises(RuntimeError):
+        with unit_of_work():
+            other = media.acquire(upload(b'other pixels'))
+            raise RuntimeError
+    assert ref_count(other) is None
+    assert not media.backend.exists(other)
+
+
+def test_staging_is_outside_the_media_root(app):
+    root = media.backend.root
+    assert os.path.commonpath([root, media.backend.staging_dir]) != root
+
+
+def test_avatar_change_releases_the_old_avatar(app, client, register):
+    _, headers = register('alice')
+    first = client.post('/api/user/set-avatar',
+                        data={'file': (io.BytesIO(PNG_SIGNATURE + b'1'),
+                                       'a.png')},
+                        headers=headers)
+    assert first.status_code == 201
+    client.post('/api/user/set-avatar',
+                data={'file': (io.BytesIO(PNG_SIGNATURE + b'2'), 'b.png')},
+                headers=headers)
+
+    with app.app_context():
+        assert MediaBlob.query.count() == 1
+
+    client.post('/api/user/delete-avatar', headers=headers)
+    with app.app_context():
+        assert MediaBlob.query.count() == 0
@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+
+from api.Pagination import PaginationError, decode_cursor, encode_cursor
+
+
+def create_posts(client, headers, count):
+    for i in range(count):
+        response = client.post('/api/user/post/',
+                               data={'content': f'post {i}'},
+                               headers=headers)
+        assert response.status_code == 201
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 17, 9, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+
+
+@pytest.mark.parametrize('token', ['zz', 'bm90IGpzb24', 'WyJ4Il0'])
+def test_invalid_cursor(token):
+    with pytest.raises(PaginationError):
+        decode_cursor(token)
+
+
+def test_pages_cover_every_post_once(client, register):
+    _, headers = register('alice')
+    create_posts(client, headers, 7)
+
+    seen = []
+    cursor = None
+    while True:
+        url = '/api/user/post/?limit=3' + (f'&cursor={cursor}'
+                                           if cursor else '')
+        page = client.get(url, headers=headers).json
+        assert len(page['posts']) <= 3
+        seen.extend(post['content'] for post in page['posts'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert seen == [f'post {i}' for i in reversed(range(7))]
+
+
+def test_cursor_is_stable_across_inserts(client, register):
+    _, headers = register('alice')
+    create_posts(client, headers, 4)
+    first = client.get('/api/user/post/?limit=2', headers=headers).json
+
+    # New posts go before the cursor and do not shift the next page
+    create_posts(client, headers, 2)
+    second = client.get(
+        f'/api/user/post/?limit=2&cursor={first["next_cursor"]}',
+        headers=headers).json
+
+    assert [post['content'] for post in second['posts']] == [
+        'post 1', 'post 0'
+    ]
+    assert second['next_cursor'] is None
+
+
+@pytest.mark.parametrize('query', ['cursor=zz', 'limit=0', 'limit=x'])
+def test_bad_page_parameters(client, register, query):
+    _, headers = register('alice')
+    response = client.get(f'/api/user/post/?{query}', headers=headers)
+    assert response.status_code == 400
@@ -0,0 +1,90 @@
+from database import PostComment, PostLike, PostModel, db
+
+
+def create_post(client, headers, content='hello'):
+    response = client.post('/api/user/post/',
+                           data={'content': content},
+                           headers=headers)
+    assert response.status_code == 201
+    return response.json['post']['id']
+
+
+def get_post(client, headers, post_id):
+    return client.get(f'/api/user/post/by-post/{post_id}',
+                      headers=headers).json['post']
+
+
+def stored_counts(app, post_id):
+    with app.app_context():
+        post = PostModel.query.get(post_id)
+        return (post.like_count, post.comment_count,
+                PostLike.query.filter_by(post_id=post_id).count(),
+                PostComment.query.filter_by(post_id=post_id).count())
+
+
+def test_like_and_unlike_are_idempotent(app, client, register):
+    _, alice = register('alice')
+    _, bob = register('bob')
+    post_id = create_post(client, alice)
+
+    like = client.post(f'/api/user/post/{post_id}/like', headers=alice)
+    assert like.json['post']['like_count'] == 1
+    again = client.post(f'/api/user/post/{post_id}/like', headers=alice)
+    assert again.json['post']['like_count'] == 1
+    client.post(f'/api/user/post/{post_id}/like', headers=bob)
+
+    post = get_post(client, alice, post_id)
+    assert (post['like_count'], post['liked']) == (2, True)
+    assert stored_counts(app, post_id)[::2] == (2, 2)
+
+    unlike = client.post(f'/api/user/post/{post_id}/unlike', headers=alice)
+    assert unlike.json['post']['like_count'] == 1
+    again = client.post(f'/api/user/post/{post_id}/unlike', headers=alice)
+    assert again.json['post']['like_count'] == 1
+    assert get_post(client, alice, post_id)['liked'] is False
+    assert stored_counts(app, post_id)[::2] == (1, 1)
+
+
+def test_comment_count_matches_comments(app, client, register):
+    _, alice = register('alice')
+    _, bob = register('bob')
+    post_id = create_post(client, alice)
+
+    for i in range(5):
+        response = client.post(f'/api/user/post/{post_id}/comment',
+                               json={'content': f'comment {i}'},
+                               headers=bob if i % 2 else alice)
+        assert response.status_code == 201
+
+    assert get_post(client, alice, post_id)['comment_count'] == 5
+    assert stored_counts(app, post_id)[1::2] == (5, 5)
+
+    page = client.get(f'/api/user/post/{post_id}/comments?limit=3',
+                      headers=alice).json
+    rest = client.get(
+        f'/api/user/post/{post_id}/comments?limit=3'
+        f'&cursor={page["next_cursor"]}',
+        headers=alice).json
+    assert len(page['comments']) + len(rest['comments']) == 5
+
+
+def test_deleting_a_user_fixes_counts_on_other_posts(app, client, register):
+    _, alice = register('alice')
+    _, bob = register('bob')
+    post_id = create_post(client, bob)
+    create_post(client, alice)
+    client.post(f'/api/user/post/{post_id}/like', headers=alice)
+    client.post(f'/api/user/post/{post_id}/like', headers=bob)
+    for _ in range(2):
+        client.post(f'/api/user/post/{post_id}/comment',
+                    json={'content': 'hi'},
+                    headers=alice)
+
+    assert client.delete('/api/user/delete', headers=alice).status_code == 200
+
+    assert stored_counts(app, post_id) == (1, 0, 1, 0)
+    feed = client.get('/api/user/feed', headers=bob).json['posts']
+    assert [post['id'] for post in feed] == [post_id]
+    with app.app_context():
+        assert PostModel.query.count() == 1
+        assert db.session.query(PostComment).count() == 0
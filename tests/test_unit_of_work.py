@@ -0,0 +1,110 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from database import (UserAccount, after_commit, after_rollback, commit, db,
+                      rollback, unit_of_work)
+
+
+def new_user(handle) -> UserAccount:
+    user = UserAccount(first_name=handle,
+                       last_name='test',
+                       handle=handle,
+                       email=f'{handle}@example.com',
+                       password_hash='x',
+                       education_level='Bachelor',
+                       account_type='Student')
+    user.created_at = user.updated_at = datetime.now()
+    db.session.add(user)
+    return user
+
+
+def committed_handles() -> list:
+    '''Handles visible outside the current session's transaction.'''
+    with db.engine.connect() as connection:
+        return sorted(
+            handle for handle, in connection.execute(
+                UserAccount.__table__.select().with_only_columns(
+                    UserAccount.handle)))
+
+
+def test_commits_once_at_the_end(app):
+    events = []
+    with app.app_context():
+        with unit_of_work():
+            new_user('alice')
+            commit()
+            after_commit(events.append, 'committed')
+            after_rollback(events.append, 'rolled back')
+            # Flushed, so it has an id, but not yet committed
+            assert UserAccount.query.filter_by(handle='alice').one().id
+            assert committed_handles() == []
+            assert events == []
+        assert committed_handles() == ['alice']
+    assert events == ['committed']
+
+
+def test_exception_rolls_back(app):
+    events = []
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            with unit_of_work():
+                new_user('alice')
+                commit()
+                after_commit(events.append, 'committed')
+                after_rollback(events.append, 'rolled back')
+                raise RuntimeError
+        assert committed_handles() == []
+    assert events == ['rolled back']
+
+
+def test_nested_units_join_the_outer_one(app):
+    with app.app_context():
+        with unit_of_work():
+            with unit_of_work():
+                new_user('alice')
+                commit()
+            assert committed_handles() == []
+        assert committed_handles() == ['alice']
+
+
+def test_failed_commit_runs_rollback_callbacks(app):
+    events = []
+    with app.app_context():
+        new_user('alice')
+        db.session.commit()
+        with pytest.raises(IntegrityError):
+            with unit_of_work():
+                after_rollback(events.append, 'rolled back')
+                after_commit(events.append, 'committed')
+                # Duplicate handle and email, caught at commit
+                new_user('alice')
+        assert committed_handles() == ['alice']
+    assert events == ['rolled back']
+
+
+def test_rollback_keeps_the_unit_open(app):
+    events = []
+    with app.app_context():
+        with unit_of_work():
+            new_user('alice')
+            after_commit(events.append, 'dropped')
+            after_rollback(events.append, 'rolled back')
+            rollback()
+            assert events == ['rolled back']
+            new_user('bob')
+            after_commit(events.append, 'committed')
+        assert committed_handles() == ['bob']
+    assert events == ['rolled back', 'committed']
+
+
+def test_outside_a_unit_commit_is_immediate(app):
+    events = []
+    with app.app_context():
+        new_user('alice')
+        commit()
+        after_commit(events.append, 'committed')
+        after_rollback(events.append, 'never')
+        assert committed_handles() == ['alice']
+    assert events == ['committed']
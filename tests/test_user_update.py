@@ -0,0 +1,85 @@
+import json
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from database import UserAccount
+
+
+def update(client, headers, **data):
+    return client.post('/api/user/update', json=data, headers=headers)
+
+
+def test_handle_is_stored_lower_cased(client, register):
+    _, headers = register('alice')
+    response = update(client, headers, handle='  Alicia ')
+    assert response.status_code == 200
+    assert response.json['user']['handle'] == 'alicia'
+
+
+@pytest.mark.parametrize('handle', ['bob', 'BOB', ' bob '])
+def test_handle_taken_by_another_user(client, register, handle):
+    register('bob')
+    _, headers = register('alice')
+    response = update(client, headers, handle=handle)
+    assert response.status_code == 400
+    assert response.json['error'] == 'Handle already in use'
+
+
+def test_keeping_your_own_handle(client, register):
+    _, headers = register('alice')
+    assert update(client, headers, handle='ALICE').status_code == 200
+
+
+@pytest.mark.parametrize('handle', ['', '   ', None])
+def test_blank_handle(client, register, handle):
+    _, headers = register('alice')
+    response = update(client, headers, handle=handle)
+    assert response.status_code == 400
+    assert client.get('/api/user/me', headers=headers).json['handle'] == 'alice'
+
+
+def test_handle_taken_concurrently(app, client, register, monkeypatch):
+    user_id, headers = register('alice')
+
+    def update_racing(self, data):
+        raise IntegrityError('UPDATE user_account', {}, Exception('UNIQUE'))
+
+    monkeypatch.setattr(UserAccount, 'update', update_racing)
+    response = update(client, headers, handle='carol', bio='lost')
+    assert response.status_code == 400
+    assert response.json['error'] == 'Handle already in use'
+
+    monkeypatch.undo()
+    with app.app_context():
+        assert UserAccount.query.get(user_id).handle == 'alice'
+    # The session was rolled back, so the next request works
+    assert update(client, headers, bio='kept').status_code == 200
+
+
+@pytest.mark.parametrize('interests', [['chess', 'go'], '["chess", "go"]'])
+def test_valid_interests(client, register, interests):
+    _, headers = register('alice')
+    response = update(client, headers, interests=interests)
+    assert response.status_code == 200
+    me = client.get('/api/user/me', headers=headers).json
+    # Serialised as the stored JSON text
+    assert json.loads(me['interests']) == ['chess', 'go']
+
+
+@pytest.mark.parametrize('interests',
+                         ['chess', '{"a": 1}', [1, 2], {'a': 1}, 3])
+def test_invalid_interests(client, register, interests):
+    _, headers = register('alice')
+    response = update(client, headers, interests=interests)
+    assert response.status_code == 400
+    assert response.json['error'] == 'Interests must be a JSON list'
+
+
+def test_cannot_promote_yourself(client, register):
+    _, headers = register('alice')
+    response = update(client, headers, account_type='admin', id=999)
+    assert response.status_code == 200
+    user = response.json['user']
+    assert user['account_type'] != 'admin'
+    assert user['id'] != 999
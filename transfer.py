@@ -0,0 +1,432 @@
+'''
+Bulk user import and streaming exports, run through the Flask CLI:
+
+    flask data import-users users.ndjson --rejects rejects.ndjson
+    flask data import-users staff.csv --batch-size 2000 --workers 8
+    flask data export users users.csv
+    flask data export posts - > posts.ndjson
+
+Imports validate each row, hash passwords on a process pool while the
+next batch is being validated, check handle / email conflicts once per
+batch and insert each batch in one transaction. Exports read in keyset
+batches, so neither side ever holds a whole table in memory.
+'''
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import bcrypt
+import click
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError
+
+from database import PostComment, PostModel, UserAccount, db
+from passwords import hasher
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+REQUIRED_FIELDS = ('email', 'handle', 'first_name', 'last_name',
+                   'education_level', 'account_type')
+OPTIONAL_FIELDS = ('occupation', 'location', 'bio', 'website', 'interests',
+                   'privacy_setting', 'education_major',
+                   'education_institution', 'organization_name',
+                   'years_in_business')
+PRIVACY_SETTINGS = ('public', 'friends', 'private')
+
+# Columns written per export, in order
+EXPORTS = {
+    'users': (UserAccount, ('id', 'handle', 'email', 'first_name',
+                            'last_name', 'education_level', 'account_type',
+                            *OPTIONAL_FIELDS, 'friend_count', 'created_at',
+                            'updated_at')),
+    'posts': (PostModel, ('id', 'owner_id', 'content', 'location',
+                          'image_uri', 'like_count', 'comment_count',
+                          'created_at')),
+    'comments': (PostComment, ('id', 'post_id', 'owner_id', 'content',
+                               'created_at')),
+}
+
+
+class InvalidRow(ValueError):
+    '''Raised for an import row that cannot be inserted.'''
+
+
+def detect_format(path: str, fmt: str = None) -> str:
+    '''`fmt` if given, else `csv` for `.csv` files and `ndjson` otherwise.'''
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def chunked(iterable, size: int):
+    '''Yields lists of up to `size` items from `iterable`.'''
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def read_rows(stream, fmt: str):
+    '''
+    Yields `(line, row)` for each record of an NDJSON or CSV stream. Lines
+    that are not valid JSON objects are yielded as `InvalidRow`s.
+    '''
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {
+                key: value
+                for key, value in row.items() if key and value != ''
+            }
+        return
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            yield line, InvalidRow(f'Invalid JSON: {e}')
+            continue
+        if not isinstance(row, dict):
+            yield line, InvalidRow('Expected a JSON object')
+            continue
+        yield line, row
+
+
+def _column_length(name: str) -> int or None:
+    return getattr(UserAccount.__table__.c[name].type, 'length', None)
+
+
+def _parse_interests(value) -> str:
+    if isinstance(value, list):
+        return UserAccount.encode_interests(value)
+    value = str(value).strip()
+    if value.startswith('['):
+        return UserAccount.encode_interests(UserAccount.parse_interests(value))
+    # Plain CSV cells: "chess; hiking"
+    return UserAccount.encode_interests(value.replace(';', ',').split(','))
+
+
+def validate_user(row: dict) -> dict:
+    '''
+    Checks and normalizes one import row the way registration does, and
+    returns the `user_account` mapping to insert. The plain password, if
+    any, is left under `password` for hashing.
+    '''
+    row = dict(row)
+    # Registration calls it `profile_type`
+    if 'account_type' not in row and 'profile_type' in row:
+        row['account_type'] = row.pop('profile_type')
+
+    missing = [field for field in REQUIRED_FIELDS if not row.get(field)]
+    if missing:
+        raise InvalidRow(f'Missing {", ".join(missing)}')
+    record = {field: str(row[field]).strip() for field in REQUIRED_FIELDS}
+    record['email'] = record['email'].lower()
+    record['handle'] = record['handle'].lower()
+    for field in ('first_name', 'last_name', 'education_level',
+                  'account_type'):
+        record[field] = record[field].capitalize()
+    if '@' not in record['email']:
+        raise InvalidRow('Invalid email')
+
+    for field in OPTIONAL_FIELDS:
+        if row.get(field) is None:
+            continue
+        if field == 'interests':
+            record[field] = _parse_interests(row[field])
+        else:
+            record[field] = str(row[field]).strip()
+    if record.get('privacy_setting', 'public') not in PRIVACY_SETTINGS:
+        raise InvalidRow('Invalid privacy_setting')
+
+    for field, value in record.items():
+        length = _column_length(field)
+        if length and len(value) > length:
+            raise InvalidRow(f'{field} is longer than {length} characters')
+
+    if row.get('password'):
+        record['password'] = str(row['password'])
+    elif str(row.get('password_hash', '')).startswith('$2'):
+        # Already a bcrypt hash, e.g. from another deployment
+        record['password_hash'] = str(row['password_hash']).encode('utf-8')
+    else:
+        raise InvalidRow('Missing password')
+
+    now = datetime.now()
+    try:
+        record['created_at'] = (datetime.strptime(row['created_at'],
+                                                  DATE_FORMAT)
+                                if row.get('created_at') else now)
+    except (TypeError, ValueError):
+        raise InvalidRow('Invalid created_at')
+    record['updated_at'] = now
+    return record
+
+
+def hash_passwords(passwords: list, rounds: int) -> list:
+    '''Hashes `passwords` with bcrypt. Runs in a worker process.'''
+    return [
+        bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+        for password in passwords
+    ]
+
+
+def find_conflicts(records: list) -> tuple:
+    '''Returns the emails and handles of `records` already in use.'''
+    emails = {
+        email
+        for email, in db.session.query(UserAccount.email).filter(
+            UserAccount.email.in_([record['email'] for record in records]))
+    }
+    handles = {
+        handle
+        for handle, in db.session.query(UserAccount.handle).filter(
+            UserAccount.handle.in_([record['handle']
+                                    for record in records]))
+    }
+    return emails, handles
+
+
+class UserImport:
+    '''
+    Streams user rows into `user_account`. Rejected rows are passed to
+    `reject(line, error, row)`; counts are kept in `stats`.
+    '''
+
+    def __init__(self, batch_size=1000, workers=None, dry_run=False,
+                 reject=None, log=print):
+        self.batch_size = max(1, batch_size)
+        self.workers = workers or os.cpu_count() or 1
+        self.dry_run = dry_run
+        self.reject = reject or (lambda line, error, row: None)
+        self.log = log
+        self.stats = {'read': 0, 'imported': 0, 'rejected': 0}
+        self._emails = set()
+        self._handles = set()
+
+    def _reject(self, line, error, row):
+        self.stats['rejected'] += 1
+        self.reject(line, str(error), row)
+
+    def _prepare(self, batch: list) -> list:
+        '''Validates a batch and drops rows conflicting with earlier ones.'''
+        valid = []
+        for line, row in batch:
+            self.stats['read'] += 1
+            if isinstance(row, InvalidRow):
+                self._reject(line, row, None)
+                continue
+            try:
+                record = validate_user(row)
+            except InvalidRow as e:
+                self._reject(line, e, row)
+                continue
+            if record['email'] in self._emails:
+                self._reject(line, 'Duplicate email in import', row)
+            elif record['handle'] in self._handles:
+                self._reject(line, 'Duplicate handle in import', row)
+            else:
+                self._emails.add(record['email'])
+                self._handles.add(record['handle'])
+                valid.append((line, row, record))
+        if not valid:
+            return valid
+
+        emails, handles = find_conflicts([record for _, _, record in valid])
+        prepared = []
+        for line, row, record in valid:
+            if record['email'] in emails:
+                self._reject(line, 'Email already in use', row)
+            elif record['handle'] in handles:
+                self._reject(line, 'Handle already in use', row)
+            else:
+                prepared.append((line, row, record))
+        return prepared
+
+    def _submit(self, pool, prepared: list) -> list:
+        '''Starts hashing the plain passwords of a batch on the pool.'''
+        if self.dry_run:
+            return []
+        passwords = [
+            record['password'] for _, _, record in prepared
+            if 'password' in record
+        ]
+        size = max(1, -(-len(passwords) // self.workers))
+        return [
+            pool.submit(hash_passwords, chunk, hasher.rounds)
+            for chunk in chunked(passwords, size)
+        ]
+
+    def _insert(self, prepared: list, futures: list) -> None:
+        if self.dry_run:
+            self.stats['imported'] += len(prepared)
+            return
+        hashes = iter([h for future in futures for h in future.result()])
+        records = []
+        for _, _, record in prepared:
+            record = dict(record)
+            if 'password' in record:
+                del record['password']
+                record['password_hash'] = next(hashes)
+            records.append(record)
+        try:
+            db.session.bulk_insert_mappings(UserAccount, records)
+            db.session.commit()
+        except IntegrityError:
+            # Someone registered a handle or email since the batch was
+            # checked; reject those and insert the rest.
+            db.session.rollback()
+            emails, handles = find_conflicts(records)
+            kept = []
+            for (line, row, _), record in zip(prepared, records):
+                if record['email'] in emails or record['handle'] in handles:
+                    self._reject(line, 'Email or handle already in use', row)
+                else:
+                    kept.append(record)
+            db.session.bulk_insert_mappings(UserAccount, kept)
+            db.session.commit()
+            records = kept
+        self.stats['imported'] += len(records)
+
+    def run(self, rows) -> dict:
+        '''Imports `rows` of `(line, row)`, returning `stats`.'''
+        pending = None
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for batch in chunked(rows, self.batch_size):
+                prepared = self._prepare(batch)
+                current = (prepared, self._submit(pool, prepared))
+                # The previous batch is inserted while this one hashes
+                if pending:
+                    self._insert(*pending)
+                    self.log(f'[+] Imported {self.stats["imported"]} users, '
+                             f'rejected {self.stats["rejected"]}')
+                pending = current
+            if pending:
+                self._insert(*pending)
+        return self.stats
+
+
+def export_rows(kind: str, batch_size: int = 1000,
+                include_password_hashes: bool = False):
+    '''
+    Yields one dict per row of `kind` (`users`, `posts` or `comments`) in id
+    order, reading `batch_size` rows per query.
+    '''
+    model, fields = EXPORTS[kind]
+    if include_password_hashes and kind == 'users':
+        fields = fields + ('password_hash', )
+    columns = [getattr(model, field) for field in fields]
+    last_id = 0
+    while True:
+        rows = db.session.query(*columns).filter(
+            model.id > last_id).order_by(model.id).limit(batch_size).all()
+        if not rows:
+            return
+        for row in rows:
+            yield dict(zip(fields, row))
+        last_id = rows[-1][0]
+
+
+def _export_value(field, value, fmt):
+    if isinstance(value, datetime):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if field == 'interests' and fmt == 'ndjson':
+        return UserAccount.parse_interests(value)
+    return value
+
+
+def write_export(kind: str, stream, fmt: str, batch_size: int = 1000,
+                 include_password_hashes: bool = False) -> int:
+    '''Writes every row of `kind` to `stream`. Returns the row count.'''
+    fields = EXPORTS[kind][1]
+    if include_password_hashes and kind == 'users':
+        fields = fields + ('password_hash', )
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=fields)
+        writer.writeheader()
+    count = 0
+    for row in export_rows(kind, batch_size, include_password_hashes):
+        row = {
+            field: _export_value(field, value, fmt)
+            for field, value in row.items()
+        }
+        if writer:
+            writer.writerow(row)
+        else:
+            stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+data_cli = AppGroup('data', help='Bulk import and export commands.')
+
+
+@data_cli.command('import-users')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']),
+              help='Defaults to the file extension, else ndjson.')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--workers', type=int,
+              help='Password hashing processes; defaults to the CPU count.')
+@click.option('--rejects', type=click.File('w', encoding='utf-8'),
+              help='Write rejected rows here as NDJSON.')
+@click.option('--dry-run', is_flag=True,
+              help='Validate and check conflicts without inserting.')
+def import_users_command(source, fmt, batch_size, workers, rejects,
+                         dry_run):
+    '''Imports users from an NDJSON or CSV file ("-" for stdin).'''
+    errors = []
+
+    def reject(line, error, row):
+        if row:
+            row = {k: v for k, v in row.items() if k != 'password'}
+        if rejects:
+            rejects.write(
+                json.dumps({'line': line, 'error': error, 'row': row},
+                           ensure_ascii=False, default=str) + '\n')
+        elif len(errors) < 20:
+            errors.append(f'[!] Line {line}: {error}')
+
+    def log(message):
+        click.echo(message, err=True)
+
+    importer = UserImport(batch_size, workers, dry_run, reject, log)
+    stats = importer.run(read_rows(source, detect_format(source.name, fmt)))
+    for error in errors:
+        log(error)
+    log(f'[+] Read {stats["read"]} rows: '
+        f'{"would import" if dry_run else "imported"} {stats["imported"]}, '
+        f'rejected {stats["rejected"]}')
+    if stats['rejected']:
+        sys.exit(1)
+
+
+@data_cli.command('export')
+@click.argument('kind', type=click.Choice(list(EXPORTS)))
+@click.argument('output', type=click.File('w', encoding='utf-8'),
+                default='-')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']),
+              help='Defaults to the file extension, else ndjson.')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--include-password-hashes', is_flag=True,
+              help='Include bcrypt hashes, for importing elsewhere.')
+def export_command(kind, output, fmt, batch_size, include_password_hashes):
+    '''Exports users, posts or comments to a file ("-" for stdout).'''
+    count = write_export(kind, output, detect_format(output.name, fmt),
+                         batch_size, include_password_hashes)
+    click.echo(f'[+] Exported {count} {kind}', err=True)
+
+
+def init_app(app):
+    app.cli.add_command(data_cli)